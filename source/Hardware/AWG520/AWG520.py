@@ -17,12 +17,14 @@
 # and is still being worked on to make it complete with the new pulse sequences introduced by Gurudev Dutt
 
 from ftplib import FTP
-import socket,sys, struct,os
+import socket,sys, struct,os, itertools
 import numpy as np
 from pathlib import Path
 import logging
 # from Pulse import Gaussian,Sech,Square,Marker
 from .Sequence import Sequence, SequenceList
+from .Cache import SequenceCache
+from .Rasterizer import MarkerEdges
 import time
 from source.common.utils import log_with, create_logger,get_project_root
 
@@ -44,8 +46,14 @@ _DAC_UPPER = 1024.0 # DAC has only 1024 levels
 _DAC_MID = 512
 _WFM_MEMORY_LIMIT = 1048512 # at most this many points can be in a waveform
 _SEQ_MEMORY_LIMIT = 8000
+_WFM_MIN_LENGTH = 256 # shortest waveform that can be played in a sequence line
+_MAX_REPEAT = 65536 # largest repeat count of a sequence line
+_IDLE_LENGTH = 1024 # length of the shared waveforms that idle segments are played with
+_MIN_IDLE_REPEAT = 4 # idle segments shorter than this many idle waveforms are left in the active waveforms
+_MIN_TRAIN_REPEAT = 2 # pulse trains that repeat fewer times than this are left in the active waveforms
 _IQTYPE = np.dtype('<f4') # AWG520 stores analog values as 4 bytes in little-endian format
 _MARKTYPE = np.dtype('<i1') # AWG520 stores marker values as 1 byte
+_WFM_RECORD = np.dtype([('iq', _IQTYPE), ('marker', _MARKTYPE)])  # one 5 byte point of a wfm file, same as '<fb'
 # unit conversion factors
 _GHz = 1.0e9  # Gigahertz
 _MHz = 1.0e6  # Megahertz
@@ -461,28 +469,28 @@ class AWGFile(object):
         return trailer
 
     def binarymaker(self,iqdata,marker):
-        '''This function makes binary strings to write to the wfm file from the I/Q data and marker data'''
+        '''This function makes the records to write to the wfm file from the I/Q data and marker data. The marker data
+        can be an array or the runs of a MarkerEdges, which are expanded straight into the records. The records are
+        returned as an array of the packed '<fb' records, which can be written to the file as it is.'''
         try:
             wfmlen = len(iqdata)
             #### Major issue discovered on 2021-02-10: wfmlen needs to be divisible by 4
-            while wfmlen%4 != 0:
-                iqdata = np.append(iqdata,0.0)
-                marker = np.append(marker,int(0))
-                wfmlen+=1
+            padded = wfmlen + (-wfmlen) % 4
             #print('wfm length is {0:d} and marker len is {1:d}'.format(len(iqdata),len(marker)))
-            if wfmlen >= _WFM_MEMORY_LIMIT:
+            if padded >= _WFM_MEMORY_LIMIT:
                 raise ValueError('Waveform memory limit exceeded')
                 #TODO: perhaps i should implement rewrite the data using a smaller clock rate
             elif wfmlen == len(marker):
-                # analog I/Q data converted to 4 byte float, marker to 1 byte , both little-endian
-                record = struct.pack('<fb', iqdata[0], marker[0])
-                i = 1
-                recordsize = struct.calcsize('<fb')
-                numbytes = wfmlen * recordsize
+                # analog I/Q data converted to 4 byte float, marker to 1 byte , both little-endian, the padding is 0
                 t = time.process_time()
-                while (i < wfmlen):
-                    record += struct.pack('<fb', iqdata[i], marker[i])
-                    i += 1
+                record = np.zeros(padded, dtype=_WFM_RECORD)
+                record['iq'][:wfmlen] = iqdata
+                if isinstance(marker, MarkerEdges):
+                    marker.expand(out=record['marker'][:wfmlen])
+                else:
+                    record['marker'][:wfmlen] = marker
+                recordsize = _WFM_RECORD.itemsize
+                numbytes = padded * recordsize
                 elapsed_time = time.process_time() - t
                 self.logger.info("Elapsed time in creating binary record is {0:6f} secs".format(elapsed_time))
                 return (numbytes, recordsize, record)
@@ -494,11 +502,12 @@ class AWGFile(object):
             return (None,None,None)
 
 
-    def write_waveform(self, sequence:Sequence=None, wavename='0', channelnum=1):
+    def write_waveform(self, sequence:Sequence=None, wavename='0', channelnum=1, start=0, stop=None):
         '''This function writes a new waveform file. the args are:
             sequence: an object of type sequence which has already been created with the data
             wavename: str describing the type of wfm, usually just a number
             channelnum: which channel to use for I/Q and the marker
+            start, stop: optional range of samples of the sequence to write, by default all of them
         '''
 
         try:
@@ -507,25 +516,22 @@ class AWGFile(object):
                 raise ValueError("Invalid sequence or no sequence object given")
             else:
                 #sequence.create_sequence() # removed this since we assume data has already been created in sequence obj
+                # the marker runs are only expanded into the records of the file
                 if channelnum == 1:
-                    markerdata = sequence.c1markerdata
+                    markerdata = sequence.c1markers
                     wavedata = sequence.wavedata[0]
                 elif channelnum == 2:
-                    markerdata = sequence.c2markerdata
+                    markerdata = sequence.c2markers
                     wavedata = sequence.wavedata[1]
                 else:
                     raise ValueError("channel number can only be 1 or 2")
+                if stop is None:
+                    stop = len(markerdata)
+                if start != 0 or stop != len(markerdata):
+                    markerdata = markerdata.slice(start, stop)
+                    wavedata = wavedata[start:stop]
                 fname = str(wavename)+'_'+str(channelnum)+str('.wfm')
-                wfmfilename =  Path(self.dirpath / fname)
-                #print(str(wfmfilename))
-                with open(wfmfilename,'wb') as wfile:
-                    wfile.write(self.wfmheader)
-                    nbytes, rsize, record = self.binarymaker(wavedata, markerdata)
-                    # next line converts nbytes to a str, and then finds number of digits in str and writes it to file as a str
-                    nbytestr = '#' + str(len(str(nbytes))) + str(nbytes)
-                    wfile.write(nbytestr.encode())
-                    wfile.write(record)
-                    wfile.write(self.maketrailer())
+                self.write_wfm(fname, wavedata, markerdata)
         except (IOError,ValueError) as error:
             # sys.stderr.write(sys.exc_info())
             # sys.stderr.write(error.message+'\n')
@@ -533,13 +539,138 @@ class AWGFile(object):
             self.logger.error("Error occurred in either file I/O or data provided:{0}".format(error))
             raise
 
-    def write_sequence(self, sequences:SequenceList=None,seqfilename = 'scan.seq', repeat=50000):
+    def write_wfm(self, fname, wavedata, markerdata):
+        '''Writes one wfm file from the analog data of a channel and its marker data, an array or MarkerEdges'''
+        wfmfilename =  Path(self.dirpath / fname)
+        #print(str(wfmfilename))
+        with open(wfmfilename,'wb') as wfile:
+            wfile.write(self.wfmheader)
+            nbytes, rsize, record = self.binarymaker(wavedata, markerdata)
+            # next line converts nbytes to a str, and then finds number of digits in str and writes it to file as a str
+            nbytestr = '#' + str(len(str(nbytes))) + str(nbytes)
+            wfile.write(nbytestr.encode())
+            wfile.write(record)
+            wfile.write(self.maketrailer())
+
+    def write_idle_waveform(self, markerbyte, channelnum):
+        '''Writes the shared waveform that idle segments with a given marker byte are played with, _IDLE_LENGTH
+        samples of 0 with the marker byte set, and returns its file name'''
+        fname = 'idle'+str(markerbyte)+'_'+str(channelnum)+'.wfm'
+        self.write_wfm(fname, np.zeros(_IDLE_LENGTH, dtype=_IQTYPE), MarkerEdges(_IDLE_LENGTH, [0], [markerbyte]))
+        return fname
+
+    def idle_segments(self, sequence:Sequence=None):
+        '''Splits the data of a sequence into active segments, idle segments, in which the I/Q data of both channels is
+        0 and the markers do not change, and train segments, in which a pulse train repeats the same data and markers.
+        An idle segment can be played as the shared idle waveform with the same markers repeated many times, and a train
+        segment as one period of its data repeated, instead of being stored sample by sample. Returns a list of (start,
+        stop, count, markers) of the segments in order, where count is 0 for an active segment and the number of times
+        the waveform is repeated otherwise, and markers is the (channel 1, channel 2) marker byte of an idle segment or
+        None. Every segment but the last starts and stops on a multiple of 4 samples and is at least _WFM_MIN_LENGTH
+        long, so the segments played one after the other give exactly the data of the sequence.
+        '''
+        length = len(sequence.c1markers)
+        active = np.flatnonzero(np.any(sequence.wavedata != 0, axis=0))
+        # the runs of samples where both channels are 0
+        starts = np.concatenate(([0], active + 1))
+        stops = np.concatenate((active, [length]))
+        keep = stops - starts >= _MIN_IDLE_REPEAT * _IDLE_LENGTH
+        # which are split where any marker changes
+        changes = np.union1d(sequence.c1markers.positions, sequence.c2markers.positions)
+        candidates = []  # (start, stop, length of the repeated waveform, fewest repeats, idle)
+        for start, stop in zip(starts[keep], stops[keep]):
+            edges = changes[(changes > start) & (changes < stop)]
+            for a, b in zip(np.concatenate(([start], edges)), np.concatenate((edges, [stop]))):
+                candidates.append((int(a), int(b), _IDLE_LENGTH, _MIN_IDLE_REPEAT, True))
+        for start, period, count in getattr(sequence, 'train_spans', []):
+            span = self.train_span(sequence, start, period, count)
+            if span is not None:
+                candidates.append(span + (_MIN_TRAIN_REPEAT, False))
+        candidates.sort()
+        segments = []
+        cursor = 0  # the end of the last segment
+        for a, b, unit, fewest, idle in candidates:
+            # the data of a span repeats from any sample on, so it can start later like an idle run
+            a = max(a + (-a) % 4, cursor)
+            if 0 < a - cursor < _WFM_MIN_LENGTH:
+                a = cursor + _WFM_MIN_LENGTH  # the active segment before it takes some of the repeated samples
+            count = (b - a) // unit
+            if count < fewest:
+                continue
+            if a > cursor:
+                segments.append((cursor, a, 0, None))
+            markers = (sequence.c1markers.value_at(a), sequence.c2markers.value_at(a)) if idle else None
+            segments.append((a, a + count * unit, count, markers))
+            cursor = a + count * unit
+        if 0 < length - cursor < _WFM_MIN_LENGTH and segments:
+            # the last active segment would be too short, so it takes some of the repeated segment before it
+            a, b, count, markers = segments.pop()
+            unit = (b - a) // count
+            fewer = -(-(_WFM_MIN_LENGTH - (length - cursor)) // unit)
+            cursor = a
+            if count - fewer >= (_MIN_IDLE_REPEAT if markers is not None else _MIN_TRAIN_REPEAT):
+                cursor = b - fewer * unit
+                segments.append((a, cursor, count - fewer, markers))
+        if cursor < length:
+            segments.append((cursor, length, 0, None))
+        merged = []
+        for segment in segments:
+            if merged and segment[2] == 0 and merged[-1][2] == 0:
+                segment = (merged.pop()[0], segment[1], 0, None)  # a repeated segment between them was dropped
+            merged.append(segment)
+        return merged
+
+    def train_span(self, sequence, start, period, count):
+        '''Checks the data of a pulse train of a sequence, see Sequence.train_spans, and returns the
+        (start, stop, period) of the part of it whose I/Q data and markers repeat with a period that can be played as a
+        waveform, i.e. a multiple of 4 samples that is at least _WFM_MIN_LENGTH long, or None if there is no such part.
+        Only the longest run of equal periods is kept, as the first event of a train can be wider and a marker can
+        change during the train.
+        sequence: the sequence
+        start: first sample of the train
+        period: number of samples after which the train repeats
+        count: number of periods
+        '''
+        multiple = 1
+        while (multiple * period) % 4 or multiple * period < _WFM_MIN_LENGTH:
+            multiple += 1
+        period *= multiple
+        # the last period can run past the end of the data, which stops with the last event
+        count = min(count // multiple, (len(sequence.c1markers) - start) // period)
+        if count < _MIN_TRAIN_REPEAT or period > _WFM_MEMORY_LIMIT:
+            return None
+        stop = start + count * period
+        blocks = [sequence.wavedata[:, start:stop].reshape(2, count, period)]
+        for markers in (sequence.c1markers, sequence.c2markers):
+            blocks.append(markers.slice(start, stop).expand().reshape(1, count, period))
+        # the longest run of periods that are each the same as the one before them
+        same = np.ones(count - 1, dtype=bool)
+        for data in blocks:
+            same &= np.all(data[:, 1:, :] == data[:, :-1, :], axis=(0, 2))
+        edges = np.flatnonzero(np.diff(np.concatenate(([False], same, [False])).astype(np.int8)))
+        if len(edges) == 0:
+            return None
+        runs = edges[1::2] - edges[::2]
+        first = int(edges[::2][np.argmax(runs)])
+        repeats = int(runs.max()) + 1
+        if repeats < _MIN_TRAIN_REPEAT:
+            return None
+        return start + first * period, start + (first + repeats) * period, period
+
+    def write_sequence(self, sequences:SequenceList=None,seqfilename = 'scan.seq', repeat=50000,
+                       cache:SequenceCache=None, compress_idle=False):
         '''This function takes in a list of sequences generated by the class SequenceList
         The args are:
         sequencelist: list of sequences generated by the object of type SequenceList
         seqfilename: str with seq file name to be written
         repeat: number of repetitions of each waveform
         timeres: clock rate
+        cache: optional SequenceCache, if it has the files for these sequences they are copied from it instead of
+            being created, otherwise the files that are written are added to it
+        compress_idle: if True, the long stretches of a scan point where the I/Q data is 0 and the markers do not change
+            are played as a short shared idle waveform with a repeat count in the seq file, and so are the periods of a
+            pulse train, see idle_segments. This takes several seq lines per point, and the AWG520 can only repeat a
+            single line, so it is only done when repeat is 1, i.e. when each point is played once per trigger.
 
         It first creates an arm_sequence which is the laser being on and then writes the rest of the sequences that
         are in the sequences object to files.
@@ -549,10 +680,28 @@ class AWGFile(object):
                 self.logger.error("Invalid sequence or no sequence object given")
                 raise ValueError("Invalid sequencelist  or no sequencelist object given")
             else:
-                sequences.create_sequence_list()
-                slist = sequences.sequencelist # list of sequences
-                wfmlen = len(slist[0].c1markerdata) # get the length of the waveform in the first sequence
-                scanlen = len(slist)
+                key = None
+                if cache is not None:
+                    key = cache.key(sequences, seqfilename=seqfilename, repeat=repeat, clock=self.timeres,
+                                    compress_idle=compress_idle)
+                    if key is not None and cache.fetch(key, self.dirpath, sequences):
+                        if sequences.auto_timeres:
+                            self.timeres = sequences.timeres  # the clock rate the cached files were written for
+                        return
+                if sequences.stream:
+                    # the sequences are written as they are created and are not kept, the number of points is known
+                    # once the first one has been created
+                    slist = sequences.iter_sequences()
+                    first = next(slist)
+                    slist = itertools.chain([first], slist)
+                else:
+                    sequences.create_sequence_list()
+                    slist = sequences.sequencelist # list of sequences
+                    first = slist[0]
+                if sequences.auto_timeres:
+                    self.timeres = sequences.timeres  # the clock rate picked for the sequences
+                wfmlen = len(first.c1markers) # get the length of the waveform in the first sequence
+                del first
 
                 # first create an empty waveform in channel 1 and 2 but turn on the green laser
                 # so that measurements can start after a trigger is received.
@@ -563,27 +712,42 @@ class AWGFile(object):
                 arm_sequence.create_sequence()
                 self.write_waveform(arm_sequence,'arm', 1)
                 self.write_waveform(arm_sequence,'arm', 2)
+                if compress_idle and repeat != 1:
+                    self.logger.info('Idle segments are only compressed when each point is played once per trigger')
                 # create scan.seq file
                 try:
+                    files = ['arm_1.wfm', 'arm_2.wfm', seqfilename]
+                    lines = []  # the lines of the scan points, the seq file is written once they are all known
+                    for i, seq in enumerate(slist):
+                        segments = self.idle_segments(seq) if compress_idle and repeat == 1 else []
+                        if len(segments) > 1:
+                            lines += self.write_segments(seq, str(i + 1), segments, files)
+                        else:
+                            # now we take each sequence in the slist arry and write it to a wfm file with the name given by
+                            # "i+1_1.wfm and i+1_2.wfm
+                            self.write_waveform(seq,''+str(i + 1), 1)
+                            self.write_waveform(seq,''+str(i + 1), 2)
+                            files += [str(i + 1) + '_1.wfm', str(i + 1) + '_2.wfm']
+                            # the scan.seq file is now updated to execute those 2 wfms for repeat number of times and wait
+                            # for a trigger to move to the next point.
+                            lines.append(self.seqline(i + 1, repeat))
+                        del seq  # when streaming, this was the last reference to the arrays of this point
+                    if len(lines) + 1 > _SEQ_MEMORY_LIMIT:
+                        raise ValueError('Scan has {0:d} sequence lines, the limit is {1:d}'.format(
+                            len(lines) + 1, _SEQ_MEMORY_LIMIT))
                     fname  = Path(self.dirpath / seqfilename)
                     with open(fname, 'wb') as sfile:
                         sfile.write(self.seqheader)
-                        temp_str = 'LINES ' + str(scanlen + 1) + '\r\n'
+                        temp_str = 'LINES ' + str(len(lines) + 1) + '\r\n'
                         sfile.write(temp_str.encode()) # have to convert to binary format
                         temp_str = '"arm_1.wfm","arm_2.wfm",0,1,0,0\r\n' # the arm sequence will be loaded and will
                         # wait
                         # for trigger
                         sfile.write(temp_str.encode())
-                        for i in list(range(scanlen)):
-                            # now we take each sequence in the slist arry and write it to a wfm file with the name given by
-                            # "i+1_1.wfm and i+1_2.wfm
-                            self.write_waveform(slist[i],''+str(i + 1), 1)
-                            self.write_waveform(slist[i],''+str(i + 1), 2)
-                            # the scan.seq file is now updated to execute those 2 wfms for repeat number of times and wait
-                            # for a trigger to move to the next point.
-                            linestr = '"'+str(i + 1)+'_1.wfm"'+','+'"'+str(i + 1)+'_2.wfm"'+','+str(repeat)+',1,0,0\r\n'
-                            sfile.write(linestr.encode())
+                        sfile.write(b''.join(lines))
                         sfile.write(b'JUMP_MODE SOFTWARE\r\n') # tells the AWG that jump trigger is controlled by the computer.
+                    if key is not None:
+                        cache.store(key, self.dirpath, sequences, files)
                 except (IOError, ValueError) as error:
                     # sys.stderr.write(sys.exc_info())
                     # sys.stderr.write(error.message+'\n')
@@ -598,6 +762,134 @@ class AWGFile(object):
 
 
 
+    def write_segments(self, sequence, wavename, segments, files):
+        '''Writes the wfm files of the active segments of a scan point and of one period of its train segments, and the
+        idle waveforms its idle segments need if they have not been written yet, see idle_segments. Returns the seq
+        lines that play the segments in order, the first of which waits for a trigger.
+        sequence: the sequence of the scan point
+        wavename: str the wfm files are named after, the number of the point
+        segments: the segments returned by idle_segments
+        files: list of the names of the files that have been written, the new files are added to it
+        '''
+        for k, (start, stop, count, markers) in enumerate(segments):
+            names = self.segment_files(wavename, k, markers)
+            if markers is None:
+                # an active segment is played once, a train segment is one period of its data repeated
+                name = wavename + '-' + str(k + 1)
+                stop = start + (stop - start) // max(count, 1)
+                self.write_waveform(sequence, name, 1, start, stop)
+                self.write_waveform(sequence, name, 2, start, stop)
+                files += names
+            else:
+                for c, m, name in zip((1, 2), markers, names):
+                    if name not in files:
+                        files.append(self.write_idle_waveform(m, c))
+        return self.segment_lines(wavename, segments)
+
+    def segment_files(self, wavename, k, markers):
+        '''Returns the names of the channel 1 and 2 wfm files that segment k of a scan point is played with, see
+        write_segments'''
+        if markers is None:
+            name = wavename + '-' + str(k + 1)
+            return [name + '_1.wfm', name + '_2.wfm']
+        return ['idle' + str(m) + '_' + str(c) + '.wfm' for c, m in zip((1, 2), markers)]
+
+    def segment_lines(self, wavename, segments):
+        '''Returns the seq lines that play the segments of a scan point in order, the first of which waits for a
+        trigger. A segment repeated more than _MAX_REPEAT times takes several lines.'''
+        lines = []
+        wait = 1
+        for k, (start, stop, count, markers) in enumerate(segments):
+            names = self.segment_files(wavename, k, markers)
+            count = max(count, 1)
+            while count > 0:
+                lines.append(self.wfmline(names[0], names[1], min(count, _MAX_REPEAT), wait))
+                count -= _MAX_REPEAT
+                wait = 0  # only the first line of the point waits for the trigger
+        return lines
+
+    def wfmline(self, ch1file, ch2file, repeat, wait=1):
+        '''Returns a line of the seq file that plays 2 wfm files repeat times, after waiting for a trigger if wait
+        is 1'''
+        linestr = '"'+ch1file+'"'+','+'"'+ch2file+'"'+','+str(repeat)+','+str(wait)+',0,0\r\n'
+        return linestr.encode()
+
+    def seqline(self, wavenum, repeat):
+        '''Returns the line of the seq file that plays the wfm files of one scan point repeat times and then waits for a
+        trigger'''
+        return self.wfmline(str(wavenum)+'_1.wfm', str(wavenum)+'_2.wfm', repeat)
+
+    def wfm_file_size(self, length):
+        '''Returns the number of samples a waveform of length samples is padded to, and the size in bytes of its wfm
+        file, in the format written by write_waveform'''
+        padded = length + (-length) % 4  # see binarymaker
+        nbytes = padded * struct.calcsize('<fb')
+        nbytestr = '#' + str(len(str(nbytes))) + str(nbytes)
+        return padded, len(self.wfmheader) + len(nbytestr) + nbytes + len(self.maketrailer())
+
+    def preflight(self, sequences:SequenceList=None, seqfilename='scan.seq', repeat=50000, compress_idle=False):
+        '''This function works out what write_sequence would write for a SequenceList, without rendering any
+        waveforms, so that scans that can not be run are found right away. When compress_idle applies, see
+        write_sequence, the points are rendered to find the seq lines of their segments, and the sizes of the wfm files
+        are still those of the whole points. It returns a dict with
+        points: list with a dict for each scan point, see SequenceList.analyze, with the padded length and the size of
+            each of its 2 wfm files added
+        arm length, arm bytes: the padded length and wfm file size of the arm waveform
+        seq bytes: the size of the seq file
+        total bytes: the size of all the files
+        memory: the number of waveform points stored in the AWG by all the files
+        latest event: the latest event of all the scan points
+        errors: list of strings describing why the scan can not be run, empty if it can
+        warnings: list of strings describing overlapping Wave events
+        '''
+        reports = sequences.analyze()
+        if sequences.auto_timeres:
+            self.timeres = sequences.timeres  # the clock rate picked for the sequences
+        errors = []
+        warnings = []
+        total = 0
+        memory = 0
+        lines = [self.seqline(i + 1, repeat) for i in range(len(reports))]
+        if compress_idle and repeat == 1:
+            lines = []
+            for i, seq in enumerate(sequences.iter_sequences()):
+                segments = self.idle_segments(seq)
+                lines += self.segment_lines(str(i + 1), segments) if len(segments) > 1 else [self.seqline(i + 1, 1)]
+                del seq
+        seqbytes = len(self.seqheader) + len(('LINES ' + str(len(lines) + 1) + '\r\n').encode())
+        seqbytes += len(b'"arm_1.wfm","arm_2.wfm",0,1,0,0\r\n') + len(b'JUMP_MODE SOFTWARE\r\n') + len(b''.join(lines))
+        for i, report in enumerate(reports):
+            report['padded length'], report['file bytes'] = self.wfm_file_size(report['length'])
+            total += 2 * report['file bytes']
+            memory += 2 * report['padded length']
+            if report['padded length'] >= _WFM_MEMORY_LIMIT:
+                errors.append('Scan point {0:d} has {1:d} samples, the waveform memory limit is {2:d}'.format(
+                    i + 1, report['padded length'], _WFM_MEMORY_LIMIT))
+            if report['overlaps'].get(_WAVE, 0) > 0:
+                warnings.append('Scan point {0:d} has {1:d} overlapping Wave events'.format(
+                    i + 1, report['overlaps'][_WAVE]))
+        if len(lines) + 1 > _SEQ_MEMORY_LIMIT:
+            errors.append('Scan has {0:d} sequence lines, the limit is {1:d}'.format(len(lines) + 1,
+                                                                                    _SEQ_MEMORY_LIMIT))
+        armlength = 0
+        armbytes = 0
+        if reports:
+            # the arm waveform is as long as the first scan point, see write_sequence
+            arm_sequence = Sequence('Green,0,'+str(reports[0]['length']*self.timeres*_ns),timeres=self.timeres)
+            armlength, armbytes = self.wfm_file_size(arm_sequence.analyze()['length'])
+            total += 2 * armbytes
+            memory += 2 * armlength
+        else:
+            errors.append('Scan has no points')
+        for err in errors:
+            self.logger.error(err)
+        for warning in warnings:
+            self.logger.warning(warning)
+        return {'points': reports, 'arm length': armlength, 'arm bytes': armbytes, 'seq bytes': seqbytes,
+                'total bytes': total + seqbytes, 'memory': memory,
+                'latest event': max([report['latest event'] for report in reports], default=0),
+                'errors': errors, 'warnings': warnings}
+
     def setwaveform(self, wavenum, wavedata,markerdata):
         pass
 
@@ -0,0 +1,179 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+# The sequence cache keeps the wfm and seq files written for a SequenceList on disk, in a directory named by a hash of
+# everything that goes into them (sequence text, pulse and scan parameters, delays, clock rate, connections, RB seed,
+# sideband mode, pulse types and the code that compiles them). Uploading the same experiment again then only copies the
+# files instead of compiling every scan point. The least recently used entries are deleted once the cache grows past its
+# size limit.
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+from pathlib import Path
+from source.Hardware.AWG520.Sequence import pulseshapedir, _WAVE_PULSES
+from source.Hardware.AWG520.Pulse import _SIDECAR_SUFFIX
+from source.common.utils import get_project_root
+
+sourcedir = get_project_root()
+cachedirpath = sourcedir / 'Hardware/AWG520/sequencecache/'
+_CACHE_LIMIT = 2 * 1024 ** 3  # default size limit of the cache in bytes
+_CACHE_VERSION = 1  # change this when the layout of the cache entries changes
+_INFO_FILE = 'info.pkl'  # the scan info of the SequenceList in each entry
+# the modules whose code decides the contents of the files, a change to any of them invalidates the cache
+_CODE_FILES = ['Sequence.py', 'Pulse.py', 'Events.py', 'Rasterizer.py', 'AWG520.py']
+_code_digest = None
+
+
+def code_digest():
+    """Returns a hash of the code that compiles the sequences, computed once per process"""
+    global _code_digest
+    if _code_digest is None:
+        h = hashlib.sha256()
+        for name in _CODE_FILES:
+            h.update((Path(__file__).parent / name).read_bytes())
+        _code_digest = h.hexdigest()
+    return _code_digest
+
+
+class SequenceCache(object):
+    """On-disk cache of the files written for a SequenceList
+    :param dirpath: directory that holds the cache entries, one sub-directory per entry
+    :param max_bytes: the least recently used entries are deleted when the cache is larger than this
+    """
+
+    def __init__(self, dirpath=cachedirpath, max_bytes=_CACHE_LIMIT):
+        self.dirpath = Path(dirpath)
+        self.max_bytes = max_bytes
+        self.logger = logging.getLogger('seqlogger.cache')
+        self.dirpath.mkdir(parents=True, exist_ok=True)
+
+    def key(self, sequences, **kwargs):
+        """Returns the key of the files written for a SequenceList, or None if they can not be cached, which is the
+        case for a random scan without an RB seed since its gates are different every time, and for a list with a
+        waveform store since the points have to be created to fill it.
+        :param sequences: the SequenceList
+        :param kwargs: anything else that changes the files, e.g. the seq file name and the repeat count
+        """
+        if sequences.scanparams['type'] == 'random scan' and sequences.rb_seed is None:
+            return None
+        if sequences.store is not None:
+            return None
+        spec = {'version': _CACHE_VERSION, 'code': code_digest(), 'sequence': sequences.sequence,
+                'pulseparams': sequences.pulseparams, 'scanparams': sequences.scanparams,
+                'delay': sequences.delay, 'timeres': sequences.timeres,
+                'connectiondict': sequences.connectiondict, 'rb_seed': sequences.rb_seed,
+                'compseqnum': sequences.comp_seq_num, 'paulirandnum': sequences.pauli_rand_num,
+                'auto_timeres': sequences.auto_timeres, 'envelope_tolerance': sequences.envelope_tolerance,
+                'coherent_sideband': sequences.coherent_sideband, 'pulse_types': self.pulse_types(),
+                'files': self.pulse_files(sequences.sequence), 'extra': kwargs}
+        text = json.dumps(spec, sort_keys=True, default=repr)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def pulse_types(self):
+        """Returns the pulse class of each Wave pulse type, which includes the shapes added with register_pulse"""
+        return sorted((name, pulsecls.__module__, pulsecls.__qualname__, shaped)
+                      for name, (pulsecls, shaped) in _WAVE_PULSES.items())
+
+    def pulse_files(self, seqtext):
+        """Returns the name, size and modification time of the files that arbitrary pulse shapes are loaded from"""
+        if 'Load Wfm' not in str(seqtext) or not pulseshapedir.exists():
+            return []
+        return sorted((p.name, p.stat().st_size, p.stat().st_mtime_ns) for p in pulseshapedir.iterdir()
+                      if p.is_file() and not p.name.endswith(_SIDECAR_SUFFIX))  # sidecars are written by the loader
+
+    def fetch(self, key, dirpath, sequences):
+        """Copies the files of a cache entry to a directory and restores the scan info and clock rate of the
+        SequenceList. Returns True if the entry was found.
+        :param key: key of the entry
+        :param dirpath: the directory to copy the files to
+        :param sequences: the SequenceList whose scan info is restored
+        """
+        entry = self.dirpath / key
+        try:
+            with open(entry / _INFO_FILE, 'rb') as f:
+                info = pickle.load(f)
+            timeres = info['timeres']
+            for name in info['files']:
+                shutil.copyfile(entry / name, Path(dirpath) / name)
+        except FileNotFoundError:
+            return False
+        except (IOError, OSError, pickle.UnpicklingError, KeyError, EOFError) as err:
+            self.logger.warning('Deleting unreadable cache entry {0}: {1}'.format(key, err))
+            shutil.rmtree(entry, ignore_errors=True)
+            return False
+        os.utime(entry)  # the modification time of an entry is when it was last used
+        sequences.points = info['points']
+        sequences.rbinfo_list = info['rbinfo_list']
+        sequences.rbscanlengths = info['rbscanlengths']
+        sequences.timeres = timeres  # the clock rate the files were written for, which auto_timeres may have picked
+        self.logger.info('Using cached sequence files {0}'.format(key))
+        return True
+
+    def store(self, key, dirpath, sequences, files):
+        """Copies the files written for a SequenceList into a new cache entry, then evicts old entries if needed
+        :param key: key of the entry
+        :param dirpath: the directory the files were written to
+        :param sequences: the SequenceList whose scan info is stored with the files
+        :param files: names of the files in dirpath
+        """
+        # the entry is assembled in a temporary directory and renamed, so that a partial entry is never seen
+        tmpdir = tempfile.mkdtemp(prefix='.tmp', dir=self.dirpath)
+        try:
+            for name in files:
+                shutil.copyfile(Path(dirpath) / name, Path(tmpdir) / name)
+            info = {'files': list(files), 'points': list(sequences.points),
+                    'rbinfo_list': sequences.rbinfo_list, 'rbscanlengths': sequences.rbscanlengths,
+                    'timeres': sequences.timeres}
+            with open(Path(tmpdir) / _INFO_FILE, 'wb') as f:
+                pickle.dump(info, f)
+            os.rename(tmpdir, self.dirpath / key)
+        except (IOError, OSError) as err:
+            self.logger.warning('Could not store sequence files in the cache: {0}'.format(err))
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            return
+        self.evict()
+
+    def entries(self):
+        """Returns a list of (last used time, size in bytes, path) of the cache entries"""
+        entries = []
+        for entry in self.dirpath.iterdir():
+            if entry.is_dir() and not entry.name.startswith('.'):
+                size = sum(f.stat().st_size for f in entry.iterdir())
+                entries.append((entry.stat().st_mtime, size, entry))
+        return entries
+
+    def size(self):
+        """Returns the total size of the cache entries in bytes"""
+        return sum(size for used, size, entry in self.entries())
+
+    def evict(self):
+        """Deletes the least recently used entries until the cache is no larger than max_bytes"""
+        entries = sorted(self.entries(), key=lambda e: e[0])
+        total = sum(size for used, size, entry in entries)
+        for used, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            self.logger.info('Evicted {0} from the sequence cache'.format(entry.name))
+
+    def clear(self):
+        """Deletes all the entries"""
+        for used, size, entry in self.entries():
+            shutil.rmtree(entry, ignore_errors=True)
@@ -0,0 +1,488 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+# The event table stores all the events of a sequence in one numpy structured array, one row per event, instead of one
+# python object per event. Channels only keep the row numbers of their events, and the analog data of the events is
+# kept once per distinct envelope in a list that the rows refer to by index.
+# All times in the table are integer ticks of TICK seconds, so that converting them to sample indices is exact integer
+# arithmetic and the start, stop and duration indices of an event always agree with each other.
+
+import numpy as np
+import logging
+import bisect
+
+_IDXTYPE = np.dtype('<i8')  # sample indices and ticks
+TICK = 1.0e-12  # seconds per tick of the integer time base
+_TICKS_PER_SECOND = 1.0e12
+
+# one row of the event table
+EVENT_DTYPE = np.dtype([('start', _IDXTYPE),  # start time in ticks
+                        ('stop', _IDXTYPE),  # stop time in ticks
+                        ('duration', _IDXTYPE),  # duration in ticks, can be longer than stop - start for shaped pulses
+                        ('start_increment', '<f8'),  # multiplier of the time increment for the start time
+                        ('stop_increment', '<f8'),  # multiplier of the time increment for the stop time
+                        ('t1_idx', _IDXTYPE),  # start time in units of the sampletime
+                        ('t2_idx', _IDXTYPE),  # stop time in units of the sampletime
+                        ('type', '<i2'),  # code of the pulse type, see EventTable.type_names
+                        ('envelope', '<i4'),  # index of the I/Q data in EventTable.envelopes, -1 if none
+                        ('train', '<i4')])  # index of the pulse train in EventTable.trains, -1 if none
+# position of some fields in a row read as a tuple
+_START, _STOP, _T1 = (EVENT_DTYPE.names.index(field) for field in ('start', 'stop', 't1_idx'))
+
+
+def to_ticks(seconds):
+    """Converts a time in seconds to the nearest integer number of ticks. Any time that is a whole number of
+    picoseconds, such as the times typed in a sequence, converts exactly.
+    :param seconds: a number or an array of numbers
+    """
+    if isinstance(seconds, (float, int, np.number)):
+        return int(round(float(seconds) / TICK))
+    return np.rint(np.asarray(seconds, dtype=np.float64) / TICK).astype(_IDXTYPE)
+
+
+def from_ticks(ticks):
+    """Converts ticks back to seconds, giving the same float as the time typed in seconds
+    :param ticks: integer number or array of ticks
+    """
+    return ticks / _TICKS_PER_SECOND
+
+
+def ticks_to_samples(ticks, ticks_per_sample):
+    """Converts ticks to sample indices, rounding half way values to the even index like round() does.
+    :param ticks: integer number or array of ticks
+    :param ticks_per_sample: number of ticks in one sample
+    """
+    if isinstance(ticks, (int, np.integer)):
+        quotient, remainder = divmod(int(ticks), int(ticks_per_sample))
+        twice = 2 * remainder
+        return quotient + int(twice > ticks_per_sample or (twice == ticks_per_sample and quotient % 2 == 1))
+    quotient, remainder = np.divmod(ticks, ticks_per_sample)
+    twice = 2 * remainder
+    up = (twice > ticks_per_sample) | ((twice == ticks_per_sample) & (quotient % 2 == 1))
+    return quotient + up
+
+
+class EventTable(object):
+    """Stores the events of a sequence as rows of a structured array.
+    :param sampletime: the sampling time (clock rate) in seconds used to convert the times to indices
+    :param capacity: number of rows allocated initially, the table grows as needed
+    """
+
+    def __init__(self, sampletime=1.0e-9, capacity=64):
+        self.logger = logging.getLogger('seqlogger.events')
+        self.sampletime = float(sampletime)
+        self.ticks_per_sample = to_ticks(sampletime)
+        self.__rows = np.zeros(max(int(capacity), 1), dtype=EVENT_DTYPE)
+        self.size = 0  # number of rows in use
+        self.type_names = []  # name of the pulse type of each type code
+        self.__type_codes = {}
+        self.envelopes = []  # I/Q data of the analog events, each distinct array is stored once
+        self.__envelope_ids = {}
+        self.trains = []  # (first row, number of events, pattern length) of each pulse train, see add_train
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def events(self):
+        """The rows of the table that are in use"""
+        return self.__rows[:self.size]
+
+    def type_code(self, name):
+        """Returns the code of a pulse type, adding the type if it has not been seen yet
+        :param name: name of the pulse type, e.g. Gauss or Green
+        """
+        if name not in self.__type_codes:
+            self.__type_codes[name] = len(self.type_names)
+            self.type_names.append(name)
+        return self.__type_codes[name]
+
+    def envelope_id(self, data):
+        """Returns the index of an envelope in the list of envelopes, adding it if needed. The same array used by many
+        events, e.g. from the envelope cache, is only stored once.
+        :param data: 2 x N array with the I and Q data, or None for events without data
+        """
+        if data is None:
+            return -1
+        key = id(data)  # the list keeps the array alive, so its id is not reused while the table exists
+        if key not in self.__envelope_ids:
+            self.__envelope_ids[key] = len(self.envelopes)
+            self.envelopes.append(data)
+        return self.__envelope_ids[key]
+
+    def append(self, start, stop, duration=None, start_increment=0.0, stop_increment=0.0, pulse_type='',
+               data=None):
+        """Adds one event to the table and returns its row number
+        :param start: start time in ticks
+        :param stop: stop time in ticks
+        :param duration: duration in ticks, defaults to stop - start
+        :param start_increment: multiplier of the time increment for the start time
+        :param stop_increment: multiplier of the time increment for the stop time
+        :param pulse_type: name of the pulse type
+        :param data: I and Q data of the event
+        """
+        if self.size == len(self.__rows):
+            self.__rows = np.concatenate((self.__rows, np.zeros(len(self.__rows), dtype=EVENT_DTYPE)))
+        if duration is None:
+            duration = stop - start
+        row = self.size
+        self.__rows[row] = (start, stop, duration, start_increment, stop_increment,
+                            ticks_to_samples(start, self.ticks_per_sample),
+                            ticks_to_samples(stop, self.ticks_per_sample), self.type_code(pulse_type),
+                            self.envelope_id(data), -1)
+        self.size += 1
+        return row
+
+    def append_train(self, start, stop, count, period, duration=None, start_increment=0.0, stop_increment=0.0,
+                     pulse_type='', data=None):
+        """Adds count events that repeat every period ticks to the table in one go, and returns their row numbers as a
+        range. The rows are filled in with array operations, so a long train costs about as much to add as one event.
+        :param start: start time in ticks of the first event
+        :param stop: stop time in ticks of the first event
+        :param count: number of events
+        :param period: time in ticks from the start of one event to the start of the next
+        :param duration: duration in ticks of every event, defaults to stop - start
+        :param start_increment: multiplier of the time increment for the start times
+        :param stop_increment: multiplier of the time increment for the stop times
+        :param pulse_type: name of the pulse type
+        :param data: list of the I and Q data of the events, which is used for the events in turn, e.g. one array per
+                phase of a phase cycle, or None for events without data
+        """
+        count = int(count)
+        if self.size + count > len(self.__rows):
+            grown = max(len(self.__rows), self.size + count - len(self.__rows))
+            self.__rows = np.concatenate((self.__rows, np.zeros(grown, dtype=EVENT_DTYPE)))
+        if duration is None:
+            duration = stop - start
+        rows = range(self.size, self.size + count)
+        evts = self.__rows[self.size:self.size + count]
+        shifts = np.arange(count, dtype=_IDXTYPE) * int(period)
+        evts['start'] = start + shifts
+        evts['stop'] = stop + shifts
+        evts['duration'] = duration
+        evts['start_increment'] = start_increment
+        evts['stop_increment'] = stop_increment
+        evts['t1_idx'] = ticks_to_samples(evts['start'], self.ticks_per_sample)
+        evts['t2_idx'] = ticks_to_samples(evts['stop'], self.ticks_per_sample)
+        evts['type'] = self.type_code(pulse_type)
+        if data is None:
+            evts['envelope'] = -1
+        else:
+            eids = np.array([self.envelope_id(env) for env in data], dtype=np.int32)
+            evts['envelope'] = np.resize(eids, count)  # the envelopes are repeated in turn
+        evts['train'] = -1
+        self.size += count
+        return rows
+
+    def append_rows(self, rows, type_names):
+        """Copies rows taken from another table, e.g. the events of a channel kept from the sequence of an earlier scan
+        point, to the end of this table and returns their row numbers as a range. Only rows without I/Q data can be
+        copied, and the copies are not part of any pulse train.
+        :param rows: structured array of rows
+        :param type_names: the names of the pulse types of the table the rows were taken from, see self.type_names
+        """
+        count = len(rows)
+        if self.size + count > len(self.__rows):
+            grown = max(len(self.__rows), self.size + count - len(self.__rows))
+            self.__rows = np.concatenate((self.__rows, np.zeros(grown, dtype=EVENT_DTYPE)))
+        evts = self.__rows[self.size:self.size + count]
+        evts[...] = rows
+        codes = np.array([self.type_code(name) for name in type_names], dtype=EVENT_DTYPE['type'])
+        if count > 0:
+            evts['type'] = codes[rows['type']]
+        evts['envelope'] = -1
+        evts['train'] = -1
+        self.size += count
+        return range(self.size - count, self.size)
+
+    def add_train(self, first, count, pattern=1):
+        """Marks consecutive rows as the events of one pulse train, so that they can be rendered by tiling the output
+        and written as repeated waveforms, and returns the index of the train in self.trains.
+        :param first: row of the first event of the train
+        :param count: number of events in the train
+        :param pattern: number of events after which the envelopes of the train repeat, e.g. the length of its phase
+                cycle
+        """
+        self.trains.append((int(first), int(count), int(pattern)))
+        self.__rows['train'][first:first + count] = len(self.trains) - 1
+        return len(self.trains) - 1
+
+    def append_event(self, evt):
+        """Copies a :class:`SequenceEvent <source.Hardware.AWG520.Sequence.SequenceEvent>` object into the table
+        and returns its row number. Marker events are rendered from their start and stop times, so their data is not
+        kept."""
+        data = None if evt.event_type == 'Marker' else evt.data
+        return self.append(to_ticks(evt.start), to_ticks(evt.stop), duration=to_ticks(evt.duration),
+                           start_increment=evt.start_increment, stop_increment=evt.stop_increment,
+                           pulse_type=getattr(evt, 'pulse_type', evt.event_type), data=data)
+
+    def update_indices(self, rows):
+        """Recomputes the sample indices of some rows after their times have changed.
+        :param rows: row number or array of row numbers
+        """
+        evts = self.__rows
+        evts['t1_idx'][rows] = ticks_to_samples(evts['start'][rows], self.ticks_per_sample)
+        evts['t2_idx'][rows] = ticks_to_samples(evts['stop'][rows], self.ticks_per_sample)
+
+    def increment_time(self, rows, dt=0.0):
+        """Increments the start and stop times of some rows by dt times their increment multipliers
+        :param rows: row number or array of row numbers
+        :param dt: the time increment in seconds
+        """
+        evts = self.__rows
+        dt = to_ticks(dt)
+        evts['start'][rows] += np.rint(dt * evts['start_increment'][rows]).astype(_IDXTYPE)
+        evts['stop'][rows] += np.rint(dt * evts['stop_increment'][rows]).astype(_IDXTYPE)
+        self.update_indices(rows)
+
+    def shift(self, rows, dt=0):
+        """Moves the start and stop times of some rows by dt, regardless of their increment multipliers
+        :param rows: row number or array of row numbers
+        :param dt: the time shift in ticks, or an array of the shift of each row
+        """
+        evts = self.__rows
+        evts['start'][rows] += np.asarray(dt, dtype=_IDXTYPE)
+        evts['stop'][rows] += np.asarray(dt, dtype=_IDXTYPE)
+        self.update_indices(rows)
+
+    def data(self, row):
+        """Returns the I and Q data of a row, or None if it has none"""
+        eid = self.__rows['envelope'][row]
+        if eid < 0:
+            return None
+        return self.envelopes[eid]
+
+
+class EventView(object):
+    """Object interface to one row of an :class:`EventTable`, with the same attributes as a
+    :class:`SequenceEvent <source.Hardware.AWG520.Sequence.SequenceEvent>`. Changing the attributes changes the row.
+    :param table: the event table
+    :param row: the row number
+    """
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    def __get(self, field):
+        return self.table.events[field][self.row].item()
+
+    def __set(self, field, var):
+        self.table.events[field][self.row] = var
+        self.table.update_indices(self.row)
+
+    @property
+    def eventidx(self):
+        return self.row
+
+    @property
+    def event_type(self):
+        return self.table.type_names[self.__get('type')]
+
+    pulse_type = event_type
+
+    @property
+    def start(self):
+        return from_ticks(self.__get('start'))
+
+    @start.setter
+    def start(self, var):
+        self.__set('start', to_ticks(var))
+
+    @property
+    def stop(self):
+        return from_ticks(self.__get('stop'))
+
+    @stop.setter
+    def stop(self, var):
+        self.__set('stop', to_ticks(var))
+
+    @property
+    def duration(self):
+        return from_ticks(self.__get('duration'))
+
+    @duration.setter
+    def duration(self, var):
+        self.__set('duration', to_ticks(var))
+
+    @property
+    def start_increment(self):
+        return self.__get('start_increment')
+
+    @start_increment.setter
+    def start_increment(self, var):
+        self.__set('start_increment', float(var))
+
+    @property
+    def stop_increment(self):
+        return self.__get('stop_increment')
+
+    @stop_increment.setter
+    def stop_increment(self, var):
+        self.__set('stop_increment', float(var))
+
+    @property
+    def sampletime(self):
+        return self.table.sampletime
+
+    @property
+    def t1_idx(self):
+        return self.__get('t1_idx')
+
+    @property
+    def t2_idx(self):
+        return self.__get('t2_idx')
+
+    @property
+    def dur_idx(self):
+        return ticks_to_samples(self.__get('duration'), self.table.ticks_per_sample)
+
+    @property
+    def data(self):
+        return self.table.data(self.row)
+
+    def increment_time(self, dt: float = 0):
+        """Increments the start and stop times by dt.
+        :param dt: The time increment.
+        """
+        self.table.increment_time(self.row, dt)
+
+
+class EventIndex(object):
+    """Keeps some rows of an :class:`EventTable`, e.g. the events of one channel, sorted by their start and stop times
+    so that the extents of the events can be read in O(1), new events are inserted with a binary search, and the
+    events in a window of time are found without looking at all of them. It also keeps count of the events that start
+    on the same sample as the event before them.
+    :param table: the event table
+    :param rows: rows to put in the index
+    """
+
+    def __init__(self, table, rows=()):
+        self.table = table
+        self.rebuild(rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def rebuild(self, rows):
+        """Puts a new set of rows in the index, e.g. after their times have been changed
+        :param rows: row numbers
+        """
+        rows = np.asarray(rows, dtype=_IDXTYPE)
+        evts = self.table.events
+        order = np.argsort(evts['start'][rows], kind='stable')
+        self.rows = rows[order].tolist()  # rows in the order of their start times
+        self.starts = evts['start'][self.rows].tolist()  # sorted start ticks
+        self.t1 = evts['t1_idx'][self.rows].tolist()  # start indices in the same order
+        self.stops = np.sort(evts['stop'][rows]).tolist()  # sorted stop ticks
+        durations = evts['stop'][rows] - evts['start'][rows]
+        self.max_duration = int(np.amax(durations)) if len(rows) > 0 else 0  # longest event, for window queries
+        self.coincidences = int(np.count_nonzero(np.diff(self.t1) == 0)) if len(rows) > 1 else 0
+
+    def insert(self, row):
+        """Adds a row to the index
+        :param row: row number
+        """
+        evt = self.table.events.item(row)  # a tuple is much quicker to read than a numpy record
+        start, stop, t1 = evt[_START], evt[_STOP], evt[_T1]
+        if not self.starts or start >= self.starts[-1]:
+            pos = len(self.starts)  # events are mostly added in order
+        else:
+            # events with the same start stay in the order they were added
+            pos = bisect.bisect_right(self.starts, start)
+        before = self.t1[pos - 1] if pos > 0 else None
+        after = self.t1[pos] if pos < len(self.t1) else None
+        self.coincidences += (t1 == before) + (t1 == after) - (before is not None and before == after)
+        self.starts.insert(pos, start)
+        self.t1.insert(pos, t1)
+        self.rows.insert(pos, row)
+        if not self.stops or stop >= self.stops[-1]:
+            self.stops.append(stop)
+        else:
+            bisect.insort(self.stops, stop)
+        self.max_duration = max(self.max_duration, stop - start)
+
+    def extend(self, rows):
+        """Adds many rows to the index, e.g. the events of a pulse train. Rows that start after all the rows in the
+        index, in order, are appended in one go, otherwise the index is rebuilt.
+        :param rows: row numbers
+        """
+        if len(rows) == 0:
+            return
+        evts = self.table.events
+        rows = np.asarray(rows, dtype=_IDXTYPE)
+        starts = evts['start'][rows]
+        if (self.starts and starts[0] < self.starts[-1]) or np.any(np.diff(starts) < 0):
+            self.rebuild(self.rows + rows.tolist())
+            return
+        t1 = evts['t1_idx'][rows]
+        stops = evts['stop'][rows]
+        self.coincidences += int(np.count_nonzero(np.diff(t1) == 0)) + bool(self.t1 and self.t1[-1] == t1[0])
+        self.starts.extend(starts.tolist())
+        self.t1.extend(t1.tolist())
+        self.rows.extend(rows.tolist())
+        if (self.stops and stops[0] < self.stops[-1]) or np.any(np.diff(stops) < 0):
+            self.stops = sorted(self.stops + stops.tolist())
+        else:
+            self.stops.extend(stops.tolist())
+        self.max_duration = max(self.max_duration, int(np.amax(stops - starts)))
+
+    def remove(self, row):
+        """Removes a row from the index
+        :param row: row number
+        """
+        pos = self.rows.index(row)
+        before = self.t1[pos - 1] if pos > 0 else None
+        after = self.t1[pos + 1] if pos + 1 < len(self.t1) else None
+        t1 = self.t1[pos]
+        self.coincidences -= (t1 == before) + (t1 == after) - (before is not None and before == after)
+        del self.starts[pos], self.t1[pos], self.rows[pos]
+        stop = int(self.table.events['stop'][row])
+        del self.stops[bisect.bisect_left(self.stops, stop)]
+
+    @property
+    def first_start(self):
+        """earliest start time in ticks, None if the index is empty"""
+        return self.starts[0] if self.starts else None
+
+    @property
+    def last_start(self):
+        """latest start time in ticks, None if the index is empty"""
+        return self.starts[-1] if self.starts else None
+
+    @property
+    def last_stop(self):
+        """latest stop time in ticks, None if the index is empty"""
+        return self.stops[-1] if self.stops else None
+
+    def starting_between(self, start, stop):
+        """Returns the rows whose start time lies strictly between start and stop
+        :param start: beginning of the window in ticks
+        :param stop: end of the window in ticks
+        """
+        return self.rows[bisect.bisect_right(self.starts, start):bisect.bisect_left(self.starts, stop)]
+
+    def overlapping(self, start, stop):
+        """Returns the rows of the events that overlap the window from start to stop
+        :param start: beginning of the window in ticks
+        :param stop: end of the window in ticks
+        """
+        lo = bisect.bisect_right(self.starts, start - self.max_duration)
+        hi = bisect.bisect_left(self.starts, stop)
+        evts = self.table.events
+        return [row for row in self.rows[lo:hi] if evts['stop'][row] > start]
+
+    def has_coincident_events(self):
+        """Returns True if two events start on the same sample"""
+        return self.coincidences > 0
@@ -17,8 +17,14 @@
 
 import numpy as np
 import sys
+import os
+import re
 import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
 from scipy.interpolate import interp1d
+from source.Hardware.AWG520.Rasterizer import MarkerEdges, marker_bit
 
 
 _DAC_BITS = 10   # AWG 520 has only 10 bits
@@ -26,10 +32,291 @@ _DAC_UPPER = 1024.0 # DAC has only 1024 levels
 _DAC_MID = 512
 _IQTYPE = np.dtype('<f4') # AWG520 stores analog values as 4 bytes in little-endian format
 _MARKTYPE = np.dtype('<i1') # AWG520 stores marker values as 1 byte
+_ENVELOPE_CACHE_BYTES = 128 * 1024 ** 2  # default memory budget of the envelope cache
+_MODULATION_BLOCK = 65536  # samples whose sideband modulation is worked out at a time
+_RAMP_CACHE_BYTES = 32 * 1024 ** 2  # default memory budget of the phase ramp cache
+_GERONO_TABLE_POINTS = 65537  # samples of the Gerono shape that pulses of any width are resampled from
+_SHAPE_CACHE_BYTES = 64 * 1024 ** 2  # default memory budget of the cache of pulse shape files
+_SIDECAR_SUFFIX = '.npy'  # added to the name of a pulse shape file for the binary copy of its numbers
 
 pulselogger = logging.getLogger('awg520.pulselogger')
 
+
+class EnvelopeCache(object):
+    """A bounded least-recently-used cache of generated pulse data. Identical pulses, e.g. every pulse of a train or
+    the same pulse at every point of a time scan, are generated once and then shared. The arrays handed out are
+    read-only so that one event cannot modify the data shared with others.
+    :param max_bytes: memory budget of the cache, the least recently used entries are evicted beyond it
+    """
+    def __init__(self, max_bytes=_ENVELOPE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0  # memory used by the arrays in the cache
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()  # the upload thread and the app can both create sequences
+
+    def get(self, key, generator):
+        """Returns the data stored under key, calling generator() to create it if it is not in the cache yet
+        :param key: hashable tuple that uniquely describes the pulse
+        :param generator: function with no arguments that returns the data array
+        """
+        with self.__lock:
+            data = self.__entries.get(key)
+            if data is not None:
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return data
+            self.misses += 1
+        data = np.asarray(generator())
+        data.flags.writeable = False
+        with self.__lock:
+            if data.nbytes <= self.max_bytes and key not in self.__entries:
+                self.__entries[key] = data
+                self.nbytes += data.nbytes
+                while self.nbytes > self.max_bytes:
+                    oldkey, olddata = self.__entries.popitem(last=False)
+                    self.nbytes -= olddata.nbytes
+                    self.evictions += 1
+        return data
+
+    def clear(self):
+        """Removes all the entries, the statistics are kept"""
+        with self.__lock:
+            self.__entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """Returns a dictionary with the hit, miss and eviction counts and the memory use of the cache"""
+        with self.__lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self.__entries), 'nbytes': self.nbytes, 'max_bytes': self.max_bytes}
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, key):
+        with self.__lock:
+            return key in self.__entries
+
+
+envelope_cache = EnvelopeCache()  # shared by all the wave events
+
+
+ramp_cache = EnvelopeCache(_RAMP_CACHE_BYTES)  # phase ramps of the sideband modulation
+
+
+shape_file_cache = EnvelopeCache(_SHAPE_CACHE_BYTES)  # parsed pulse shape files and their resampled columns
+
+
+def shape_file_key(filename):
+    """Returns the key of a pulse shape file in the shape file cache, its resolved path, modification time and size,
+    so that a file that is changed is loaded again"""
+    path = Path(filename).resolve()
+    stat = path.stat()
+    return str(path), stat.st_mtime_ns, stat.st_size
+
+
+def shape_sidecar(key):
+    """Returns the path of the .npy sidecar of a pulse shape file, named after the modification time and size of the
+    file, so that a sidecar is only used for the exact file it was parsed from
+    :param key: key of the file returned by shape_file_key
+    """
+    path = Path(key[0])
+    return path.with_name('{0}.{1}-{2}{3}'.format(path.name, key[1], key[2], _SIDECAR_SUFFIX))
+
+
+def load_shape_file(filename):
+    """Returns the numbers in a comma separated pulse shape file, one row per line, as a read-only array. The text is
+    only parsed once: the array is kept in the shape file cache, and saved in a .npy sidecar next to the file, which
+    later runs memory map instead of parsing the text as long as the file has the same modification time and size.
+    :param filename: path of the file
+    """
+    key = shape_file_key(filename)
+
+    def load():
+        path = Path(key[0])
+        sidecar = shape_sidecar(key)
+        try:
+            return np.load(sidecar, mmap_mode='r')
+        except (OSError, ValueError):
+            pass  # no sidecar for this version of the file, or it could not be read, so the text is parsed
+        data = np.genfromtxt(path, delimiter=',')
+        temp = sidecar.with_name(sidecar.name + '.tmp')
+        try:
+            with open(temp, 'wb') as f:
+                np.save(f, data)
+            os.replace(temp, sidecar)  # other processes never see a half written sidecar
+            stale = re.compile(re.escape(path.name) + r'(\.\d+-\d+)?' + re.escape(_SIDECAR_SUFFIX))
+            for other in path.parent.iterdir():
+                if other != sidecar and stale.fullmatch(other.name):
+                    other.unlink()  # sidecars of earlier versions of the file
+        except OSError as err:
+            pulselogger.warning('Could not write {0}: {1}'.format(sidecar, err))
+        return data
+    return shape_file_cache.get(('file',) + key, load)
+
+
+def resampled_shape(filename, width, column):
+    """Returns a column of a pulse shape file resampled to width points evenly spread between the first and last
+    time in column 1, kept in the shape file cache for each width. The columns are rounded to float32 first.
+    :param filename: path of the file
+    :param width: number of samples
+    :param column: index of the column
+    """
+    key = shape_file_key(filename)
+
+    def resample():
+        csv = load_shape_file(filename)
+        tt = np.array(csv[:, 1], dtype=_IQTYPE)
+        data = np.array(csv[:, column], dtype=_IQTYPE)
+        # generate a list of integers which goes from tmin to tmax and has width number of samples
+        resampleidx = np.linspace(tt[0], tt[-1], width)
+        return np.interp(resampleidx, tt, data)  # obtain values of amplitude at resampled values
+    return shape_file_cache.get(('resampled', width, column) + key, resample)
+
+
+def shape_max(filename, column):
+    """Returns the largest value of a column of a pulse shape file, rounded to float32 like the resampled columns"""
+    return np.amax(np.array(load_shape_file(filename)[:, column], dtype=_IQTYPE))
+
+
+def phase_ramp(width, ssb_freq):
+    """Returns exp(2 pi i ssb_freq n) for the samples n of a block as complex64, from the ramp cache. The clock rate is
+    already in ssb_freq, which is in cycles per sample, so the same ramp serves every pulse with that frequency.
+    :param width: number of samples, at most _MODULATION_BLOCK
+    :param ssb_freq: the side band frequency in cycles per sample, or a column array of them for one ramp per row
+    """
+    ssb_freq = np.asarray(ssb_freq, dtype=np.float64)
+
+    def generate():
+        angle = np.arange(width, dtype=np.float64) * (2 * np.pi * ssb_freq)
+        ramp = np.empty(angle.shape, dtype=np.complex64)
+        np.cos(angle, out=ramp.real)
+        np.sin(angle, out=ramp.imag)
+        return ramp
+    return ramp_cache.get((width, ssb_freq.shape, ssb_freq.tobytes()), generate)
+
+
+def iq_modulation(data, ssb_freq, iqscale, phase, skew_phase, out=None):
+    """Returns the I and Q data of an envelope with the sideband modulation, IQ scale and phase corrections applied,
+    see :meth:`Pulse.iq_generator`. ssb_freq and phase can also be column arrays, with one envelope per row of data
+    or the same envelope for all of them, which modulates the envelope for many values at once.
+    :param data: the envelope, the last axis is the sample index
+    :param ssb_freq: the side band frequency in cycles per sample
+    :param iqscale: the voltage scale of the Q channel
+    :param phase: the phase difference between I and Q channels in degrees
+    :param skew_phase: corrections to the phase in degrees
+    :param out: optional float32 array of shape (2, ...) that the I and Q data are written into, e.g. a slice of the
+            array of a whole sequence, by default a new one is made
+    """
+    width = np.shape(data)[-1]
+    shape = np.broadcast_shapes(np.shape(data), np.shape(ssb_freq), np.shape(phase), (width,))
+    if out is None:
+        out = np.empty((2,) + shape, dtype=_IQTYPE)
+    ramp = phase_ramp(min(width, _MODULATION_BLOCK), ssb_freq)
+    # the IQ scale and the skew phase are a 2 x 2 matrix applied to the cos and sin of the phase of each sample
+    skew = 2 * np.pi * skew_phase / 360.0
+    qcos, qsin = iqscale * np.sin(skew), iqscale * np.cos(skew)
+    for first in range(0, width, _MODULATION_BLOCK):
+        last = min(width, first + _MODULATION_BLOCK)
+        block = data[..., first:last]
+        iout, qout = out[0, ..., first:last], out[1, ..., first:last]
+        # the phase at the first sample of the block, and the phase offset, are one complex rotation of the ramp
+        rotation = np.exp(2j * np.pi * (np.multiply(ssb_freq, first) + np.divide(phase, 360.0)))
+        iq = np.multiply(ramp[..., :last - first], rotation.astype(np.complex64))
+        np.multiply(iq.real, qcos, out=iout)
+        np.multiply(iq.imag, qsin, out=qout)
+        qout += iout
+        np.multiply(block, qout, out=qout)
+        np.multiply(block, iq.real, out=iout)
+        del iq  # freed before the rotated ramp of the next block is made
+    return out[0], out[1]
+
+
+def sideband_modulation(data, ssb_freq, iqscale, skew_phase, first=0):
+    """Applies the sideband modulation, IQ scale and skew phase corrections in place to I and Q data made in baseband,
+    i.e. with an SB frequency of 0, an IQ scale of 1 and no skew phase, so that each pulse only carries its own phase.
+    The phase of the modulation at each sample follows from its index in the whole sequence, so it is continuous from
+    one pulse to the next.
+    :param data: float32 array of shape (2, samples), e.g. a slice of the data of a sequence
+    :param ssb_freq: the side band frequency in cycles per sample
+    :param iqscale: the voltage scale of the Q channel
+    :param skew_phase: corrections to the phase in degrees
+    :param first: index in the sequence of the first sample of data
+    """
+    width = data.shape[-1]
+    if width == 0:
+        return data
+    ramp = phase_ramp(min(width, _MODULATION_BLOCK), ssb_freq)
+    skew = 2 * np.pi * skew_phase / 360.0
+    qcos, qsin = iqscale * np.sin(skew), iqscale * np.cos(skew)
+    for start in range(0, width, _MODULATION_BLOCK):
+        last = min(width, start + _MODULATION_BLOCK)
+        rotation = np.exp(2j * np.pi * ssb_freq * (first + start))
+        carrier = np.multiply(ramp[:last - start], np.complex64(rotation))
+        idata, qdata = data[0, start:last], data[1, start:last]
+        # the baseband data times the carrier, as a complex number
+        real = idata * carrier.real
+        real -= qdata * carrier.imag
+        imag = idata * carrier.imag
+        imag += qdata * carrier.real
+        np.multiply(real, qcos, out=qdata)
+        imag *= qsin
+        qdata += imag
+        idata[...] = real
+        del carrier, real, imag
+    return data
+
+
+def constant_envelope(width, amp):
+    """Returns the envelope of a square pulse, amp at every sample, as a read-only view of amp that takes no memory.
+    amp can also be a column array, which gives one envelope per row.
+    :param width: number of samples
+    :param amp: the amplitude
+    """
+    amp = np.asarray(amp, dtype=np.float64)
+    return np.broadcast_to(amp, np.broadcast_shapes(amp.shape, (width,)))
+
+
+def batch_samples(widths):
+    """Returns the widths as an array, the sample indices of the longest one as a row, and the mask of the samples that
+    are inside each pulse, with one row per pulse, for the padded arrays made by :meth:`Pulse.batch_envelopes`
+    :param widths: number of samples of each pulse
+    """
+    widths = np.asarray(widths, dtype=np.intp).reshape(-1)
+    samples = np.arange(widths.max(initial=0), dtype=np.intp)
+    return widths, samples, samples < widths[:, np.newaxis]
+
+
+def padded_envelopes(envelopes, widths):
+    """Returns the envelopes of pulses of different widths as one array padded with zeros, with one row per pulse
+    :param envelopes: the envelope of each pulse
+    :param widths: number of samples of each pulse
+    """
+    widths, samples, inside = batch_samples(widths)
+    data = np.zeros(inside.shape, dtype=np.result_type(*envelopes) if len(envelopes) else np.float64)
+    data[inside] = np.concatenate(envelopes) if len(envelopes) else []
+    return data
+
+
+def constant_envelopes(widths, amps):
+    """Returns the envelopes of square pulses of many widths and amplitudes as a padded array, see
+    :meth:`Pulse.batch_envelopes`
+    :param widths: number of samples of each pulse
+    :param amps: amplitude of each pulse, already scaled to the DAC range
+    """
+    widths, samples, inside = batch_samples(widths)
+    amps = np.asarray(amps, dtype=np.float64).reshape(-1, 1)
+    return np.where(inside, amps, 0.0), widths
+
+
 class Pulse(object):
+    # how the envelope is turned into I and Q data: 'iq' with the sideband modulation, 'i' or 'q' to put it on one
+    # channel only, or None if the class makes its I and Q data some other way
+    MODULATION = 'iq'
+
     def __init__(self, num, width, ssb_freq, iqscale, phase, skew_phase):
         self.vmax = 1.0  # The max voltage that AWG is using
         self.num = num  # The name of each pulse. It is an integer number, more like a serial number for different type of pulse
@@ -41,7 +328,7 @@ class Pulse(object):
         self.Q_data = None  # The I and Q data that will has the correction of IQ scale
         self.I_data = None  # and phase. Both of them will be an array with floating number.
 
-    def iq_generator(self, data):
+    def iq_generator(self, data, out=None):
         # This method is taking "envelope pulse data" and then adding the correction of IQ scale and phase to it.
         # The input is an array of floating point number.
         # For example, if you are making a Gaussain pulse, this will be an array with number given by exp(-((x-mu)/2*sigma)**2)
@@ -51,21 +338,68 @@ class Pulse(object):
 
         # Making I and Q correction
         # print(f'ssb freq {self.ssb_freq}, phase {self.phase}, iqscale {self.iqscale},skewphase {self.skew_phase}')
-        tempx = np.arange(self.width * 1.0)
-        self.Q_data = np.array(data * np.sin(2 * np.pi * (tempx * self.ssb_freq + self.phase/360.0 + self.skew_phase/360.0)) * self.iqscale, dtype=_IQTYPE)
-        self.I_data = np.array(data * np.cos(2 * np.pi * (tempx * self.ssb_freq + self.phase/360.0)), dtype=_IQTYPE)
-
-    def i_generator(self,data):
-        tempx = np.arange(self.width * 1.0)
-        self.Q_data = np.zeros(len(data))
-        self.I_data = np.array(data)
+        # If out is given, a (2 x width) float32 array, the data is written straight into it and I_data and Q_data
+        # are its rows
+        self.I_data, self.Q_data = iq_modulation(data, self.ssb_freq, self.iqscale, self.phase, self.skew_phase,
+                                                 out=out)
+
+    def i_generator(self,data, out=None):
+        if out is None:
+            out = np.empty((2, len(data)), dtype=_IQTYPE)
+        out[0] = data
+        out[1] = 0.0
+        self.I_data, self.Q_data = out
         # self.I_data = np.array(data * np.cos(2 * np.pi * (tempx * self.ssb_freq + self.phase/360.0)), dtype=_IQTYPE)
 
-    def q_generator(self,data):
-        tempx = np.arange(self.width * 1.0)
+    def q_generator(self,data, out=None):
         # self.Q_data = np.array(data * np.sin(2 * np.pi * (tempx * self.ssb_freq  + self.phase/360.0 + self.skew_phase/360.0)) * self.iqscale, dtype=_IQTYPE)
-        self.Q_data = np.array(data)
-        self.I_data = np.zeros(len(data))
+        if out is None:
+            out = np.empty((2, len(data)), dtype=_IQTYPE)
+        out[0] = 0.0
+        out[1] = data
+        self.I_data, self.Q_data = out
+
+    def envelope(self, amp):
+        """Returns the envelope of the pulse, i.e. the data before the I and Q correction, for an amplitude already
+        scaled to the DAC range. amp can also be a column array, which gives one envelope per row.
+        :param amp: the amplitude
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def batch_envelopes(cls, widths, deviations, amps):
+        """Returns the envelopes of many pulses of this shape at once, each the same as :meth:`envelope` gives, as an
+        array padded with zeros with one row per pulse, and the number of samples of each pulse. This makes the
+        pulses one at a time; shapes that can be worked out for all of them in one go override it.
+        :param widths: number of samples of each pulse
+        :param deviations: the deviation, i.e. the pulsewidth in samples, of each pulse, unused by square pulses
+        :param amps: amplitude of each pulse, already scaled to the DAC range
+        """
+        widths = np.asarray(widths, dtype=np.intp).reshape(-1)
+        # python scalars, as the single pulses get them
+        envelopes = [np.asarray(cls(0, w, 0.0, 1.0, 0.0, d, 0.0).envelope(a)).reshape(-1) for w, d, a in
+                     zip(widths.tolist(), np.reshape(deviations, -1).tolist(), np.reshape(amps, -1).tolist())]
+        return padded_envelopes(envelopes, widths), widths
+
+    def modulate(self, data, ssb_freq=None, phase=None, out=None):
+        """Returns the I and Q data of an envelope as data_generator makes them. ssb_freq and phase default to those
+        of the pulse, and can be column arrays to modulate many envelopes at once, see :func:`iq_modulation`.
+        :param data: the envelope
+        :param ssb_freq: the side band frequency
+        :param phase: the phase in degrees
+        :param out: optional float32 array of shape (2, ...) to write the I and Q data into
+        """
+        if ssb_freq is None:
+            ssb_freq = self.ssb_freq
+        if phase is None:
+            phase = self.phase
+        if self.MODULATION in ('i', 'q'):
+            if out is None:
+                out = np.empty((2,) + np.shape(data), dtype=_IQTYPE)
+            out[0] = data if self.MODULATION == 'i' else 0.0
+            out[1] = data if self.MODULATION == 'q' else 0.0
+            return out[0], out[1]
+        return iq_modulation(data, ssb_freq, self.iqscale, phase, self.skew_phase, out=out)
 
 class Gaussian(Pulse):
     def __init__(self, num, width, ssb_freq, iqscale, phase,deviation, amp, skew_phase=0):
@@ -75,11 +409,35 @@ class Gaussian(Pulse):
         self.amp = amp * self.vmax/_DAC_UPPER # amp can be a value anywhere from 0 - 1000
 
 
-    def data_generator(self):
+    def envelope(self, amp):
+        # worked out in place, so that the only array made is the envelope
         data = np.arange(self.width * 1.0,dtype=_IQTYPE)
-        data = np.float32(self.amp * np.exp(
-            -((data - self.mean) ** 2) / (2 * self.deviation * self.deviation)))  # making a Gaussian function
-        self.iq_generator(data)
+        data -= self.mean
+        np.square(data, out=data)
+        np.negative(data, out=data)
+        data /= 2 * self.deviation * self.deviation
+        np.exp(data, out=data)  # making a Gaussian function
+        amp = np.asarray(amp, dtype=data.dtype)
+        return np.multiply(amp, data, out=data if amp.ndim == 0 else None)
+
+    @classmethod
+    def batch_envelopes(cls, widths, deviations, amps):
+        # the same float32 arithmetic as envelope, with one row per pulse
+        widths, samples, inside = batch_samples(widths)
+        column = (len(widths), 1)
+        data = np.tile(samples.astype(_IQTYPE), column)
+        data -= (widths / 2.0).astype(_IQTYPE).reshape(column)
+        np.square(data, out=data)
+        np.negative(data, out=data)
+        deviations = np.asarray(deviations).reshape(column)
+        data /= (2 * deviations * deviations).astype(_IQTYPE)
+        np.exp(data, out=data)
+        data *= np.asarray(amps, dtype=_IQTYPE).reshape(column)
+        data[~inside] = 0.0
+        return data, widths
+
+    def data_generator(self, out=None):
+        self.iq_generator(self.envelope(self.amp), out)
 
 class Sech(Pulse):
     def __init__(self, num, width, ssb_freq, iqscale, phase, deviation, amp, skew_phase=0):
@@ -89,12 +447,32 @@ class Sech(Pulse):
         self.amp = amp * self.vmax / _DAC_UPPER # amp can be a value anywhere from 0 - 1000
         # print('mean {0}, deviation {1}, amp {2}, width {3}'.format(self.mean,self.deviation,self.amp,self.width))
 
-    def data_generator(self):
-        data = np.arange(self.width * 1.0)
-        data = np.float32(self.amp * 2.0/(np.exp((data - self.mean)/self.deviation) + np.exp(-(data -
-                                                                                       self.mean)/self.deviation)))
-                               # making a Sech function
-        self.iq_generator(data)
+    def envelope(self, amp):
+        # worked out in place in float32, 2 / (exp(x) + exp(-x)) is 1 / cosh(x)
+        data = np.arange(self.width * 1.0, dtype=_IQTYPE)
+        data -= self.mean
+        data /= self.deviation
+        with np.errstate(over='ignore'):  # far from the centre of the pulse, where it is 0
+            np.cosh(data, out=data)
+        amp = np.asarray(amp, dtype=data.dtype)
+        # making a Sech function
+        return np.divide(amp, data, out=data if amp.ndim == 0 else None)
+
+    @classmethod
+    def batch_envelopes(cls, widths, deviations, amps):
+        widths, samples, inside = batch_samples(widths)
+        column = (len(widths), 1)
+        data = np.tile(samples.astype(_IQTYPE), column)
+        data -= (widths / 2.0).astype(_IQTYPE).reshape(column)
+        data /= np.asarray(deviations).astype(_IQTYPE).reshape(column)
+        with np.errstate(over='ignore'):
+            np.cosh(data, out=data)
+        np.divide(np.asarray(amps, dtype=_IQTYPE).reshape(column), data, out=data)
+        data[~inside] = 0.0
+        return data, widths
+
+    def data_generator(self, out=None):
+        self.iq_generator(self.envelope(self.amp), out)
 
 class Lorentzian(Pulse):
     def __init__(self, num, width, ssb_freq, iqscale, phase, deviation, amp, skew_phase=0):
@@ -104,36 +482,98 @@ class Lorentzian(Pulse):
         self.amp = amp * self.vmax / _DAC_UPPER  # amp can be a value anywhere from 0 - 100
 
 
-    def data_generator(self):
-        data = np.arange(self.width * 1.0)
-        data = np.float32(self.amp * (self.deviation**2)/(4* (np.power(data - self.mean,2) + (self.deviation/2)**2)))
-                               # making a Lorentzian function
-        self.iq_generator(data)
+    def envelope(self, amp):
+        # worked out in place in float32, like the Gaussian
+        data = np.arange(self.width * 1.0, dtype=_IQTYPE)
+        data -= self.mean
+        np.square(data, out=data)
+        data += (self.deviation/2)**2
+        data *= 4
+        amp = np.asarray(np.multiply(amp, self.deviation**2), dtype=data.dtype)
+        # making a Lorentzian function
+        return np.divide(amp, data, out=data if amp.ndim == 0 else None)
+
+    @classmethod
+    def batch_envelopes(cls, widths, deviations, amps):
+        widths, samples, inside = batch_samples(widths)
+        column = (len(widths), 1)
+        deviations = np.asarray(deviations, dtype=np.float64).reshape(column)
+        data = np.tile(samples.astype(_IQTYPE), column)
+        data -= (widths / 2.0).astype(_IQTYPE).reshape(column)
+        np.square(data, out=data)
+        data += ((deviations / 2) ** 2).astype(_IQTYPE)
+        data *= 4
+        np.divide((np.asarray(amps, dtype=np.float64).reshape(column) * deviations ** 2).astype(_IQTYPE), data,
+                  out=data)
+        data[~inside] = 0.0
+        return data, widths
+
+    def data_generator(self, out=None):
+        self.iq_generator(self.envelope(self.amp), out)
 
 #Gerono class added on 10/28/2021
 class Gerono(Pulse):
+    _shape_table = None  # the shape of the pulse, see shape_table
+
     def __init__(self, num, width, ssb_freq, iqscale, phase,deviation, amp,skew_phase=0):
         super().__init__(num, width, ssb_freq, iqscale, phase, skew_phase)
         self.amp = amp * self.vmax/_DAC_UPPER # amp can be a value anywhere from 0 - 1000
 
 
-    def data_generator(self):
-
-        n_points = 5000
-        l_max = 2*np.pi
-        l = self.build_l(l_max, n_points)
-        phi = np.pi/2
-        alpha = self.calculate_alpha(phi)
-
-        x, y = self.gerono_func(alpha, l)  # Require l_max = np.pi
-
-        #Numerically calculate the pulse function.
-        pulse_func, t_of_l_list, kappa = self.core_calculation(l, x, y)
-
-        data = np.linspace(min(t_of_l_list), max(t_of_l_list), num=self.width,dtype=_IQTYPE)
-        data = self.NormalizeGerono(pulse_func(data))
-        data = np.float32(self.amp*data)  # Gerono goes here
-        self.iq_generator(data)
+    def data_generator(self, out=None):
+        self.iq_generator(self.envelope(self.amp), out)
+
+    def envelope(self, amp):
+        # the shape does not depend on anything but the width, so it is resampled from a table made once
+        table = self.shape_table()
+        # linear interpolation between the samples of the table, at the positions of the samples of the pulse
+        position = np.linspace(0.0, len(table) - 1, num=self.width)
+        idx = np.minimum(position.astype(np.intp), len(table) - 2)
+        data = table[idx] + (position - idx) * (table[idx + 1] - table[idx])
+        data = self.NormalizeGerono(data)
+        return np.float32(amp*data)  # Gerono goes here
+
+    @classmethod
+    def batch_envelopes(cls, widths, deviations, amps):
+        # the shape only depends on the width, so the positions of the samples are worked out as np.linspace does for
+        # each width, and the samples past the end of a shorter pulse repeat its last one until they are cleared
+        widths, samples, inside = batch_samples(widths)
+        column = (len(widths), 1)
+        table = cls(0, 0, 0.0, 1.0, 0.0, 0, 0.0).shape_table()
+        last = len(table) - 1
+        with np.errstate(divide='ignore', invalid='ignore'):  # a pulse of one sample has no step, and is at 0
+            step = (last / (widths - 1.0)).reshape(column)
+            position = np.minimum(samples, (widths - 1).reshape(column)) * step
+        position[widths == 1] = 0.0
+        position[np.arange(len(widths)), np.maximum(widths - 1, 0)] = np.where(widths > 1, last, 0.0)
+        idx = np.minimum(position.astype(np.intp), last - 1)
+        data = table[idx] + (position - idx) * (table[idx + 1] - table[idx])
+        data[~inside] = 0.0
+        data /= np.max(abs(data), axis=1, keepdims=True)
+        return np.float32(np.asarray(amps, dtype=np.float64).reshape(column) * data), widths
+
+    def shape_table(self):
+        """Returns the Gerono shape sampled at _GERONO_TABLE_POINTS times evenly spread over the pulse, which is
+        worked out from the curve the first time it is needed and then kept for all Gerono pulses"""
+        table = Gerono._shape_table
+        if table is None:
+            n_points = 5000
+            l_max = 2*np.pi
+            l = self.build_l(l_max, n_points)
+            phi = np.pi/2
+            alpha = self.calculate_alpha(phi)
+
+            x, y = self.gerono_func(alpha, l)  # Require l_max = np.pi
+
+            #Numerically calculate the pulse function.
+            pulse_func, t_of_l_list, kappa = self.core_calculation(l, x, y)
+            # the times are worked out in float64 so that the first and last are exactly the ends of the curve
+            t = np.linspace(t_of_l_list[0], t_of_l_list[-1], num=_GERONO_TABLE_POINTS)
+            t[-1] = t_of_l_list[-1]
+            table = pulse_func(t)
+            table.flags.writeable = False
+            Gerono._shape_table = table
+        return table
 
     # Gerono parametrization
     def gerono_func(self,alpha, l):
@@ -221,31 +661,55 @@ class Square(Pulse):
         self.mean = self.width / 2.0
         self.height = height * self.vmax / _DAC_UPPER  # height can be a value anywhere from 0 - 1000
 
-    def data_generator(self):
-        data = (np.zeros(self.width) + 1.0) * self.height  # making a Square function
-        self.iq_generator(data)
+    def envelope(self, amp):
+        return constant_envelope(self.width, amp)  # making a Square function
+
+    @classmethod
+    def batch_envelopes(cls, widths, deviations, amps):
+        return constant_envelopes(widths, amps)
+
+    def data_generator(self, out=None):
+        self.iq_generator(self.envelope(self.height), out)
 
 class SquareI(Pulse):
+    MODULATION = 'i'
+
     def __init__(self, num, width, ssb_freq, iqscale, phase, height, skew_phase=0):
         super().__init__(num, width, ssb_freq, iqscale, phase, skew_phase)
         self.mean = self.width / 2.0
         self.height = height * self.vmax / _DAC_UPPER  # height can be a value anywhere from 0 - 1000
 
-    def data_generator(self):
-        data = (np.zeros(self.width) + 1.0) * self.height  # making a Square function
-        self.i_generator(data)
+    def envelope(self, amp):
+        return constant_envelope(self.width, amp)  # making a Square function
+
+    @classmethod
+    def batch_envelopes(cls, widths, deviations, amps):
+        return constant_envelopes(widths, amps)
+
+    def data_generator(self, out=None):
+        self.i_generator(self.envelope(self.height), out)
 
 class SquareQ(Pulse):
+    MODULATION = 'q'
+
     def __init__(self, num, width, ssb_freq, iqscale, phase, height, skew_phase=0):
         super().__init__(num, width, ssb_freq, iqscale, phase, skew_phase)
         self.mean = self.width / 2.0
         self.height = height * self.vmax / _DAC_UPPER  # height can be a value anywhere from 0 - 1000
 
-    def data_generator(self):
-        data = (np.zeros(self.width) + 1.0) * self.height  # making a Square function
-        self.q_generator(data)
+    def envelope(self, amp):
+        return constant_envelope(self.width, amp)  # making a Square function
+
+    @classmethod
+    def batch_envelopes(cls, widths, deviations, amps):
+        return constant_envelopes(widths, amps)
+
+    def data_generator(self, out=None):
+        self.q_generator(self.envelope(self.height), out)
 
 class DataIQ(Pulse):
+    MODULATION = None  # the file has the I and Q data
+
     def __init__(self, filename, num, width, ssb_freq, iqscale, phase, deviation, amp, skew_phase=0):
         super().__init__(num, width, ssb_freq, iqscale, phase, skew_phase)
         self.amp = amp * self.vmax/_DAC_UPPER  # amp can be a value anywhere from 0 - 1000
@@ -253,24 +717,21 @@ class DataIQ(Pulse):
         self.mean = self.width/2.0
         self.filename = filename  # may want to fix this so path is always the same place.
 
-    def data_generator(self):
+    def data_generator(self, out=None):
         try:
-            csv = np.genfromtxt(self.filename, delimiter=',')  # load a file with amplitude and phase values written by the other module/function
-            tt = np.array(csv[:, 1], dtype=_IQTYPE)
-            dataI = np.array(csv[:, 2], dtype=_IQTYPE)
-            dataQ = np.array(csv[:, 3], dtype=_IQTYPE)
-            maxampI = np.amax(dataI)  # find maximum value before resampling
-            maxampQ = np.amax(dataQ)
-            # now we need to resample the data to be compatible with the width
-            resampleidx = np.linspace(tt[0], tt[-1], self.width) # generate a list of integers which goes from tmin to tmax and has width number of samples
-            dataI = np.interp(resampleidx, tt, dataI)  # obtain values of amplitude at resampled values
-            dataI = dataI * self.amp / maxampI  # normalize to maximum value
-            dataQ = np.interp(resampleidx, tt, dataQ)  # obtain values of amplitude at resampled values
-            dataQ = dataQ * self.amp / maxampQ  # normalize to maximum value
-            self.time = np.interp(resampleidx, tt, tt)  # obtain time at resampled values
-
-            self.Q_data = np.array(dataQ)
-            self.I_data = np.array(dataI)
+            # the file with amplitude and phase values written by the other module/function is only parsed once
+            maxampI = shape_max(self.filename, 2)  # find maximum value before resampling
+            maxampQ = shape_max(self.filename, 3)
+            # the resampled columns are kept for each width
+            dataI = resampled_shape(self.filename, self.width, 2) * self.amp / maxampI  # normalize to maximum value
+            dataQ = resampled_shape(self.filename, self.width, 3) * self.amp / maxampQ  # normalize to maximum value
+            self.time = resampled_shape(self.filename, self.width, 1)  # obtain time at resampled values
+
+            if out is None:
+                out = np.empty((2, self.width), dtype=_IQTYPE)
+            out[0] = dataI
+            out[1] = dataQ
+            self.I_data, self.Q_data = out
 
         except IOError as err:
             print("OS error: {0}".format(err))
@@ -282,27 +743,23 @@ class DataIQ(Pulse):
 
 
 class Marker(Pulse):
+    MODULATION = None
+
     def __init__(self, num, width, markernum, marker_on, marker_off):
         super().__init__(num, width, 0, 1, 0, skew_phase=0)
         self.markernum = markernum  # this number shows which marker we are using, 1 and 2 are for CH1 m1 and m2,
                                     # 3 and 4 are for CH2 m1 and m2, and so on
         self.marker_on = marker_on  # at which point you want to turn on the marker (can use this for marker delay)
         self.marker_off = marker_off  # at which point you want to turn off the marker
-        self.data = np.zeros(self.width * 1, dtype=_MARKTYPE)
+        self.data = MarkerEdges(self.width)  # the marker byte is constant, so it is a single run
 
     def data_generator(self):
-        """
+        """Sets the marker byte of the pulse, which is kept as a run of the same byte and not expanded to an array
 
         :rtype: object
         """
-        if self.markernum == 1 or self.markernum == 3:
-            # For marker 1 and 3, turning on the 1st bit of the marker byte
-            #self.data[self.marker_on:self.marker_off] += 1
-            self.data += 1
-        elif self.markernum == 2 or self.markernum == 4:
-            # For marker 2 and 4, turning on the 2nd bit of the marker byte
-            #self.data[self.marker_on:self.marker_off] += 2
-            self.data += 2
+        # marker 1 and 3 turn on the 1st bit of the marker byte, marker 2 and 4 turn on the 2nd bit
+        self.data = MarkerEdges(self.width, [0], [marker_bit(self.markernum)])
 
 class LoadWave(Pulse):
     def __init__(self,filename,num, width, ssb_freq, iqscale, phase, deviation, amp, skew_phase=0):
@@ -312,20 +769,17 @@ class LoadWave(Pulse):
         self.mean = self.width/2.0
         self.filename = filename # may want to fix this so path is always the same place.
 
-    def data_generator(self):
+    def envelope(self, amp):
+        # the file with amplitude and phase values written by the other module/function is only parsed once, and
+        # resampled once for each width
+        maxamp = shape_max(self.filename, 2) # find maximum value before resampling
+        data = resampled_shape(self.filename, self.width, 2)
+        self.time = resampled_shape(self.filename, self.width, 1) # obtain time at resampled values
+        return data * amp / maxamp # normalize to maximum value
+
+    def data_generator(self, out=None):
         try:
-            csv = np.genfromtxt(self.filename, delimiter=',')# load a file with amplitude and phase values written by
-            # the other module/function
-            tt = np.array(csv[:, 1],dtype = _IQTYPE)
-            data = np.array(csv[:, 2], dtype = _IQTYPE)
-            maxamp = np.amax(data) # find maximum value before resampling
-            # now we need to resample the data to be compatible with the width
-            resampleidx = np.linspace(tt[0],tt[-1],self.width) # generate a list of integers which goes from
-            # tmin to tmax and has width number of samples
-            data = np.interp(resampleidx,tt,data) # obtain values of amplitude at resampled values
-            data = data * self.amp / maxamp # normalize to maximum value
-            self.time = np.interp(resampleidx,tt,tt) # obtain time at resampled values
-            self.iq_generator(data)
+            self.iq_generator(self.envelope(self.amp), out)
         except IOError as err:
             #sys.stderr.write('File error: %s', err.message)
             print("OS error: {0}".format(err))
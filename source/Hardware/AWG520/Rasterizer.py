@@ -0,0 +1,437 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+# The rasterizer turns the events of a sequence into an interval table, i.e. arrays of start and stop sample indices
+# plus a table of envelopes for the analog events, and then renders the whole table into the I/Q and marker arrays.
+# Every envelope is copied once, straight into its slice of the I/Q array, without an intermediate table of all the
+# samples, and the events of a pulse train that repeat the same envelope at a fixed spacing are copied all at once
+# through a strided view of the I/Q array. In a time scan the table of one point can also be rendered from the I/Q data
+# of the previous point, copying the start that has not changed and the end that has only been shifted, so that only the
+# samples in between are rendered again. Sequences do not render the marker bytes, they keep them as runs of the same
+# byte (see MarkerEdges), which are only expanded when the wfm files are written.
+
+import numpy as np
+import logging
+from numpy.lib.stride_tricks import as_strided
+
+_IQTYPE = np.dtype('<f4')  # AWG520 stores analog values as 4 bytes in little-endian format
+_MARKTYPE = np.dtype('<i1')  # AWG520 stores marker values as 1 byte
+_IDXTYPE = np.dtype('<i8')  # sample indices
+_LOOP_RUNS = 256  # markers with more runs than this are expanded with np.repeat instead of one slice per run
+_MIN_TILES = 4  # the events of a pulse train are tiled if at least this many of them have the same envelope
+
+rasterlogger = logging.getLogger('seqlogger.rasterizer')
+
+
+def marker_bit(markernum):
+    """Returns the bit of the marker byte that is set by a marker number. Marker 1 and 3 (CH1/CH2 marker 1) use the
+    1st bit, marker 2 and 4 (CH1/CH2 marker 2) use the 2nd bit, anything else (e.g. a disconnected switch) sets nothing.
+    :param markernum: the marker number from the connection dictionary
+    """
+    if markernum == 1 or markernum == 3:
+        return 1
+    elif markernum == 2 or markernum == 4:
+        return 2
+    else:
+        return 0
+
+
+def interval_indices(starts, lengths):
+    """Expands a set of intervals into the flat array of sample indices covered by them, without a python loop.
+    :param starts: array of start indices
+    :param lengths: array of interval lengths in samples
+    """
+    starts = np.asarray(starts, dtype=_IDXTYPE)
+    lengths = np.asarray(lengths, dtype=_IDXTYPE)
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=_IDXTYPE)
+    offsets = np.cumsum(lengths) - lengths  # position of the first sample of each interval in the flat array
+    return np.repeat(starts - offsets, lengths) + np.arange(total, dtype=_IDXTYPE)
+
+
+def roll_intervals(starts, stops, shift, length):
+    """Applies the same shift to a set of intervals that np.roll(data, shift) applies to the samples, i.e. samples
+    shifted past either end of the array wrap around to the other end. Intervals that end up straddling the end of the
+    array are split in two.
+    :param starts: array of start indices
+    :param stops: array of stop indices
+    :param shift: number of samples to shift by, negative values move the intervals earlier
+    :param length: length of the array the intervals live in
+    """
+    starts = np.asarray(starts, dtype=_IDXTYPE)
+    stops = np.asarray(stops, dtype=_IDXTYPE)
+    if shift == 0 or length == 0 or len(starts) == 0:
+        return starts, stops
+    widths = stops - starts
+    newstarts = np.mod(starts + shift, length)
+    newstops = newstarts + widths
+    wrapped = newstops > length
+    if np.any(wrapped):
+        # the part beyond the end of the array continues at the beginning
+        newstarts = np.concatenate((newstarts, np.zeros(np.count_nonzero(wrapped), dtype=_IDXTYPE)))
+        newstops = np.concatenate((np.minimum(newstops, length), newstops[wrapped] - length))
+    return newstarts, newstops
+
+
+def count_overlaps(starts, stops):
+    """Returns the number of intervals that begin before an interval that begins no later than them has ended, i.e. the
+    number of intervals that overlap an earlier one.
+    :param starts: array of start indices
+    :param stops: array of stop indices
+    """
+    starts = np.asarray(starts, dtype=_IDXTYPE)
+    if len(starts) < 2:
+        return 0
+    order = np.argsort(starts, kind='stable')
+    ends = np.maximum.accumulate(np.asarray(stops, dtype=_IDXTYPE)[order])
+    return int(np.count_nonzero(starts[order][1:] < ends[:-1]))
+
+
+class MarkerEdges(object):
+    """The marker byte of one AWG channel as a list of runs: the byte is values[k] from sample positions[k] up to the
+    next position, or up to the end for the last run. Markers only change at the edges of their events, so a few runs
+    describe what takes one byte per sample once it is expanded.
+    :param length: number of samples
+    :param positions: the first sample of each run, starting with 0 and increasing
+    :param values: the marker byte of each run
+    """
+
+    def __init__(self, length=0, positions=None, values=None):
+        self.length = int(length)
+        if positions is None:
+            positions, values = [0], [0]
+        self.positions = np.asarray(positions, dtype=_IDXTYPE)
+        self.values = np.asarray(values, dtype=_MARKTYPE)
+
+    def __len__(self):
+        return self.length
+
+    def __array__(self, dtype=None, copy=None):
+        data = self.expand()
+        return data if dtype is None else data.astype(dtype)
+
+    @classmethod
+    def from_intervals(cls, length, groups):
+        """Makes the runs of the marker byte set by groups of intervals, without expanding them
+        :param length: number of samples
+        :param groups: list of (start indices, stop indices, bit) of each group of intervals
+        """
+        edges = {}  # positions and changes in the number of intervals that set each bit
+        for starts, stops, bit in groups:
+            starts = np.clip(np.asarray(starts, dtype=_IDXTYPE), 0, length)
+            stops = np.clip(np.asarray(stops, dtype=_IDXTYPE), starts, length)
+            keep = stops > starts
+            positions, changes = edges.get(bit, ([], []))
+            positions.extend((starts[keep], stops[keep]))
+            changes.extend((np.ones(np.count_nonzero(keep), dtype=_IDXTYPE),
+                            -np.ones(np.count_nonzero(keep), dtype=_IDXTYPE)))
+            edges[bit] = (positions, changes)
+        allpositions = [np.zeros(1, dtype=_IDXTYPE)] + [np.concatenate(p) for p, c in edges.values()]
+        positions = np.unique(np.concatenate(allpositions))
+        positions = positions[positions < max(length, 1)]
+        values = np.zeros(len(positions), dtype=_MARKTYPE)
+        for bit, (bitpositions, changes) in edges.items():
+            bitpositions = np.concatenate(bitpositions)
+            if len(bitpositions) == 0:
+                continue
+            order = np.argsort(bitpositions, kind='stable')
+            # the number of intervals setting this bit from each edge on
+            active = np.cumsum(np.concatenate(changes)[order])
+            last = np.searchsorted(bitpositions[order], positions, side='right') - 1
+            on = (last >= 0) & (active[np.maximum(last, 0)] > 0)
+            values[on] |= bit
+        # runs with the same byte as the run before them are merged
+        keep = np.concatenate(([True], values[1:] != values[:-1]))
+        return cls(length, positions[keep], values[keep])
+
+    @classmethod
+    def from_array(cls, data):
+        """Makes the runs of an expanded marker byte array"""
+        data = np.asarray(data, dtype=_MARKTYPE)
+        if len(data) == 0:
+            return cls(0)
+        positions = np.concatenate(([0], np.flatnonzero(data[1:] != data[:-1]) + 1))
+        return cls(len(data), positions, data[positions])
+
+    def slice(self, start, stop):
+        """Returns the runs of the samples from start up to stop
+        :param start: first sample
+        :param stop: the sample after the last one
+        """
+        first = np.searchsorted(self.positions, start, side='right') - 1
+        last = np.searchsorted(self.positions, stop, side='left')
+        positions = np.maximum(self.positions[first:last], start) - start
+        return MarkerEdges(stop - start, positions, self.values[first:last])
+
+    def value_at(self, index):
+        """Returns the marker byte of one sample"""
+        return int(self.values[np.searchsorted(self.positions, index, side='right') - 1])
+
+    def runs(self):
+        """Returns the start indices, stop indices and marker byte of the runs"""
+        stops = np.append(self.positions[1:], self.length)
+        return self.positions, stops, self.values
+
+    def expand(self, out=None):
+        """Returns the marker byte of every sample
+        :param out: optional array of length self.length to write the bytes into, e.g. the marker field of the records
+                of a wfm file
+        """
+        starts, stops, values = self.runs()
+        if out is None:
+            return np.repeat(values, np.maximum(stops - starts, 0))
+        if len(values) > _LOOP_RUNS:
+            out[:] = np.repeat(values, np.maximum(stops - starts, 0))
+        else:
+            for start, stop, value in zip(starts, stops, values):
+                out[start:stop] = value
+        return out
+
+
+class IntervalTable(object):
+    """Holds the start/stop indices of all the events in a sequence together with the envelope data of the analog
+    events. Marker events are stored per AWG channel with the bit they set in the marker byte, and any delay is applied
+    as an offset to their indices rather than by shifting the rendered data.
+    :param length: number of samples in the rendered sequence
+    """
+
+    def __init__(self, length=0):
+        self.length = int(length)
+        self.logger = logging.getLogger('seqlogger.rasterizer.table')
+        self.wave_starts = []  # list of start index arrays for the analog events
+        self.envelopes = []  # list of 2 x N arrays with the I and Q data of each analog event
+        self.wave_trains = []  # list of arrays with the tiling group of each analog event, -1 if it has none
+        self.train_spans = []  # (start, period, number of periods) of the data of each pulse train, in samples
+        self.sideband_starts = []  # start and stop index arrays of the analog events made in baseband, which get the
+        self.sideband_stops = []  # sideband modulation of the whole sequence
+        self.marker_starts = {1: [], 2: []}  # start indices of the marker intervals for AWG channel 1 and 2
+        self.marker_stops = {1: [], 2: []}  # stop indices of the marker intervals
+        self.marker_bits = {1: [], 2: []}  # bit set by each group of marker intervals
+
+    def add_wave_events(self, starts, envelopes, trains=None):
+        """Adds analog events to the table
+        :param starts: start indices of the events
+        :param envelopes: list of 2 x N arrays with the I and Q data for each event
+        :param trains: optional tiling group of each event, -1 for none. The events of a group that have the same
+                envelope and start at a fixed spacing are rendered together, see :meth:`render_waves`
+        """
+        self.wave_starts.append(np.asarray(starts, dtype=_IDXTYPE))
+        self.envelopes.extend(envelopes)
+        if trains is None:
+            trains = np.full(len(self.wave_starts[-1]), -1, dtype=_IDXTYPE)
+        self.wave_trains.append(np.asarray(trains, dtype=_IDXTYPE))
+
+    def add_train_span(self, start, period, count):
+        """Records that the data of a pulse train repeats count times with the given period, so that it can be played as
+        a repeated waveform, see :meth:`AWGFile.idle_segments <source.Hardware.AWG520.AWG520.AWGFile.idle_segments>`
+        :param start: index of the first sample of the train
+        :param period: number of samples after which the events of the train repeat
+        :param count: number of periods
+        """
+        self.train_spans.append((int(start), int(period), int(count)))
+
+    def add_sideband_events(self, starts, stops):
+        """Records analog events whose data was made in baseband, see :meth:`sideband_ranges`
+        :param starts: start indices of the events
+        :param stops: stop indices of the events
+        """
+        self.sideband_starts.append(np.asarray(starts, dtype=_IDXTYPE))
+        self.sideband_stops.append(np.asarray(stops, dtype=_IDXTYPE))
+
+    def sideband_ranges(self):
+        """Returns the start and stop indices of the ranges of samples covered by the events added with
+        :meth:`add_sideband_events`, with the overlapping and touching events merged"""
+        if len(self.sideband_starts) == 0:
+            return np.zeros(0, dtype=_IDXTYPE), np.zeros(0, dtype=_IDXTYPE)
+        starts = np.clip(np.concatenate(self.sideband_starts), 0, self.length)
+        stops = np.clip(np.concatenate(self.sideband_stops), 0, self.length)
+        order = np.argsort(starts, kind='stable')
+        starts, stops = starts[order], np.maximum.accumulate(stops[order])
+        new = np.ones(len(starts), dtype=bool)
+        new[1:] = starts[1:] > stops[:-1]
+        last = np.append(np.flatnonzero(new)[1:] - 1, len(starts) - 1)
+        starts, stops = starts[new], stops[last]
+        keep = stops > starts
+        return starts[keep], stops[keep]
+
+    def add_marker_events(self, awgchannel, starts, stops, bit, delay=0):
+        """Adds marker events to the table
+        :param awgchannel: AWG channel (1 or 2) whose marker byte is set by these events
+        :param starts: start indices of the events
+        :param stops: stop indices of the events
+        :param bit: the bit of the marker byte that is turned on
+        :param delay: number of samples by which the events are moved earlier to compensate for hardware delays
+        """
+        if bit == 0 or len(starts) == 0:
+            return
+        starts, stops = roll_intervals(starts, stops, -int(delay), self.length)
+        self.marker_starts[awgchannel].append(starts)
+        self.marker_stops[awgchannel].append(stops)
+        self.marker_bits[awgchannel].append(bit)
+
+    def render_markers(self, awgchannel, out=None, lo=0, hi=None):
+        """Renders the packed marker byte of one AWG channel
+        :param awgchannel: AWG channel 1 or 2
+        :param out: optional array of length self.length to render into, it is assumed to be zeroed
+        :param lo: first sample to render, the samples before it are left alone
+        :param hi: the samples from this one on are left alone, defaults to self.length
+        """
+        if out is None:
+            out = np.zeros(self.length, dtype=_MARKTYPE)
+        if hi is None:
+            hi = self.length
+        for starts, stops, bit in zip(self.marker_starts[awgchannel], self.marker_stops[awgchannel],
+                                      self.marker_bits[awgchannel]):
+            starts = np.clip(starts, lo, hi)
+            stops = np.clip(stops, starts, hi)
+            idx = interval_indices(starts, stops - starts)
+            out[idx] |= bit  # repeated indices all set the same bit, so overlapping events are harmless
+        return out
+
+    def wave_intervals(self):
+        """Returns the start and stop indices of the analog events, with the events running past the end of the
+        sequence truncated"""
+        if len(self.envelopes) == 0:
+            return np.zeros(0, dtype=_IDXTYPE), np.zeros(0, dtype=_IDXTYPE)
+        starts = np.concatenate(self.wave_starts)
+        lengths = np.array([env.shape[-1] for env in self.envelopes], dtype=_IDXTYPE)
+        lengths = np.clip(np.minimum(lengths, self.length - starts), 0, None)
+        return starts, starts + lengths
+
+    def render_waves(self, out=None, lo=0, hi=None):
+        """Renders the I and Q data of all the analog events
+        :param out: optional 2 x self.length array to render into, it is assumed to be zeroed
+        :param lo: first sample to render, the samples before it are left alone
+        :param hi: the samples from this one on are left alone, defaults to self.length
+        """
+        if out is None:
+            out = np.zeros((2, self.length), dtype=_IQTYPE)
+        if len(self.envelopes) == 0:
+            return out
+        if hi is None:
+            hi = self.length
+        starts, stops = self.wave_intervals()
+        # only the part of each event between lo and hi is rendered, from this offset into its envelope
+        firsts = np.clip(starts, lo, hi)
+        lengths = np.clip(stops, firsts, hi) - firsts
+        offsets = firsts - starts
+        tiled = np.zeros(len(firsts), dtype=bool)
+        if count_overlaps(firsts, firsts + lengths) > 0:
+            self.logger.warning('Overlapping Wave events found, later events will overwrite earlier ones')
+        else:
+            # the events of a train are copied at once into a strided view that holds one envelope per row
+            for members, period in self.tiles(firsts, lengths, offsets):
+                env = self.envelopes[members[0]]
+                tiles = as_strided(out[:, firsts[members[0]]:], shape=(2, len(members), env.shape[-1]),
+                                   strides=(out.strides[0], period * out.strides[1], out.strides[1]))
+                tiles[...] = env[:, np.newaxis, :]
+                tiled[members] = True
+        # each envelope is copied straight into its slice of out, in order, so later events overwrite earlier ones
+        for first, length, offset, env, done in zip(firsts.tolist(), lengths.tolist(), offsets.tolist(),
+                                                    self.envelopes, tiled.tolist()):
+            if not done:
+                out[:, first:first + length] = env[:, offset:offset + length]
+        return out
+
+    def tiles(self, firsts, lengths, offsets):
+        """Returns a list of (events, period) of the groups of analog events that can be tiled: events of the same
+        group that are rendered in full, have the same envelope and start every period samples, with period at least the
+        length of the envelope. The first event of a train, which can have a different width, is left out if needed.
+        :param firsts: first sample of each event that is rendered
+        :param lengths: number of samples of each event that are rendered
+        :param offsets: offset into its envelope of the first sample of each event that is rendered
+        """
+        groups = []
+        trains = np.concatenate(self.wave_trains)
+        if not np.any(trains >= 0):
+            return groups
+        widths = np.array([env.shape[-1] for env in self.envelopes], dtype=_IDXTYPE)
+        full = (offsets == 0) & (lengths == widths)
+        for train in np.unique(trains[trains >= 0]):
+            members = np.flatnonzero((trains == train) & full)
+            if len(members) < _MIN_TILES:
+                continue
+            env = self.envelopes[members[-1]]
+            members = np.array([m for m in members.tolist() if self.envelopes[m] is env], dtype=_IDXTYPE)
+            for candidate in (members, members[1:]):
+                steps = np.diff(firsts[candidate])
+                if len(candidate) >= _MIN_TILES and np.all(steps == steps[0]) and steps[0] >= env.shape[-1]:
+                    groups.append((candidate, int(steps[0])))
+                    break
+        return groups
+
+    def marker_edges(self, awgchannel):
+        """Returns the packed marker byte of one AWG channel as :class:`MarkerEdges`, without rendering it
+        :param awgchannel: AWG channel 1 or 2
+        """
+        return MarkerEdges.from_intervals(self.length, zip(self.marker_starts[awgchannel],
+                                                           self.marker_stops[awgchannel], self.marker_bits[awgchannel]))
+
+    def rasterize(self):
+        """Renders the whole table and returns the wave data (2 x N array of I and Q) and the marker data for AWG
+        channels 1 and 2"""
+        wavedata = self.render_waves()
+        c1markerdata = self.render_markers(1)
+        c2markerdata = self.render_markers(2)
+        return wavedata, c1markerdata, c2markerdata
+
+    def shift_window(self, previous):
+        """Compares the analog events of this table with those of the table of the previous point of a scan, and
+        returns (lo, hi) such that the I/Q data before sample lo is the same as that of the previous table, and the
+        data from sample hi on is the end of the data of the previous table, shifted by the difference in length. Only
+        the samples from lo to hi then have to be rendered. Returns None if the tables do not have the same number of
+        analog events.
+        :param previous: the interval table of the previous point
+        """
+        shift = self.length - previous.length
+        starts, stops = self.wave_intervals()
+        oldstarts, oldstops = previous.wave_intervals()
+        if len(starts) != len(oldstarts):
+            return None
+        equal = np.array([env is oldenv or np.array_equal(env, oldenv) for env, oldenv in
+                          zip(self.envelopes, previous.envelopes)], dtype=bool)
+        same = equal & (starts == oldstarts) & (stops == oldstops)
+        shifted = equal & (starts == oldstarts + shift) & (stops == oldstops + shift)
+        lo, hi = self.length, 0
+        if not np.all(same):
+            lo = min(int(starts[~same].min()), int(oldstarts[~same].min()))
+        if not np.all(shifted):
+            hi = max(int(stops[~shifted].max()), int(oldstops[~shifted].max()) + shift)
+        hi = min(self.length, max(hi, lo, shift))
+        lo = max(0, min(lo, previous.length, hi))
+        return lo, hi
+
+    def rerender(self, previous, wavedata):
+        """Renders the I and Q data of this table from the data rendered for the table of the previous point of a scan,
+        see :meth:`shift_window`. The previous array is not changed. Returns the new 2 x self.length array, or None if
+        the data has to be rendered from scratch, which is also the case when the analog events cover fewer samples than
+        would be copied, since rendering them into a new zeroed array is then cheaper.
+        :param previous: the interval table of the previous point
+        :param wavedata: the I and Q data of the previous point
+        """
+        window = self.shift_window(previous)
+        if window is None:
+            return None
+        lo, hi = window
+        starts, stops = self.wave_intervals()
+        if int(np.sum(stops - starts)) <= self.length - (hi - lo):
+            return None
+        start = hi - (self.length - previous.length)  # where the shifted end begins in the previous data
+        self.logger.debug('Rendering samples %d to %d of %d', lo, hi, self.length)
+        out = np.empty((2, self.length), dtype=wavedata.dtype)
+        out[:, :lo] = wavedata[:, :lo]
+        out[:, lo:hi] = 0
+        out[:, hi:] = wavedata[:, start:]
+        return self.render_waves(out, lo, hi)
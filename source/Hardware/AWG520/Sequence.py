@@ -18,9 +18,13 @@ import numpy as np
 import logging
 from decimal import Decimal, getcontext
 from source.Hardware.AWG520.Pulse import Gaussian, Square, SquareI, SquareQ, Marker, Sech, Lorentzian, Gerono,LoadWave, Pulse, \
-    DataIQ
+    DataIQ, envelope_cache, sideband_modulation, iq_modulation, _DAC_UPPER
+from source.Hardware.AWG520.Rasterizer import IntervalTable, MarkerEdges, marker_bit, count_overlaps
+from source.Hardware.AWG520.Events import EventTable, EventView, EventIndex, TICK, to_ticks, from_ticks, \
+    ticks_to_samples
 from source.common.utils import log_with, create_logger, get_project_root
-import re, sys, os, random
+import re, sys, os, math, random, shutil, tempfile, collections, itertools, copy, mmap, weakref
+from concurrent.futures import ProcessPoolExecutor
 
 maindir = get_project_root()
 # seqfiledir = maindir / 'Hardware/sequencefiles/'
@@ -50,9 +54,26 @@ _ANALOG2 = 'Analog2'  # new keyword for channel 2
 _RANDBENCH = "RandBench"  # new keyword for randomized benchmarking
 # dictionary of connections from marker channels to devices,
 _CONN_DICT = {_MW_S1: None, _MW_S2: 1, _GREEN_AOM: 2, _ADWIN_TRIG: 4}
+# AWG channel whose marker byte each marker channel is written to, and which delay is applied to it
+_MARKER_ROUTES = {_MW_S2: (1, 'mw'), _GREEN_AOM: (1, 'aom'), _MW_S1: (2, 'mw'), _ADWIN_TRIG: (2, None)}
 # dictionary of IQ parameters that will be used as default if none is supplied
 _PULSE_PARAMS = {'amplitude': 1000.0, 'pulsewidth': 20e-9, 'SB freq': 0.00, 'IQ scale factor': 1.0,
                  'phase': 0.0, 'skew phase': 0.0, 'num pulses': 1}
+# scan types handled by SequenceList, with the pulse param that each one changes and its type; time scans change the
+# start/stop times instead, and carrier frequency scans are done by the MW synthesizer so the sequence is unchanged
+_SCAN_TYPES = {'time': None, 'amplitude': ('amplitude', float), 'SB freq': ('SB freq', float),
+               'pulsewidth': ('pulsewidth', float), 'number': ('num pulses', int), 'Carrier frequency': None,
+               'phase': ('phase', float)}
+# scan types that do not change the time of any event, so every point of the scan has the same length
+_UNTIMED_SCANS = ['amplitude', 'SB freq', 'phase', 'Carrier frequency', 'no scan']
+# scan types that only change the envelope or the modulation of the Wave events, which can be built in batches
+_BATCH_SCANS = ['amplitude', 'phase', 'SB freq']
+_BATCH_BYTES = 64 * 1024 ** 2  # memory used for the I/Q data of a batch of scan points
+_PREFILL_PADDING = 1.25  # longest pulse in a chunk of prefilled pulses over the shortest, see prefill_wave_events
+# clock rates of the AWG520 in ns, see AWGFile.maketrailer
+_CLOCKS = [1, 5, 10, 25, 100]
+# largest difference in the I/Q data at which a coarser clock still counts as exact, this is the float32 rounding
+_EXACT_TOLERANCE = 1e-6
 # allowed values of the Waveform types
 _PULSE_TYPES = ['Gauss', 'Sech', 'Square', 'Lorentz', 'SquareI', 'SquareQ', 'Gerono', 'Load Wfm']
 
@@ -89,9 +110,9 @@ class SequenceEvent:
         self.__sampletime = sampletime
         # these variables store the start, stop, and duration in units of the sampletime, useful for indexing arrays
         # and writing data to the AWG
-        self.__t1_idx = round(Decimal(self.start / self.sampletime))
-        self.__t2_idx = round(Decimal(self.stop / self.sampletime))
-        self.__dur_idx = round(Decimal(self.duration / self.sampletime))
+        self.__t1_idx = self.to_index(self.start)
+        self.__t2_idx = self.to_index(self.stop)
+        self.__dur_idx = self.to_index(self.duration)
         # data for the event
         self.data = None
 
@@ -201,19 +222,23 @@ class SequenceEvent:
 
     @property
     def t1_idx(self):  # this variable stores the start time in integer format suitable for indexing arrays
-        self.__t1_idx = round(Decimal(self.start / self.sampletime))
+        self.__t1_idx = self.to_index(self.start)
         return self.__t1_idx
 
     @property
     def t2_idx(self):  # this variable stores the stop time in integer format suitable for indexing arrays
-        self.__t2_idx = round(Decimal(self.stop / self.sampletime))
+        self.__t2_idx = self.to_index(self.stop)
         return self.__t2_idx
 
     @property
     def dur_idx(self):  # this variable stores the start time in integer format suitable for indexing arrays
-        self.__dur_idx = round(Decimal(self.duration / self.sampletime))
+        self.__dur_idx = self.to_index(self.duration)
         return self.__dur_idx
 
+    def to_index(self, t):
+        """Converts a time to an index in units of the sampletime, using the integer tick time base"""
+        return ticks_to_samples(to_ticks(t), to_ticks(self.sampletime))
+
     def increment_time(self, dt: float = 0):
         """Increments the start and stop times by dt.
         :param dt: The time increment.
@@ -224,6 +249,215 @@ class SequenceEvent:
         self.stop += dt * self.stop_increment
 
 
+# pulse class of each Wave event type, and whether the pulse is shaped by the pulsewidth; shaped pulses are made at
+# least 8 pulsewidths long
+_WAVE_PULSES = {'Gauss': (Gaussian, True), 'Sech': (Sech, True), 'Square': (Square, False),
+                'Lorentz': (Lorentzian, True), 'SquareI': (SquareI, False), 'SquareQ': (SquareQ, False),
+                'Gerono': (Gerono, True), 'Load Wfm': (LoadWave, True)}
+# Wave event types that are modulated with the sideband, and can therefore be made in baseband and get the sideband
+# modulation of the whole sequence, see Sequence.coherent_sideband
+_SIDEBAND_TYPES = [name for name, (pulsecls, shaped) in _WAVE_PULSES.items() if pulsecls.MODULATION == 'iq']
+_SIDEBAND_PARAMS = ('SB freq', 'IQ scale factor', 'skew phase')  # params of the sideband modulation
+_BASEBAND_PARAMS = {'SB freq': 0.0, 'IQ scale factor': 1.0, 'skew phase': 0.0}  # their values in baseband
+
+
+def register_pulse(name, pulsecls, shaped=True):
+    """Adds a pulse shape that Wave events can use by name, e.g. 'Wave,1e-6,2e-6,Name', without changing Channel.
+    The class takes the same arguments as Gaussian if it is shaped, or as Square otherwise, and makes its envelope with
+    :meth:`Pulse.envelope`. If it overrides :meth:`Pulse.batch_envelopes`, the pulses of all the points of a
+    pulsewidth scan are worked out together, see :func:`prefill_wave_events`.
+    :param name: the pulse type in the sequence
+    :param pulsecls: subclass of :class:`Pulse`
+    :param shaped: whether the pulse is shaped by the pulsewidth, otherwise it is a square pulse as long as the event
+    """
+    if name not in _PULSE_TYPES:
+        _PULSE_TYPES.insert(len(_PULSE_TYPES) - 1, name)  # Load Wfm is always the last type
+    _WAVE_PULSES[name] = (pulsecls, shaped)
+    if name in _SIDEBAND_TYPES:
+        _SIDEBAND_TYPES.remove(name)
+    if pulsecls.MODULATION == 'iq':
+        _SIDEBAND_TYPES.append(name)
+
+
+def wave_event_size(pulse_type, start, stop, pulse_params, ticks_per_sample):
+    """Returns the stop time and duration in ticks of a Wave event, which are longer than requested if the pulse does
+    not fit, and its length and pulsewidth in samples
+    :param pulse_type: type of pulse, eg Gauss, Sech etc
+    :param start: start time of the event in ticks
+    :param stop: stop time of the event in ticks
+    :param pulse_params: the pulse params dictionary
+    :param ticks_per_sample: the sampling time (clock rate) used for this event in ticks
+    """
+    pulsewidth = to_ticks(pulse_params['pulsewidth'])
+    duration = stop - start
+    pwidth_idx = 0
+    if _WAVE_PULSES[pulse_type][1]:
+        pwidth_idx = pulsewidth // ticks_per_sample
+        # if duration < 8 * pulsewidth, set it equal to at least that much
+        if duration < 8 * pulsewidth:
+            duration = 8 * pulsewidth
+            stop = start + duration
+    return stop, duration, ticks_to_samples(duration, ticks_per_sample), pwidth_idx
+
+
+def wave_event_key(pulse_type, dur_idx, pwidth_idx, pulse_params, filekey=None):
+    """Returns the key of the I and Q data of a Wave event in the envelope cache"""
+    return (pulse_type, dur_idx, pwidth_idx, float(pulse_params['amplitude']), float(pulse_params['SB freq']),
+            float(pulse_params['IQ scale factor']), float(pulse_params['phase']), float(pulse_params['skew phase']),
+            filekey)
+
+
+def wave_event_data(pulse_type, start, stop, pulse_params, ticks_per_sample, filename=None, num=0):
+    """Generates the I and Q data of a Wave event without creating the event object. Identical pulses are only
+    generated once, the data is taken from the envelope cache and is read-only. Returns the stop time and duration in
+    ticks, which are longer than requested if the pulse does not fit, and the data.
+    :param pulse_type: type of pulse, eg Gauss, Sech etc
+    :param start: start time of the event in ticks
+    :param stop: stop time of the event in ticks
+    :param pulse_params: A dictionary containing parameters for the IQ modulator: amplitude, pulseWidth,
+                        SB frequency, IQ scale factor, phase, skewPhase.
+    :param ticks_per_sample: the sampling time (clock rate) used for this event in ticks
+    :param filename: file the pulse shape is loaded from for Load Wfm pulses
+    :param num: serial number given to the pulse
+    """
+    ssb_freq = float(pulse_params['SB freq'])
+    iqscale = float(pulse_params['IQ scale factor'])
+    phase = float(pulse_params['phase'])
+    amp = float(pulse_params['amplitude'])
+    skew_phase = float(pulse_params['skew phase'])
+    pulsecls, shaped = _WAVE_PULSES[pulse_type]
+    stop, duration, dur_idx, pwidth_idx = wave_event_size(pulse_type, start, stop, pulse_params, ticks_per_sample)
+    if shaped:
+        args = (num, dur_idx, ssb_freq, iqscale, phase, pwidth_idx, amp, skew_phase)
+    else:
+        # for square pulses, the pulsewidth and the duration are the same
+        args = (num, dur_idx, ssb_freq, iqscale, phase, amp, skew_phase)
+    filekey = None
+    if pulse_type == _PULSE_TYPES[-1]:
+        if filename is None:
+            filename = 'test4.txt'
+        if 'IQdata.txt' in str(filename):
+            pulsecls = DataIQ
+        filename = pulseshapedir / filename
+        args = (filename,) + args
+        try:
+            filekey = (str(filename), os.stat(filename).st_mtime_ns)  # a modified file gives a new pulse
+        except OSError:
+            filekey = (str(filename), None)
+    key = wave_event_key(pulse_type, dur_idx, pwidth_idx, pulse_params, filekey)
+
+    def generate():
+        pulse = pulsecls(*args)
+        data = np.zeros((2, dur_idx), dtype=_IQTYPE)
+        pulse.data_generator(out=data)  # the pulse writes its I and Q data straight into the array that is cached
+        return data
+    return stop, duration, envelope_cache.get(key, generate)
+
+
+def wave_batch_data(pulse_type, dur_idx, pulse_params, amps, ssb_freqs, phases, ticks_per_sample, filename=None,
+                    out=None):
+    """Generates the I and Q data of one Wave pulse for many values of its amplitude, SB frequency and phase at once,
+    the same as :func:`wave_event_data` gives for each of them. Returns an array of shape (number of values, 2,
+    dur_idx), or None if the pulse type makes its I and Q data in a way that can not be batched.
+    :param pulse_type: type of pulse, eg Gauss, Sech etc
+    :param dur_idx: length of the pulse in samples
+    :param pulse_params: the pulse params dictionary, for the pulsewidth, IQ scale factor and skew phase
+    :param amps: array of amplitudes
+    :param ssb_freqs: array of SB frequencies
+    :param phases: array of phases in degrees
+    :param ticks_per_sample: the sampling time (clock rate) used for this event in ticks
+    :param filename: file the pulse shape is loaded from for Load Wfm pulses
+    :param out: optional float32 array of shape (number of values, 2, dur_idx) to write the data into, e.g. the slice
+            of the data of a batch of sequences where the pulse is
+    """
+    pulsecls, shaped = _WAVE_PULSES[pulse_type]
+    iqscale = float(pulse_params['IQ scale factor'])
+    skew_phase = float(pulse_params['skew phase'])
+    if shaped:
+        pwidth_idx = to_ticks(pulse_params['pulsewidth']) // ticks_per_sample
+        args = (0, dur_idx, 0.0, iqscale, 0.0, pwidth_idx, 0.0, skew_phase)
+    else:
+        args = (0, dur_idx, 0.0, iqscale, 0.0, 0.0, skew_phase)
+    if pulse_type == _PULSE_TYPES[-1]:
+        if filename is None:
+            filename = 'test4.txt'
+        if 'IQdata.txt' in str(filename):
+            pulsecls = DataIQ
+        args = (pulseshapedir / filename,) + args
+    if pulsecls.MODULATION is None:
+        return None
+    pulse = pulsecls(*args)
+    column = (len(amps), 1)
+    amps = np.asarray(amps, dtype=np.float64).reshape(column) * pulse.vmax / _DAC_UPPER
+    data = pulse.envelope(amps)
+    if out is None:
+        out = np.empty((len(amps), 2, dur_idx), dtype=_IQTYPE)
+    pulse.modulate(data, np.asarray(ssb_freqs, dtype=np.float64).reshape(column),
+                   np.asarray(phases, dtype=np.float64).reshape(column), out=out.swapaxes(0, 1))
+    return out
+
+
+def prefill_wave_events(events, ticks_per_sample):
+    """Generates the I and Q data of many Wave events at once and puts it in the envelope cache, where
+    :func:`wave_event_data` then finds it. The envelopes of each pulse type are made by one call of its
+    :meth:`Pulse.batch_envelopes` for each chunk of pulses of about the same length, of at most about _BATCH_BYTES, and
+    modulated together. Events that are already in the cache, and Load Wfm events, are left to wave_event_data. At most
+    half of the cache is filled, so that the events do not evict each other before they are used. Returns the number
+    of pulses generated.
+    :param events: iterable of the pulse type, start and stop time in ticks and pulse params of each event
+    :param ticks_per_sample: the sampling time (clock rate) used for the events in ticks
+    """
+    groups = {}  # the keys of the pulses of each type and modulation but the phase, in a dict to drop repeats
+    for pulse_type, start, stop, pulse_params in events:
+        if pulse_type not in _WAVE_PULSES or pulse_type == _PULSE_TYPES[-1] or \
+                _WAVE_PULSES[pulse_type][0].MODULATION is None:
+            continue
+        stop, duration, dur_idx, pwidth_idx = wave_event_size(pulse_type, start, stop, pulse_params, ticks_per_sample)
+        key = wave_event_key(pulse_type, dur_idx, pwidth_idx, pulse_params)
+        if key not in envelope_cache:
+            groups.setdefault((pulse_type, key[4], key[5], key[7]), {})[key] = None
+    budget = envelope_cache.max_bytes // 2
+    made = 0
+    for (pulse_type, ssb_freq, iqscale, skew_phase), keys in groups.items():
+        chunk = []
+        # only pulses of about the same length are made together, so that little of the padded arrays is wasted; a
+        # chunk holds the padded envelopes, at most float64, and their I and Q data
+        for key in sorted(keys, key=lambda k: k[1]) + [None]:
+            if chunk and (key is None or key[1] > _PREFILL_PADDING * chunk[0][1] or
+                          (len(chunk) + 1) * key[1] * 4 * _IQTYPE.itemsize > _BATCH_BYTES):
+                made += prefill_chunk(pulse_type, ssb_freq, iqscale, skew_phase, chunk)
+                chunk = []
+            if key is not None and budget >= key[1] * 2 * _IQTYPE.itemsize:
+                budget -= key[1] * 2 * _IQTYPE.itemsize
+                chunk.append(key)
+    return made
+
+
+def prefill_chunk(pulse_type, ssb_freq, iqscale, skew_phase, keys):
+    """Generates the I and Q data of a chunk of pulses of one type, SB freq, IQ scale factor and skew phase with one
+    call of :meth:`Pulse.batch_envelopes`, and puts the data of each pulse in the envelope cache under its key. The
+    pulses share one phase ramp, see :func:`phase_ramp`. Returns the number of pulses.
+    :param pulse_type: type of pulse, eg Gauss, Sech etc
+    :param ssb_freq: the side band frequency
+    :param iqscale: the IQ scale factor
+    :param skew_phase: the skew phase in degrees
+    :param keys: the keys of the pulses, see :func:`wave_event_key`
+    """
+    pulsecls = _WAVE_PULSES[pulse_type][0]
+    column = (len(keys), 1)
+    amps = np.array([k[3] for k in keys]) * 1.0 / _DAC_UPPER  # scaled to the DAC range as the pulse classes do
+    data, widths = pulsecls.batch_envelopes([k[1] for k in keys], [k[2] for k in keys], amps)
+    out = np.empty((2,) + data.shape, dtype=_IQTYPE)
+    if pulsecls.MODULATION == 'iq':
+        iq_modulation(data, ssb_freq, iqscale, np.array([k[6] for k in keys]).reshape(column), skew_phase, out=out)
+    else:
+        out[0] = data if pulsecls.MODULATION == 'i' else 0.0
+        out[1] = data if pulsecls.MODULATION == 'q' else 0.0
+    for row, (key, width) in enumerate(zip(keys, widths.tolist())):
+        envelope_cache.get(key, lambda: np.array(out[:, row, :width]))
+    return len(keys)
+
+
 class WaveEvent(SequenceEvent):
     """Provides functionality for events that are analog in nature. Inherits from :class:`sequence event <SequenceEvent>`
     :param start: start time for event
@@ -256,11 +490,8 @@ class WaveEvent(SequenceEvent):
         self.duration = self.stop - self.start
         self.__pulse_type = pulse_type
         self.extract_pulse_params_from_dict()  # unpack the dictionary of pulse params
-        zerosdata = np.zeros(self.dur_idx, dtype=_IQTYPE)  # create an array ofcc zeros of the right size
-        pulse = Pulse(self.waveidx, self.dur_idx, self.ssb_freq, self.iqscale,
-                      self.phase, self.skewphase)  # create a blank Pulse object
-        pulse.iq_generator(zerosdata)
-        self.data = np.array((pulse.I_data, pulse.Q_data))  # initialize the data to be zero
+        # initialize the data to be zero, the zeros of a given size are shared by all events
+        self.data = envelope_cache.get(('Zeros', self.dur_idx), lambda: np.zeros((2, self.dur_idx), dtype=_IQTYPE))
 
     @property
     def pulse_params(self):
@@ -304,6 +535,16 @@ class WaveEvent(SequenceEvent):
         self.__skew_phase = float(self.pulse_params['skew phase'])
         self.__npulses = int(self.pulse_params['num pulses'])  # not needed for a single WaveEvent
 
+    def make_data(self, filename=None):
+        """Generates the data of the event with :func:`wave_event_data`, making the event longer if needed
+        :param filename: file the pulse shape is loaded from, if any
+        """
+        stop, duration, self.data = wave_event_data(self.pulse_type, to_ticks(self.start), to_ticks(self.stop),
+                                                     self.pulse_params, to_ticks(self.sampletime), filename=filename,
+                                                     num=self.waveidx)
+        self.stop = from_ticks(stop)
+        self.duration = from_ticks(duration)
+
     @property
     def data(self):
         return self.__data
@@ -348,15 +589,7 @@ class GaussPulse(WaveEvent):
                          dt=dt, sampletime=sampletime)
         self.pulse_type = self.PULSE_KEYWORD
         self.extract_pulse_params_from_dict()
-        pwidth_idx = int(self.pulsewidth / self.sampletime)
-        # if duration < 6 * pulsewidth, set it equal to at least that much
-        if self.duration < 8 * self.pulsewidth:
-            self.duration = 8 * self.pulsewidth
-            self.stop = self.start + self.duration
-        pulse = Gaussian(self.waveidx, self.dur_idx, self.ssb_freq, self.iqscale, self.phase,
-                         pwidth_idx, self.amplitude, self.skewphase)
-        pulse.data_generator()  # generate the data
-        self.data = np.array((pulse.I_data, pulse.Q_data))
+        self.make_data()
 
 
 class SechPulse(WaveEvent):
@@ -368,17 +601,7 @@ class SechPulse(WaveEvent):
                          dt=dt, sampletime=sampletime)
         self.pulse_type = self.PULSE_KEYWORD
         self.extract_pulse_params_from_dict()
-        pwidth_idx = int(self.pulsewidth / self.sampletime)
-        if self.duration < 8 * self.pulsewidth:
-            self.duration = 8 * self.pulsewidth
-            self.stop = self.start + self.duration
-
-        # print(f'original pulsewidth {self.pulsewidth} converted pulsewidth {pwidth_idx}')
-        # data = np.arange(self.duration * 1.0)
-        pulse = Sech(self.waveidx, self.dur_idx, self.ssb_freq, self.iqscale, self.phase,
-                     pwidth_idx, self.amplitude, self.skewphase)
-        pulse.data_generator()  # generate the data
-        self.data = np.array((pulse.I_data, pulse.Q_data))
+        self.make_data()
 
 
 class SquarePulse(WaveEvent):
@@ -390,15 +613,7 @@ class SquarePulse(WaveEvent):
                          dt=dt, sampletime=sampletime)
         self.pulse_type = self.PULSE_KEYWORD
         self.extract_pulse_params_from_dict()
-        # for square pulses, the pulsewidth and the duration are the same, so we comment out the next few lines
-        # pwidth_idx = int(self.pulsewidth / self.sampletime)
-        # if self.duration < 6 * self.pulsewidth:
-        #     self.duration = 6 * self.pulsewidth
-        #     self.stop = self.start + self.duration
-        pulse = Square(self.waveidx, self.dur_idx, self.ssb_freq, self.iqscale, self.phase, self.amplitude,
-                       self.skewphase)
-        pulse.data_generator()  # generate the data
-        self.data = np.array((pulse.I_data, pulse.Q_data))
+        self.make_data()
 
 
 class LorentzPulse(WaveEvent):
@@ -410,14 +625,8 @@ class LorentzPulse(WaveEvent):
                          dt=dt, sampletime=sampletime)
         self.pulse_type = self.PULSE_KEYWORD
         self.extract_pulse_params_from_dict()
-        pwidth_idx = int(self.pulsewidth / self.sampletime)
-        if self.duration < 8 * self.pulsewidth:
-            self.duration = 8 * self.pulsewidth
-            self.stop = self.start + float(self.duration)
-        pulse = Lorentzian(self.waveidx, self.dur_idx, self.ssb_freq, self.iqscale, self.phase, pwidth_idx,
-                           self.amplitude, self.skewphase)
-        pulse.data_generator()  # generate the data
-        self.data = np.array((pulse.I_data, pulse.Q_data))
+        self.make_data()
+
 
 class GeronoPulse(WaveEvent):
     """Generates a Wave event with a Gerono shape"""
@@ -428,15 +637,8 @@ class GeronoPulse(WaveEvent):
                          dt=dt, sampletime=sampletime)
         self.pulse_type = self.PULSE_KEYWORD
         self.extract_pulse_params_from_dict()
-        pwidth_idx = int(self.pulsewidth / self.sampletime)
-        # if duration < 6 * pulsewidth, set it equal to at least that much
-        if self.duration < 8 * self.pulsewidth:
-            self.duration = 8 * self.pulsewidth
-            self.stop = self.start + self.duration
-        pulse = Gerono(self.waveidx, self.dur_idx, self.ssb_freq, self.iqscale, self.phase,
-                         pwidth_idx, self.amplitude, self.skewphase)
-        pulse.data_generator()  # generate the data
-        self.data = np.array((pulse.I_data, pulse.Q_data))
+        self.make_data()
+
 
 class SquarePulseI(WaveEvent):
     """Generates a Wave event with a Square shape, only outputs on I channel"""
@@ -447,15 +649,7 @@ class SquarePulseI(WaveEvent):
                          dt=dt, sampletime=sampletime)
         self.pulse_type = self.PULSE_KEYWORD
         self.extract_pulse_params_from_dict()
-        # for square pulses, the pulsewidth and the duration are the same, so we comment out the next few lines
-        # pwidth_idx = int(self.pulsewidth / self.sampletime)
-        # if self.duration < 6 * self.pulsewidth:
-        #     self.duration = 6 * self.pulsewidth
-        #     self.stop = self.start + self.duration
-        pulse = SquareI(self.waveidx, self.dur_idx, self.ssb_freq, self.iqscale, self.phase, self.amplitude,
-                        self.skewphase)
-        pulse.data_generator()  # generate the data
-        self.data = np.array((pulse.I_data, pulse.Q_data))
+        self.make_data()
 
 
 class SquarePulseQ(WaveEvent):
@@ -467,15 +661,7 @@ class SquarePulseQ(WaveEvent):
                          dt=dt, sampletime=sampletime)
         self.pulse_type = self.PULSE_KEYWORD
         self.extract_pulse_params_from_dict()
-        # for square pulses, the pulsewidth and the duration are the same, so we comment out the next few lines
-        # pwidth_idx = int(self.pulsewidth / self.sampletime)
-        # if self.duration < 6 * self.pulsewidth:
-        #     self.duration = 6 * self.pulsewidth
-        #     self.stop = self.start + self.duration
-        pulse = SquareQ(self.waveidx, self.dur_idx, self.ssb_freq, self.iqscale, self.phase, self.amplitude,
-                        self.skewphase)
-        pulse.data_generator()  # generate the data
-        self.data = np.array((pulse.I_data, pulse.Q_data))
+        self.make_data()
 
 
 class ArbitraryPulse(WaveEvent):
@@ -491,17 +677,7 @@ class ArbitraryPulse(WaveEvent):
         self.pulse_type = self.PULSE_KEYWORD
         self.filename = pulseshapedir / filename
         self.extract_pulse_params_from_dict()
-        pwidth_idx = int(self.pulsewidth / self.sampletime)
-        if self.duration < 8 * self.pulsewidth:
-            self.duration = 8 * self.pulsewidth
-            self.stop = self.start + float(self.duration)
-        pulse = LoadWave(self.filename, self.waveidx, self.dur_idx, self.ssb_freq, self.iqscale, self.phase,
-                         pwidth_idx, self.amplitude, self.skewphase)
-        if 'IQdata.txt' in filename:
-            pulse = DataIQ(self.filename, self.waveidx, self.dur_idx, self.ssb_freq, self.iqscale, self.phase,
-                           pwidth_idx, self.amplitude, self.skewphase)
-        pulse.data_generator()  # generate the data
-        self.data = np.array((pulse.I_data, pulse.Q_data))
+        self.make_data(filename)
 
 
 class MarkerEvent(SequenceEvent):
@@ -667,7 +843,7 @@ class Channel:
     """
 
     def __init__(self, ch_type=None, event_train=None, delay=None, pulse_params=None, connection_dict=None,
-                 event_channel_idx=0, sampletime=1.0 * _ns,**kwargs):
+                 event_channel_idx=0, sampletime=1.0 * _ns, event_table=None, **kwargs):
 
         if ch_type is None:
             ch_type = _MARKER
@@ -679,15 +855,21 @@ class Channel:
             connection_dict = _CONN_DICT
         if event_train is None:
             event_train = []  # add empty event
+        if event_table is None:
+            event_table = EventTable(sampletime)
         # super().__init__(**kwargs)
         self.logger = logging.getLogger('seqlogger.channel')
-        self.event_train = event_train
+        # the events are stored in an event table, which may be shared with other channels of the sequence, and the
+        # channel only keeps the numbers of the rows that hold its events
+        self.table = event_table
+        self.rows = [self.table.append_event(evt) for evt in event_train]
+        self.index = EventIndex(self.table, self.rows)  # the rows sorted by time, for extents and overlap queries
         self.delay = delay
         self.pulse_params = pulse_params
         self.connection_dict = connection_dict
         self.sampletime = sampletime
         # set various object variables
-        self.num_of_events = len(self.event_train)  # number of events in the channel
+        self.num_of_events = len(self.rows)  # number of events in the channel
         self.event_channel_index = event_channel_idx  # index of event in channel
         self.latest_channel_event = 0  # channel event with latest time
         self.first_channel_event = 0  # channel event with earliest time
@@ -695,19 +877,33 @@ class Channel:
         #
         if self.num_of_events == 1 or self.num_of_events == 0:
             self.separation = 0.0
-        # array storing all the start and stop times in this channel
-        self.event_start_times = []
-        self.event_stop_times = []
-        self.event_durations = []
-        for idx, evt in self.event_train:
-            self.event_start_times.append(evt.start)
-            self.event_stop_times.append(evt.stop)
 
         self.set_first_channel_event()
         self.set_latest_channel_event()
 
+    @property
+    def events(self):
+        """The rows of the event table that hold the events of this channel, as a structured array"""
+        return self.table.events[self.rows]
+
+    @property
+    def event_train(self):
+        """The events of this channel as a list of objects, changing them changes the event table. Call
+        self.index.rebuild(self.rows) after changing their times so that the index stays sorted."""
+        return [EventView(self.table, row) for row in self.rows]
+
+    @property
+    def event_start_times(self):
+        """sorted array storing all the start times in this channel"""
+        return from_ticks(np.array(self.index.starts, dtype=np.int64))
+
+    @property
+    def event_stop_times(self):
+        """sorted array storing all the stop times in this channel"""
+        return from_ticks(np.array(self.index.stops, dtype=np.int64))
+
     def add_event(self, time_on=1e-6, time_off=1.1e-6, pulse_type="Green", start_inc=0.0, stop_inc=0.0, dt=0.0,
-                  fname=None):
+                  fname=None, offsets=None, phase=None):
         """This method adds one event of a given type to the channel
         :param time_on: starting time of the event
         :param time_off: ending time of the event
@@ -716,61 +912,49 @@ class Channel:
         :param stop_inc: increment for stop time
         :param dt: increment for start and stop times
         :param fname: filename used for arbitrary pulse shapes
+        :param offsets: the amounts in ticks that the start and stop times are moved by, if given they are used instead
+                of dt times the increments, see :meth:`ParsedSequence.time_offsets`
+        :param phase: phase of the pulse in degrees, defaults to the phase in the pulse params
         """
         self.num_of_events += 1
         self.event_channel_index += 1
-        temp_pulseparams = self.pulse_params.copy()
-        event = SequenceEvent()  # no need for this statement, but pycharm complains event may be assigned before ref?
-        # TODO: simplify this remaining code using a dictionary or other function reference list and a for loop
+        # the times are kept as integer ticks from here on
+        if offsets is None:
+            dt = to_ticks(dt)
+            offsets = (round(dt * float(start_inc)), round(dt * float(stop_inc)))
+        start = to_ticks(time_on) + int(offsets[0])
+        stop = to_ticks(time_off) + int(offsets[1])
+        duration = None
+        data = None
         if self.ch_type == _WAVE or self.ch_type == _RANDBENCH:
-            if pulse_type == _PULSE_TYPES[0]:
-                event = GaussPulse(start=time_on, stop=time_off, pulse_params=temp_pulseparams, start_inc=start_inc,
-                                   stop_inc=stop_inc, dt=dt, sampletime=self.sampletime)
-            elif pulse_type == _PULSE_TYPES[1]:
-                event = SechPulse(start=time_on, stop=time_off, pulse_params=temp_pulseparams, start_inc=start_inc,
-                                  stop_inc=stop_inc, dt=dt, sampletime=self.sampletime)
-            elif pulse_type == _PULSE_TYPES[2]:
-                event = SquarePulse(start=time_on, stop=time_off, pulse_params=temp_pulseparams, start_inc=start_inc,
-                                    stop_inc=stop_inc, dt=dt, sampletime=self.sampletime)
-            elif pulse_type == _PULSE_TYPES[3]:
-                event = LorentzPulse(start=time_on, stop=time_off, pulse_params=temp_pulseparams, start_inc=start_inc,
-                                     stop_inc=stop_inc, dt=dt, sampletime=self.sampletime)
-            elif pulse_type == _PULSE_TYPES[4]:
-                event = SquarePulseI(start=time_on, stop=time_off, pulse_params=temp_pulseparams, start_inc=start_inc,
-                                     stop_inc=stop_inc, dt=dt, sampletime=self.sampletime)
-            elif pulse_type == _PULSE_TYPES[5]:
-                event = SquarePulseQ(start=time_on, stop=time_off, pulse_params=temp_pulseparams, start_inc=start_inc,
-                                     stop_inc=stop_inc, dt=dt, sampletime=self.sampletime)
-            elif pulse_type == _PULSE_TYPES[6]:
-                event = GeronoPulse(start=time_on, stop=time_off, pulse_params=temp_pulseparams, start_inc=start_inc,
-                                     stop_inc=stop_inc, dt=dt, sampletime=self.sampletime)
-            elif pulse_type == _PULSE_TYPES[-1]:
-                event = ArbitraryPulse(start=time_on, stop=time_off, pulse_params=temp_pulseparams,
-                                       start_inc=start_inc,
-                                       stop_inc=stop_inc, filename=fname, dt=dt, sampletime=self.sampletime)
-        elif pulse_type == _GREEN_AOM:
-            event = Green(start=time_on, stop=time_off, connection_dict=self.connection_dict, start_inc=start_inc,
-                              stop_inc=stop_inc, dt=dt, sampletime=self.sampletime)
-        elif pulse_type == _ADWIN_TRIG:
-            event = Measure(start=time_on, stop=time_off, connection_dict=self.connection_dict, start_inc=start_inc,
-                                stop_inc=stop_inc, dt=dt, sampletime=self.sampletime)
-        elif pulse_type == _MW_S1:
-            event = S1(start=time_on, stop=time_off, connection_dict=self.connection_dict, start_inc=start_inc,
-                           stop_inc=stop_inc, dt=dt, sampletime=self.sampletime)
-        elif pulse_type == _MW_S2:
-            event = S2(start=time_on, stop=time_off, connection_dict=self.connection_dict, start_inc=start_inc,
-                           stop_inc=stop_inc, dt=dt, sampletime=self.sampletime)
-        else:
-            event = SequenceEvent(start=time_on, stop=time_off, start_increment=start_inc,
-                                  stop_increment=stop_inc, sampletime=self.sampletime)
-            event.increment_time(dt=dt)
-        self.event_train.append(event)
-        self.event_start_times.append(event.start)
-        self.event_stop_times.append(event.stop)
+            if pulse_type in _WAVE_PULSES:
+                stop, duration, data = wave_event_data(pulse_type, start, stop, self.phase_params(phase),
+                                                       self.table.ticks_per_sample, filename=fname)
+            else:
+                self.logger.error('Type error: Pulse type must be in list of pulse types allowed:%s', _PULSE_TYPES)
+        elif pulse_type not in _MARKER_ROUTES:
+            pulse_type = ''  # a plain sequence event
+        # marker events have no data, they are rendered from their start and stop indices
+        row = self.table.append(start, stop, duration=duration, start_increment=start_inc, stop_increment=stop_inc,
+                                pulse_type=pulse_type, data=data)
+        self.rows.append(row)
+        self.index.insert(row)
+
+    def phase_params(self, phase=None):
+        """Returns the pulse params with the phase replaced by phase, or the pulse params themselves if it is None
+        :param phase: phase in degrees
+        """
+        if phase is None:
+            return self.pulse_params
+        params = self.pulse_params.copy()
+        params['phase'] = phase
+        return params
 
     def add_event_train(self, time_on=1e-6, time_off=1.1e-6, separation=0.0, events_in_train=1, pulse_type='Gauss',
-                        start_inc=0.0, stop_inc=0.0, dt=0.0, fname=None):
-        """This method adds multiple events to the channel
+                        start_inc=0.0, stop_inc=0.0, dt=0.0, fname=None, offsets=None, phases=None):
+        """This method adds multiple events to the channel. The events after the first one are added to the event table
+        as one train, see :meth:`EventTable.append_train`, so their envelope is made once per phase rather than once per
+        event, and the train is marked in the table so that it is rendered by tiling its envelopes into the data.
         :param time_on: starting time of the event
         :param time_off: ending time of the event
         :param separation: optional separation between the events
@@ -780,25 +964,55 @@ class Channel:
         :param stop_inc: stop increment multiplier
         :param dt: amount to increment
         :param fname: filename for arbitrary pulses
+        :param offsets: the amounts in ticks that the start and stop times of the first event are moved by
+        :param phases: optional list of phases in degrees, which are added in turn to the phase of the events, e.g.
+                0, 90, 0, 90, 90, 0, 90, 0 for an XY8 train
         """
-
+        cycle = [None]  # the phase of each event of the phase cycle
+        if phases:
+            phase = float(self.pulse_params['phase'])
+            cycle = [(phase + float(p)) % 360.0 for p in phases]
         # add this pulse to the current pulse channel
         self.add_event(time_on=time_on, time_off=time_off, pulse_type=pulse_type, start_inc=start_inc,
-                       stop_inc=stop_inc, dt=dt, fname=fname)  # make sure we add the increment first
-        width = self.event_train[0].duration
-        sep = float(separation)
+                       stop_inc=stop_inc, dt=dt, fname=fname, offsets=offsets,
+                       phase=cycle[0])  # make sure we add the increment first
+        first = self.rows[-1]
         if events_in_train > 1:
-            for nn in range(events_in_train - 1):
-                t_on = time_on + (nn + 1) * (width + sep)
-                t_off = time_off + (nn + 1) * (width + sep)
-                # no need to add any more increments
-                self.add_event(time_on=t_on, time_off=t_off, pulse_type=pulse_type, fname=fname)
+            count = int(events_in_train) - 1
+            # no need to add any more increments
+            period = int(self.table.events['duration'][self.rows[0]]) + to_ticks(float(separation))
+            start = to_ticks(time_on) + period
+            stop = to_ticks(time_off) + period
+            duration = None
+            data = None
+            if self.ch_type == _WAVE or self.ch_type == _RANDBENCH:
+                if pulse_type in _WAVE_PULSES:
+                    # the events after the first one all have the same length, so one envelope per phase is enough
+                    data = []
+                    for k in range(1, len(cycle) + 1):
+                        end, duration, env = wave_event_data(pulse_type, start, stop,
+                                                             self.phase_params(cycle[k % len(cycle)]),
+                                                             self.table.ticks_per_sample, filename=fname)
+                        data.append(env)
+                    stop = end
+                else:
+                    self.logger.error('Type error: Pulse type must be in list of pulse types allowed:%s', _PULSE_TYPES)
+            elif pulse_type not in _MARKER_ROUTES:
+                pulse_type = ''  # a plain sequence event
+            rows = self.table.append_train(start, stop, count, period, duration=duration, pulse_type=pulse_type,
+                                           data=data)
+            self.table.add_train(first, events_in_train, len(cycle))
+            self.rows.extend(rows)
+            self.index.extend(rows)
+            self.num_of_events += count
+            self.event_channel_index += count
         self.set_latest_channel_event()
         self.set_first_channel_event()
 
     def delete_event(self, index):
         if self.num_of_events > 0:
-            evt = self.event_train.pop(index)
+            row = self.rows.pop(index)  # the row stays in the table but no longer belongs to the channel
+            self.index.remove(row)
             self.num_of_events -= 1
             self.event_channel_index -= 1
             self.set_latest_channel_event()
@@ -807,37 +1021,46 @@ class Channel:
         else:
             return False
 
+    def push_window(self):
+        """Returns the earliest start time, the latest stop time and the push time in ticks, which are used to move the
+        events of other channels that would conflict with the events of this channel"""
+        if self.num_of_events == 0:
+            return 0, 0, 0
+        earliest_start_time = self.index.first_start
+        latest_stop_time = max(0, self.index.last_stop)
+        push_time = self.index.last_start - earliest_start_time
+        return earliest_start_time, latest_stop_time, push_time
+
+    def push_events(self, earliest_start_time, latest_stop_time, push_time):
+        """Moves the events that start between the earliest start time and the latest stop time of another set of
+        events later by push_time, so that they do not conflict with those events.
+        :param earliest_start_time: start of the time window in ticks
+        :param latest_stop_time: end of the time window in ticks
+        :param push_time: time in ticks by which the events are moved
+        Returns True if any event was moved.
+        """
+        if push_time == 0:
+            return False  # nothing would move
+        conflicts = self.index.starting_between(earliest_start_time, latest_stop_time)
+        if len(conflicts) > 0:
+            self.table.shift(conflicts, push_time)
+            self.index.rebuild(self.rows)
+        return len(conflicts) > 0
+
     def insert_channel_events(self, newchan):
         """This method inserts new events from another channel into the channel of the same type"""
         # if the new channel events conflict with the current channel we need to insert it carefully
-        earliest_start_time = self.first_channel_event
-        latest_stop_time = self.latest_channel_event
-        latest_start_time = np.amax(np.array(self.event_start_times, dtype=np.float32))
-        push_time = float(latest_start_time - earliest_start_time)
+        earliest_start_time, latest_stop_time, push_time = self.push_window()
 
         if self.ch_type == newchan.ch_type:
-            events = newchan.event_train  # get all the events in the newchan
-            self.num_of_events += len(events)  # update the number of events
-            self.event_channel_index += len(events)  # update the event index
-            for idx, evt in enumerate(newchan.event_train):
-                # store any values of the start_increment and stop intcrement from the event
-                temp1 = evt.start_increment
-                temp2 = evt.stop_increment
-                # check if the inserted channel start time conflicts with previous start times
-                if (evt.start > earliest_start_time) and (evt.start < latest_stop_time):
-                    evt.start_increment = 1  # set the increments to 1
-                    evt.stop_increment = 1
-                    evt.increment_time(dt=push_time)  # increment the event
-                # restore the old values of increment
-                evt.start_increment = temp1
-                evt.stop_increment = temp2
-            self.event_train.extend(events)  # extend the channel with these events
-            self.event_start_times.extend(newchan.event_start_times)  # extend the start times
-            self.event_stop_times.extend(newchan.event_stop_times)  # extedn the stop times
-            # store the new start and stop times in the arrays
-            for idx, evt in enumerate(self.event_train):
-                self.event_start_times[idx] = evt.start
-                self.event_stop_times[idx] = evt.stop
+            if newchan.table is not self.table:
+                newchan = Channel(ch_type=newchan.ch_type, event_train=newchan.event_train, event_table=self.table)
+            self.num_of_events += newchan.num_of_events  # update the number of events
+            self.event_channel_index += newchan.num_of_events  # update the event index
+            # check if the inserted channel start times conflict with previous start times
+            newchan.push_events(earliest_start_time, latest_stop_time, push_time)
+            self.rows.extend(newchan.rows)  # extend the channel with these events
+            self.index.extend(newchan.rows)
             # update the first and latest channel events
             self.set_first_channel_event()  # keep track of the new first channel event
             self.set_latest_channel_event()  # and the last channel event
@@ -848,31 +1071,25 @@ class Channel:
         # self.set_latest_sequence_event()
 
     def has_coincident_events(self):
-        found_coincident_event = False
-        evt_on_times = []
-        # evt_off_times = []
-        for evt in self.event_train:
-            evt_on_times.extend(evt.t1_idx)
-        if len(evt_on_times) > len(set(evt_on_times)):
-            found_coincident_event = True
-        return found_coincident_event
+        return self.index.has_coincident_events()
+
+    def overlapping_events(self, time_on, time_off):
+        """Returns the events of this channel that overlap a window of time
+        :param time_on: beginning of the window
+        :param time_off: end of the window
+        """
+        return [EventView(self.table, row) for row in self.index.overlapping(to_ticks(time_on), to_ticks(time_off))]
 
     def set_first_channel_event(self):
-        if self.num_of_events > 1:
-            self.first_channel_event = sorted(self.event_train, key=lambda x: x.start)[0].start
-        elif self.num_of_events == 1:
-            self.first_channel_event = self.event_train[0].start
+        if self.num_of_events > 0:
+            self.first_channel_event = from_ticks(self.index.first_start)
         else:
             self.first_channel_event = 0
-        self.event_start_times.sort()  # we will also keep this array sorted
 
     def set_latest_channel_event(self):
         self.latest_channel_event = 0
-        for i in range(self.num_of_events):
-            if self.event_train[i].stop > self.latest_channel_event:
-                self.latest_channel_event = self.event_train[i].stop
-
-        self.event_stop_times.sort()
+        if self.num_of_events > 0:
+            self.latest_channel_event = from_ticks(max(0, self.index.last_stop))
 
     # def get_event_start_times(self):
     #     for idx, evt in self.event_train:
@@ -952,23 +1169,57 @@ class RandomGateChannel(Channel):
             kwargdic['numcompgateseqs']= 4
         if 'compseqnum' not in kwargdic:
             kwargdic['compseqnum']= 1
+        if 'rng' not in kwargdic:
+            kwargdic['rng'] = random  # the module level generator unless the sequence gives us a seeded one
         self.lengths_list = kwargdic['lengths_list']
         self.num_comp_gate_seqs = kwargdic['numcompgateseqs']
         self.change_width = kwargdic['change_width']
         self.change_amp = kwargdic['change_amp']
         self.comp_seq_num = kwargdic['compseqnum']
-
+        self.rng = kwargdic['rng']
 
     def set_pauli_num(self,num=0):
         self.num_comp_gate_seqs = num
     def set_lengths_list(self,trunc_lengths:list):
         self.lengths_list = trunc_lengths
 
+    def save_comp_seq(self, Ng=4, l_max=100):
+        """Loads the Ng computational gate sequences of length l_max from the RB_Pauli.txt file, or generates them and
+        saves them to that file if it does not exist yet.
+        :param Ng: number of computational gate sequences
+        :param l_max: number of computational gates in each sequence
+        """
+        comp_gates = ['(+pi/2_x)', '(+pi/2_y)', '(-pi/2_x)', '(-pi/2_y)']  # The set of Comp. gates
+        loc = maindir / 'SeqDesigns/RB/'
+        file = loc / 'RB_Pauli.txt'
+        try:
+            os.mkdir(loc)
+        except FileExistsError:
+            pass
+
+        if os.path.exists(file):
+            Comp_seq_list = np.genfromtxt(file, dtype=str, delimiter='\n')
+            Comp_seq_list = Comp_seq_list.reshape(int(len(Comp_seq_list) / l_max), l_max)
+        else:
+            Comp_seq_list = []
+            for i in range(Ng):
+                Comp_seq_list.append([])
+            for seq in Comp_seq_list:
+                for i in range(l_max):
+                    seq.append(self.rng.choice(comp_gates))
+            f = open(file, 'w')
+            for i in Comp_seq_list:
+                for j in i:
+                    f.write(j + '\n')
+            f.close()
+        return Comp_seq_list
+
     def add_event_train(self,time_on=1e-6, time_off=1.1e-6, separation=0.0, events_in_train=1, pulse_type='Gauss',
-                        start_inc=0.0, stop_inc=0.0, dt=0.0, fname=None):
+                        start_inc=0.0, stop_inc=0.0, dt=0.0, fname=None, offsets=None):
         """This function implements a channel that will randomize the pulse sequence.
         :param events_in_train: length of the computational gate sequence
         :param separation: separation between events
+        :param offsets: the amounts in ticks that the start and stop times of the first event are moved by
         """
         """we have 3 types of pulses to generate: Pauli Gates (pi_x, pi_y and pi_z), Computational Gates (pi/2_x, 
         pi/2_y, pi/2_z) and the R gate (This is a custom gate to make sure the final measurement is an eigenstate of 
@@ -986,7 +1237,6 @@ class RandomGateChannel(Channel):
         # truncated Nl times.
         Ng = self.num_comp_gate_seqs  # Number of Computational gate sequences
         pauli_gates = ['(identity)', '(+pi_x)', '(+pi_y)', '(+pi_z)', '(-pi_x)', '(-pi_y)', '(-pi_z)']  # The Set of Pauli gates
-        comp_gates = ['(+pi/2_x)', '(+pi/2_y)', '(-pi/2_x)', '(-pi/2_y)']  # The set of Comp. gates
 
 
 
@@ -1068,36 +1318,6 @@ class RandomGateChannel(Channel):
                                     '(-pi_z)': '(identity)'
                                     }
         """
-        Generate the Ng computational gate sequences
-        """
-
-        def save_comp_seq(Ng, l_max):
-
-            loc = maindir / 'SeqDesigns/RB/'
-            file = loc / 'RB_Pauli.txt'
-            try:
-                os.mkdir(loc)
-            except FileExistsError:
-                pass
-
-            if os.path.exists(file):
-                Comp_seq_list = np.genfromtxt(file, dtype=str, delimiter='\n')
-                Comp_seq_list = Comp_seq_list.reshape(int(len(Comp_seq_list) / l_max), l_max)
-            else:
-                Comp_seq_list = []
-                for i in range(Ng):
-                    Comp_seq_list.append([])
-                for seq in Comp_seq_list:
-                    for i in range(l_max):
-                        seq.append(random.choice(comp_gates))
-                f = open(file, 'w')
-                for i in Comp_seq_list:
-                    for j in i:
-                        f.write(j + '\n')
-                f.close()
-            return Comp_seq_list
-
-        """
         Choose one of the Ng sequences (j = 0, .. , Ng-1)  truncate it to length l 
         """
 
@@ -1110,7 +1330,7 @@ class RandomGateChannel(Channel):
         def gen_P_list(l):
             P_list = []
             for i in range(l + 2):
-                P_list.append(random.choice(pauli_gates))
+                P_list.append(self.rng.choice(pauli_gates))
             return P_list
 
         def find_R(gate_list):
@@ -1125,7 +1345,7 @@ class RandomGateChannel(Channel):
                                1) or np.allclose(
                     abs(np.inner(np.ndarray.flatten(z1), np.ndarray.flatten(np.matmul(M2, z0)))), 1):
                     Rlist.append(i)
-            R = random.choice(Rlist)
+            R = self.rng.choice(Rlist)
             M3 = np.matmul(r_gate[R], M)
             if np.isclose(abs(np.inner(np.ndarray.flatten(z0), np.ndarray.flatten(np.matmul(M3, z0)))), 1):
                 final_state = 'z0'
@@ -1262,7 +1482,7 @@ class RandomGateChannel(Channel):
             idx = (np.abs(lst - K)).argmin()
             return lst[idx]
 
-        Comp_seq_list = save_comp_seq(Ng, l_max)
+        Comp_seq_list = self.save_comp_seq(Ng, l_max)
         # find the length that is closest to the truncation lengths list
         length = closest(self.lengths_list,events_in_train)
         #length = self.lengths_list[events_in_train]  # Choose the truncation length from the L list (l=0,..,Nl-1).
@@ -1287,7 +1507,7 @@ class RandomGateChannel(Channel):
         # create first event with an event width given by multiplying the width factor if needed
         event_width = (time_off - time_on)*widthfactor
         self.add_event(time_on=time_on, time_off=time_on+event_width, pulse_type=pulse_type, start_inc=start_inc,
-                       stop_inc=stop_inc, dt=dt, fname=fname)  # make sure we add the increment first
+                       stop_inc=stop_inc, dt=dt, fname=fname, offsets=offsets)  # make sure we add the increment first
         # if the event width is too small, update it to the correct duration
         # if self.event_train[0].duration > event_width:
         #     event_width = self.event_train[0].duration
@@ -1315,218 +1535,104 @@ class RandomGateChannel(Channel):
 
 
 
-def find_start_stop_increment_times(pulse):
-    """This method finds the start, stop and increment factors from a list of strings"""
-    start, stop, start_increment, stop_increment = (0.0, 0.0, 0.0, 0.0)
-    if '+' in pulse[1]:
-        t1, t2 = pulse[1].split('+')  # '1000+2t' becomes '1000' and '2t'
-        start = float(t1)
-        if t2 == 't':
-            start_increment = 1.0
-        else:
-            start_increment = float(t2[:-1])
-    else:
-        start = float(pulse[1])
-    if '+' in pulse[2]:
-        t1, t2 = pulse[2].split('+')
-        stop = float(t1)
-        if t2 == 't':
-            stop_increment = 1.0
-        else:
-            stop_increment = float(t2[:-1])
-    else:
-        stop = float(pulse[2])
-    return start, stop, start_increment, stop_increment
-
+# a term of a time expression: an optional number, then optionally a scan variable, which may be the power of a base,
+# e.g. '1e-6', 't', '2t', '0.5*t', '20e-9*n' or '1e-9*2^n'
+_TIME_TERM = re.compile(r'(?P<coef>(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?)?(?P<mul>\*)?'
+                        r'(?:(?P<base>\d+\.?\d*)\^)?(?P<var>[tn])?')
 
-class Sequence:
-    def __init__(self, seqtext=None, delay=None, pulseparams=None, connectiondict=None, timeres=1):
-        """Class that implements a collection of :class:`channels <Channel>`
-            :param seqtext: string that specifies sequence in the form 'type,start,stop, optionalparams'\n,
-            eg. here is Rabi sequence 'S1,1e-6,1.01e-6+t\nGreen,1.02e-6+t,4.02e-6+t\nMeasure,1.02e-6+t,1.12e-6+t'
-            for a gaussian pulse would use 'Wave,1e-6,1e-6+t,Gauss\nGreen,2e-6+t,5e-6+t\nMeasure,2e-6+t,
-            2.1e-6+t'
-            :param delay: list with [AOM delay, MW delay] , possibly other delays to be added.
-            :param pulseparams: a dictionary containing the amplitude, pulsewidth,SB frequency,IQ scale factor,
-                        phase, skewphase
-            :param connectiondict: a dictionary of the connections between AWG channels and switches/IQ modulators
-            :param timeres: clock rate in ns
 
-            After creating the instance, call the method create_sequence with an optional increment of time ,
-            and then the arrays created will be: wavedata (analag I and Q data), c1markerdata, c2markerdata
-        """
-        if delay is None:
-            delay = [0.0, 0.0]
-        self.logger = logging.getLogger('seqlogger.seq_class')  # start the class logger
-        if seqtext is None:
-            seqtext = 'Green,0.6e-6,0.7e-6\nWave,1e-6+t,1.5e-6+t,SquareI,a=0.5,n=2\nMeasure,1.5e-6+t,1.8e-6+t'
-        self.seq = []
-        self.convert_text_to_seq(seqtext)  # this function creates the seq object, a list of list of strings
-        self.timeres = float(timeres) * _ns  # old code was written assuming everything in ns, so fix that
-        self.rb_nevents = 1  # this was created to account for the nevents variable when the scan is a random scan
-        self.rbinfo_list = []  # a list created to save the random scan info (final states and final sequences)
-        if pulseparams is None:
-            self.pulseparams = _PULSE_PARAMS
-        # if pulseparams == None:
-        #    self.pulseparams = {'amplitude': 100, 'pulsewidth': 20, 'SB freq': 0.00, 'IQ scale factor': 1.0,'phase': 0.0, 'skew phase':0.0, 'num pulses': 1}
-        else:
-            self.pulseparams = pulseparams
-        if connectiondict is None:
-            self.connectiondict = _CONN_DICT
+def parse_time_expression(text):
+    """Parses the start or stop time of a line of the sequence, a sum of terms such as '1e-6+t', '1e-6-2t+20e-9*n' or
+    '1e-6+1e-9*2^n'. A number on its own is a time in seconds. 't' is the scanned time of a time scan, and a number in
+    front of it multiplies it. 'n' is the index of the scan point, and a number in front of it is a time in seconds,
+    so '20e-9*n' moves the time by 20 ns per point. 'R^n' with a number R gives times that grow geometrically with the
+    index. Returns the constant time in seconds and a dictionary of the multiplier of each variable term, whose keys are
+    ('t', None), ('n', None) or ('n', R).
+    :param text: the time as a string
+    """
+    const = 0.0
+    terms = {}
+    expr = re.sub(r'\s+', '', text)
+    # split the sum before each sign, except for the sign of an exponent
+    for term in re.split(r'(?<![eE])(?=[+-])', expr):
+        sign = -1.0 if term.startswith('-') else 1.0
+        term = term.lstrip('+-')
+        m = _TIME_TERM.fullmatch(term)
+        if not term or m is None or ((m.group('mul') or m.group('base')) and not m.group('var')) or \
+                (m.group('base') and m.group('var') != 'n') or (m.group('mul') and not m.group('coef')):
+            raise ValueError("Can not understand the time '{0}'".format(text))
+        coef = sign * float(m.group('coef')) if m.group('coef') else sign
+        if m.group('var') is None:
+            const += coef
         else:
-            self.connectiondict = connectiondict
-        self.delay = delay
-        #
-        self.num_of_channels = 0
-        self.num_of_wait_events = 0
-        self.channels = []
-        self.channel_sampletimes = []
-        self.seq_channel_indices = []
-        self.wait_events = []  # handling waiting events separately since we simply turn everything off,
-        # latest_sequence_event is the last time that a channel is turned off
-        self.latest_sequence_event = 0
-        self.first_sequence_event = 0
-        # when doing random benchmarking we need to know whether to change amplitude or the width to create pi pulses
-        # right now these are boolean variables, perhaps later we may want to allow for these to be numbers specified by user
-        self.change_amp = False
-        self.change_width = False
-        self.paulinum = 4 # this variable is used in random benchmarking to pick one of the pauli random sequences
-        # this variable is used in RB to fix the truncation lengths
-        self.trunc_lengths = [2, 3, 4, 5, 6, 7, 8, 10, 12, 16, 20, 24, 32, 40, 48, 64, 80, 96]
-        # init the arrays
-        self.wavedata = None
-        self.c1markerdata = None
-        self.c2markerdata = None
-
+            key = (m.group('var'), float(m.group('base')) if m.group('base') else None)
+            terms[key] = terms.get(key, 0.0) + coef
+    return const, terms
 
-    def set_first_sequence_event(self):
-        if self.num_of_channels > 1:
-            temp_channels = []
-            for channel in self.channels:
-                channel.set_first_channel_event()
-                if channel.num_of_events > 0:
-                    temp_channels.append(channel)
-            if len(temp_channels) > 0:
-                self.first_sequence_event = sorted(temp_channels, key=lambda x: x.first_channel_event)[
-                    0].first_channel_event
-            else:
-                self.first_sequence_event = 0
-        if self.num_of_wait_events > 0:
-            if float(self.wait_events[0]) < self.first_sequence_event:
-                self.first_sequence_event = float(self.wait_events[0])
 
-    def set_latest_sequence_event(self):
-        self.latest_sequence_event = 0
-        for idx, chan in enumerate(self.channels):
-            if chan.latest_channel_event > self.latest_sequence_event:
-                self.latest_sequence_event = chan.latest_channel_event
-        if self.num_of_wait_events > 0:
-            if float(self.wait_events[-1]) > self.latest_sequence_event:
-                self.latest_sequence_event = float(self.wait_events[-1])
-
-    def add_channel(self, ch_type):
-        """Adds a channel of specified channel type, but does not yet add the events data"""
-        self.num_of_channels += 1
-        temp_pulseparams = self.pulseparams.copy()
-        if self.num_of_channels > 1:
-            evt_ch_idx = self.channels[-1].event_channel_index + 1
+def find_start_stop_increment_times(pulse):
+    """This method finds the start, stop and increment factors from a list of strings. The increment factors are the
+    multipliers of the scanned time t, see :func:`parse_time_expression` for the other terms a time can have."""
+    start, start_terms = parse_time_expression(pulse[1])
+    stop, stop_terms = parse_time_expression(pulse[2])
+    return start, stop, start_terms.get(('t', None), 0.0), stop_terms.get(('t', None), 0.0)
+
+
+def time_variables(keys, dts, indices):
+    """Returns the values of the variables of time expressions at each scan point as a (variables x points) array. The
+    scanned time is given in ticks, so that its multipliers are plain numbers, and the other variables are given in
+    seconds divided by ticks, so that their multipliers in seconds give ticks too.
+    :param keys: list of the variable keys returned by :func:`parse_time_expression`
+    :param dts: the scanned time in seconds at each point
+    :param indices: the index of each point
+    """
+    indices = np.asarray(indices, dtype=np.float64)
+    values = np.zeros((len(keys), len(indices)))
+    for k, (var, base) in enumerate(keys):
+        if var == 't':
+            values[k] = to_ticks(np.asarray(dts, dtype=np.float64))
+        elif base is None:
+            values[k] = indices / TICK
         else:
-            evt_ch_idx = 0
+            values[k] = np.power(base, indices) / TICK
+    return values
 
-        if ch_type == _RANDBENCH:
-            channel = RandomGateChannel(ch_type=ch_type,delay=self.delay, pulse_params=temp_pulseparams,
-                                            connection_dict=self.connectiondict, sampletime=self.timeres,
-                                            event_channel_idx=evt_ch_idx,change_amp=self.change_amp,change_width=self.change_width, compseqnum = self.comp_seq_num)
-        else:
-            channel = Channel(ch_type=ch_type, delay=self.delay, pulse_params=temp_pulseparams,
-                                  connection_dict=self.connectiondict, sampletime=self.timeres, event_channel_idx=
-                                  evt_ch_idx)
 
-        self.channels.append(channel)
-        self.channel_sampletimes.append(self.timeres)
-        self.seq_channel_indices.append(channel.event_channel_index)
-        self.set_latest_sequence_event()
-        self.set_first_sequence_event()
-
-    def delete_channel(self, index):
-        """deletes the channel object"""
-        if self.num_of_channels > 0:
-            self.channels.pop(index)
-            self.num_of_channels -= 1
-            self.seq_channel_indices.pop(index)
-            self.set_latest_sequence_event()
-            self.set_first_sequence_event()
-            return True
-        else:
-            return False
-
-    def adjust_channel_times(self, chantype='a1'):
-        """this is a critical method that adjusts channel times for all other channels besides the one specified.
-        THis is often needed when we either increment times in a given channel that would then end up conflicting
-        with other channels start/stop times; or when we add new events into a channel
-        :param chantype: string that gives the channel type that will not be adjusted """
-        # first figure out which channel we are being asked to ignore
-        insertchan = self.channels[0]
-        for (idx, chan) in enumerate(self.channels):
-            if chan.ch_type == chantype:
-                insertchan = chan
-        # here we get all the start and stop times that we need from that channel
-        earliest_start_time = insertchan.first_channel_event
-        latest_stop_time = insertchan.latest_channel_event
-        latest_start_time = np.amax(np.array(insertchan.event_start_times, dtype=np.float32))
-        push_time = float(latest_start_time - earliest_start_time)
-        for (idx, chan) in enumerate(self.channels):
-            if chan.ch_type != insertchan.ch_type:
-                for idx, evt in enumerate(chan.event_train):
-                    # store any values of the start_increment and stop intcrement from the event
-                    temp1 = evt.start_increment
-                    temp2 = evt.stop_increment
-                    # check if the inserted channel start time conflicts with previous start times
-                    if (evt.start > earliest_start_time) and (evt.start < latest_stop_time):
-                        evt.start_increment = 1  # set the increments to 1
-                        evt.stop_increment = 1
-                        evt.increment_time(dt=push_time)  # increment the event
-                    # restore the old values of increment
-                    evt.start_increment = temp1
-                    evt.stop_increment = temp2
-                    # store the new start and stop times in the arrays
-                    chan.event_start_times[idx] = evt.start
-                    chan.event_stop_times[idx] = evt.stop
-                # update the first and latest channel events
-                chan.set_first_channel_event()
-                chan.set_latest_channel_event()
+class SequenceLine(object):
+    """A single line of the sequence definition, e.g. 'Wave,1e-6,1.1e-6+t,Gauss,n=2++' split into a list of strings.
+    The start and stop times, their increments and the optional params are parsed and validated once when the line
+    is created; scanned values are only filled in from the pulse params when the line is bound to a scan point.
+    :param line: list of strings that specify one line of the sequence
+    """
 
-    def convert_text_to_seq(self, seqtext):
-        """This method parses the sequence definition which is currently just a string, and converts
-        it to a list of list of strings.  Eventually may include more sophisticated parsing techniques, e.g. using a
-        lexer/parser library like PLY, ATL5"""
-        # get a list of all the lines in the text
-        all_lines = seqtext.split('\n')
-        b_all_lines = all_lines[:]  # make a copy
-        # now iterate over the copy, and create a list of a list of strings which specify the sequence
-        for (idx, line) in list(enumerate(b_all_lines)):
-            wfm = line.split(',')
-            self.seq.append(wfm)
-            # b_all_lines[idx:idx] = [wfm]
-        # self.seq = self.seq[:-1]
-        # print('text box converted to', self.seq)
+    def __init__(self, line):
+        self.logger = logging.getLogger('seqlogger.seq_line')
+        self.line = line
+        self.ch_type = line[0]  # type of channel
+        self.start, self.start_terms = parse_time_expression(line[1])
+        self.stop, self.stop_terms = parse_time_expression(line[2])
+        self.start_increment = self.start_terms.get(('t', None), 0.0)  # the multipliers of the scanned time
+        self.stop_increment = self.stop_terms.get(('t', None), 0.0)
+        self.unpack_optional_params()
 
     ## Changes made by Gurudev 2020-07-08 : Modifying the unpacking of optional params so that order of the optional
     # params does not matter, also added in a new optional param phase = NN
-    def unpack_optional_params(self, seq_idx=0):
-        '''get the optional params in the list of strings
-        :param seq_idx: index in the list of strings to unpack
+    def unpack_optional_params(self):
+        '''get the optional params in the list of strings. Values that are scanned (phase = N.N++, n = N++) are only
+        flagged here and are looked up in the pulse params by :meth:`bind`
         '''
-        ch_type = self.seq[seq_idx][0]  # type of channel
-        opt_params = self.seq[seq_idx][3:]  # all the optional parameters
+        ch_type = self.ch_type  # type of channel
+        opt_params = self.line[3:]  # all the optional parameters
         # currently we support 4 parameters: pulsetype, num-events, amplitude_scale,fname
         amplitude_scale = 1.0
         num_events = 1
         fname = None
-        phase = self.pulseparams['phase']
+        phase = None  # None means the phase in the pulse params is used
+        scan_phase = False  # phase = N.N++ takes the phase from the pulse params, used when scanning the phase
+        scan_num_events = False  # n = N++ takes the number of pulses from the pulse params
+        phases = None  # phases = N.N;N.N cycles the phases of the events of a train
+        separation = 0.0  # sep = N.N is the time between the events of a train
         pulsetype = ''
-        ## GURUDEV 2021-07-12: trying to fix issue that number scan is being overwritten by the nevents parameter
-        temp_pulseparams = self.pulseparams.copy()
         ## GURUDEV 2021-07-23: for Randomized benchmarking, we need to know whether the width or the amplitude of the
         # event should be changed to make pi pulses
         change_amp = False
@@ -1540,12 +1646,15 @@ class Sequence:
                     pulsetype = opt_params[0]
                     if pulsetype in simple_ptypes:  # check whether pulsetype is of 1st 3 types
                         # check if there are any other optional parameters
-                        if len(opt_params) > 4:
-                            self.logger.warning(f"only 3 optional parameters supported for {pulsetype} channels")
+                        if len(opt_params) > 6:
+                            self.logger.warning(f"only 5 optional parameters supported for {pulsetype} channels")
                         for s in opt_params[1:]:
-                            # the allowed patterns are amp = N.N, phase = N.N, num = N in any order
+                            # the allowed patterns are amp = N.N, phase = N.N, num = N, phases = N.N;N.N, sep = N.N in
+                            # any order
                             patt = r'(amp\s*\=\s*)(?P<amp>\d\.?\d*)|(phase\s*\=\s*)(?P<phase>\d\.?\d*)' \
-                                   r'(?P<incp>\+\+)?|(n\s*=\s*)(?P<num>\d{,4})(?P<incn>\+\+)?'  ## Gurudev: trying this
+                                   r'(?P<incp>\+\+)?|(n\s*=\s*)(?P<num>\d{,4})(?P<incn>\+\+)?|' \
+                                   r'(phases\s*=\s*)(?P<phases>-?[\d.]+(?:\s*;\s*-?[\d.]+)*)|' \
+                                   r'(sep\s*=\s*)(?P<sep>\d+\.?\d*(?:[eE][+-]?\d+)?)'  ## Gurudev: trying this
                             m = re.search(patt, s)
                             if m:
                                 if m.group('amp'):
@@ -1554,30 +1663,40 @@ class Sequence:
                                 if m.group('num'):
                                     val = int(m.group('num'))  # the match is returned in group 'num'
                                     num_events = val if (val > 1) else 1
+                                    scan_num_events = False
                                 if m.group('incn') == '++':  # we take the number from the pulseparams,
                                     # used when scanning the number of pulses
-                                    num_events = temp_pulseparams['num pulses']
+                                    scan_num_events = True
                                 if m.group('phase'):
                                     val = Decimal(m.group('phase'))  # the match is returned in group 'phase'
                                     # we take the phase modulo 360 degrees, have to use Decimal for modulo to work
                                     phase = float(val % Decimal('360.0')) if (val > 360.0) else float(val)
+                                    scan_phase = False
                                 if m.group('incp') == '++':
                                     # we take the phase from the pulseparams, used when scanning the phase
-                                    val = temp_pulseparams['phase']
-                                    phase = float(val % Decimal('360.0')) if (val > 360.0) else float(val)
+                                    scan_phase = True
+                                if m.group('phases'):
+                                    # the phases of a phase cycle, e.g. phases = 0;90;0;90, added to the phase in turn
+                                    phases = [float(p) for p in m.group('phases').split(';') if p.strip()]
+                                if m.group('sep'):
+                                    separation = float(m.group('sep'))  # time between the events of a train
                             else:
-                                raise RuntimeError("Optional params must be of form amp = D.D or phase = D.D or n = D")
+                                raise RuntimeError("Optional params must be of form amp = D.D or phase = D.D or n = D "
+                                                   "or phases = D.D;D.D or sep = D.D")
                     elif pulsetype == _PULSE_TYPES[-1]:  # this is for loading waveforms
                         # regex allows f = blah.txt, f = blah.csv ,fname = blah.txt etc
                         if len(opt_params) < 2:  # not enough optional parms were supplied
                             raise RuntimeWarning('Filename must be supplied else will use default')
-                        if len(opt_params) > 5:
-                            self.logger.error(f"only 4 optional parameters supported for {pulsetype} channels")
-                            raise RuntimeError(f"only 4 optional parameters supported for {pulsetype} channels")
+                        if len(opt_params) > 7:
+                            self.logger.error(f"only 6 optional parameters supported for {pulsetype} channels")
+                            raise RuntimeError(f"only 6 optional parameters supported for {pulsetype} channels")
                         for s in opt_params[1:]:
-                            # the allowed patterns are amp = N.N, phase = N.N, num = N, fname = ABC in any order
+                            # the allowed patterns are amp = N.N, phase = N.N, num = N, phases = N.N;N.N, sep = N.N,
+                            # fname = ABC in any order
                             patt = r'(amp\s*\=\s*)(?P<amp>\d\.?\d*)|(phase\s*\=\s*)(?P<phase>\d\.?\d*)' \
                                    r'(?P<incp>\+\+)?|(n\s*=\s*)(?P<num>\d{,4})(?P<incn>\+\+)?|' \
+                                   r'(phases\s*=\s*)(?P<phases>-?[\d.]+(?:\s*;\s*-?[\d.]+)*)|' \
+                                   r'(sep\s*=\s*)(?P<sep>\d+\.?\d*(?:[eE][+-]?\d+)?)|' \
                                    r'(fname\s*=\s*)(?P<file>\w+)\.(?P<ext>txt|csv)'
                             m = re.search(patt, s)
                             if m:
@@ -1587,16 +1706,22 @@ class Sequence:
                                 if m.group('num'):
                                     val = int(m.group('num'))  # the match is returned in group 'num'
                                     num_events = val if (val > 1) else 1
+                                    scan_num_events = False
                                 if m.group('incn') == '++':
-                                    num_events = temp_pulseparams['num pulses']
+                                    scan_num_events = True
                                 if m.group('phase'):
                                     val = Decimal(m.group('phase'))  # the match is returned in group 'phase'
                                     # we take the phase modulo 360 degrees, have to use Decimal for modulo to work
                                     phase = float(val % Decimal('360.0')) if (val > 360.0) else float(val)
+                                    scan_phase = False
                                 if m.group('incp') == '++':
                                     # we take the phase from the pulseparams, used when scanning the phase
-                                    val = temp_pulseparams['phase']
-                                    phase = float(val % Decimal('360.0')) if (val > 360.0) else float(val)
+                                    scan_phase = True
+                                if m.group('phases'):
+                                    # the phases of a phase cycle, e.g. phases = 0;90;0;90, added to the phase in turn
+                                    phases = [float(p) for p in m.group('phases').split(';') if p.strip()]
+                                if m.group('sep'):
+                                    separation = float(m.group('sep'))  # time between the events of a train
                                 if m.group('file'):
                                     fname = m.group('file') + '.' + m.group('ext')
                             else:
@@ -1683,7 +1808,7 @@ class Sequence:
                 self.logger.error('Runtime warning/error: {0}'.format(err))
                 sys.stderr.write('Runtime warning/error: {0}\n'.format(err))
         else:  # if channel type is marker, then only one other parameter is allowed, the number of pulses
-            pulsetype = self.seq[seq_idx][0]  # the pulsetype and channel name are identical for marker types
+            pulsetype = self.ch_type  # the pulsetype and channel name are identical for marker types
             try:
                 if opt_params is None:
                     num_events = 1
@@ -1698,7 +1823,416 @@ class Sequence:
             except (RuntimeWarning, RuntimeError) as err:
                 self.logger.error('Runtime warning/error: {0}'.format(err))
                 sys.stderr.write('Runtime warning/error: {0}\n'.format(err))
-        return pulsetype, amplitude_scale, num_events, fname, phase,change_width, change_amp
+        self.pulsetype = pulsetype
+        self.amplitude_scale = amplitude_scale
+        self.num_events = num_events
+        self.scan_num_events = scan_num_events
+        self.fname = fname
+        self.phase = phase
+        self.scan_phase = scan_phase
+        self.phases = phases
+        self.separation = separation
+        self.change_width = change_width
+        self.change_amp = change_amp
+
+    def bind(self, pulseparams):
+        """Returns the optional params of this line for one scan point
+        :param pulseparams: the pulse params dictionary of the scan point
+        :return: pulsetype, amplitude scale, number of events, file name, phase, change width, change amp
+        """
+        num_events = pulseparams['num pulses'] if self.scan_num_events else self.num_events
+        if self.scan_phase or self.phase is None:
+            val = float(pulseparams['phase'])
+            phase = val % 360.0 if (val > 360.0) else val
+        else:
+            phase = self.phase
+        return self.pulsetype, self.amplitude_scale, num_events, self.fname, phase, self.change_width, self.change_amp
+
+
+class ParsedSequence(object):
+    """The parsed form of a sequence definition, which is created once and can then be used by all the
+    :class:`sequences <Sequence>` in a scan, so that the text and the optional params are not parsed again for every
+    scan point.
+    :param seqtext: string that specifies the sequence in the form 'type,start,stop, optionalparams\n' or the list of
+                    list of strings that it is converted to
+    """
+
+    def __init__(self, seqtext):
+        if isinstance(seqtext, str):
+            # get a list of all the lines in the text, and split each line into a list of strings
+            self.seq = [line.split(',') for line in seqtext.split('\n')]
+        else:
+            self.seq = [list(line) for line in seqtext]
+        self.lines = [SequenceLine(line) for line in self.seq]
+        self.compile_times()
+
+    def __len__(self):
+        return len(self.lines)
+
+    def compile_times(self):
+        """Compiles the start and stop times of all the lines into arrays: self.base_ticks, the (2 x lines) constant
+        start and stop times in ticks, and self.time_coefficients, the (2 x lines x variables) multipliers of the
+        variables in self.time_keys, see :func:`parse_time_expression`"""
+        self.time_keys = sorted({key for line in self.lines for key in itertools.chain(line.start_terms,
+                                                                                         line.stop_terms)},
+                                key=lambda key: (key[0] != 't', key[0], key[1] or 0.0))
+        self.base_ticks = np.array([[to_ticks(line.start) for line in self.lines],
+                                    [to_ticks(line.stop) for line in self.lines]], dtype=np.int64)
+        self.time_coefficients = np.zeros((2, len(self.lines), len(self.time_keys)))
+        for i, line in enumerate(self.lines):
+            for k, key in enumerate(self.time_keys):
+                self.time_coefficients[0, i, k] = line.start_terms.get(key, 0.0)
+                self.time_coefficients[1, i, k] = line.stop_terms.get(key, 0.0)
+
+    def time_offsets(self, dts, indices=None):
+        """Returns the amount in ticks by which the start and stop time of every line is moved at each scan point, as
+        a (2 x lines x points) array. All the points come out of one product of the multipliers and the variables, so
+        the times of a whole scan are worked out at once.
+        :param dts: the scanned time in seconds at each point
+        :param indices: the index of each point, defaults to 0, 1, 2, ...
+        """
+        if indices is None:
+            indices = np.arange(len(dts))
+        values = time_variables(self.time_keys, dts, indices)
+        return np.rint(self.time_coefficients @ values).astype(np.int64)
+
+    def time_ticks(self, dts, indices=None):
+        """Returns the start and stop times in ticks of every line at each scan point as a (2 x lines x points) array
+        :param dts: the scanned time in seconds at each point
+        :param indices: the index of each point, defaults to 0, 1, 2, ...
+        """
+        return self.base_ticks[:, :, np.newaxis] + self.time_offsets(dts, indices)
+
+
+class ChannelCache(object):
+    """Keeps the compiled marker channels of the last scan point, so that the points of a scan that does not change
+    them, e.g. a pulsewidth, amplitude, number or random scan, reuse them instead of building them again. A channel
+    is kept with the key of its own inputs: the times, offsets and optional params of its lines, and the clock rate.
+    The events of a channel are kept before the channels of the sequence are adjusted to each other, which is still
+    done at every point, so a reused channel gives exactly the same events. The marker runs of the last point are
+    kept too, and are reused when the marker events and delays they are made from have not changed.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger('seqlogger.channel_cache')
+        self.channels = {}  # channel type -> (key, rows of its events, pulse type names, number of events, index)
+        self.markers = None  # (marker intervals, length, c1markers, c2markers) of the last point
+        self.adjusted = None  # (key, push windows, shifts, lowest and highest starts) of the marker channels
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.channels.clear()
+        self.markers = None
+        self.adjusted = None
+
+    def has(self, ch_type, key):
+        """Returns True if the events of a channel type were kept with the same key
+        :param ch_type: the channel type, e.g. Green
+        :param key: the key of the inputs of the channel at this point
+        """
+        kept = self.channels.get(ch_type)
+        if kept is None or kept[0] != key:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def restore(self, channel):
+        """Fills an empty channel with the events kept for its type, see :meth:`has`
+        :param channel: the new :class:`Channel`, which has to use the event table of the sequence
+        """
+        key, rows, type_names, num_of_events, event_channel_index = self.channels[channel.ch_type]
+        channel.rows = list(channel.table.append_rows(rows, type_names))
+        channel.index.rebuild(channel.rows)
+        channel.num_of_events = num_of_events
+        channel.event_channel_index = event_channel_index
+        channel.set_first_channel_event()
+        channel.set_latest_channel_event()
+
+    def keep(self, channel, key):
+        """Keeps the events of a channel that has been built with the given key
+        :param channel: the :class:`Channel`, before it is adjusted to the other channels of its sequence
+        :param key: the key of the inputs of the channel
+        """
+        self.channels[channel.ch_type] = (key, channel.table.events[channel.rows].copy(),
+                                          list(channel.table.type_names), channel.num_of_events,
+                                          channel.event_channel_index)
+
+    def keep_adjustment(self, key, windows, channels, starts):
+        """Keeps how the marker channels were adjusted to each other, see :meth:`Sequence.adjust_channels`
+        :param key: the keys of the marker channels
+        :param windows: the push window of each line, or None for the lines of the other channels
+        :param channels: the adjusted marker channels
+        :param starts: the start times of the events of each channel before they were adjusted
+        """
+        shifts = {}
+        after = []
+        for chan, before in zip(channels, starts):
+            after.append(chan.table.events['start'][chan.rows])
+            shifts[chan.ch_type] = after[-1] - before
+        lowest = np.concatenate(starts) if starts else np.zeros(0, dtype=np.int64)
+        highest = np.concatenate(after) if after else lowest
+        self.adjusted = (key, windows, shifts, lowest, highest)
+
+    def marker_edges(self, table):
+        """Returns the marker runs of AWG channel 1 and 2 of an :class:`IntervalTable`, reusing those of the last point
+        if its marker intervals, which include the delays, and its length are the same
+        :param table: the interval table
+        """
+        intervals = [(table.marker_starts[c], table.marker_stops[c], table.marker_bits[c]) for c in (1, 2)]
+        if self.markers is not None and self.markers[1] == table.length and \
+                self.same_intervals(self.markers[0], intervals):
+            return self.markers[2], self.markers[3]
+        c1markers, c2markers = table.marker_edges(1), table.marker_edges(2)
+        self.markers = (intervals, table.length, c1markers, c2markers)
+        return c1markers, c2markers
+
+    @staticmethod
+    def same_intervals(old, new):
+        """Returns True if two lists of the (starts, stops, bits) of the marker intervals of each AWG channel are the
+        same"""
+        for (oldstarts, oldstops, oldbits), (starts, stops, bits) in zip(old, new):
+            if oldbits != bits:
+                return False
+            for a, b in zip(oldstarts + oldstops, starts + stops):
+                if not np.array_equal(a, b):
+                    return False
+        return True
+
+
+class Sequence:
+    def __init__(self, seqtext=None, delay=None, pulseparams=None, connectiondict=None, timeres=1):
+        """Class that implements a collection of :class:`channels <Channel>`
+            :param seqtext: string that specifies sequence in the form 'type,start,stop, optionalparams'\n, or a
+            :class:`ParsedSequence` of such a string when the same sequence is used for many scan points,
+            eg. here is Rabi sequence 'S1,1e-6,1.01e-6+t\nGreen,1.02e-6+t,4.02e-6+t\nMeasure,1.02e-6+t,1.12e-6+t'
+            for a gaussian pulse would use 'Wave,1e-6,1e-6+t,Gauss\nGreen,2e-6+t,5e-6+t\nMeasure,2e-6+t,
+            2.1e-6+t'
+            :param delay: list with [AOM delay, MW delay] , possibly other delays to be added.
+            :param pulseparams: a dictionary containing the amplitude, pulsewidth,SB frequency,IQ scale factor,
+                        phase, skewphase
+            :param connectiondict: a dictionary of the connections between AWG channels and switches/IQ modulators
+            :param timeres: clock rate in ns
+
+            After creating the instance, call the method create_sequence with an optional increment of time ,
+            and then the arrays created will be: wavedata (analag I and Q data), c1markerdata, c2markerdata
+        """
+        if delay is None:
+            delay = [0.0, 0.0]
+        self.logger = logging.getLogger('seqlogger.seq_class')  # start the class logger
+        if seqtext is None:
+            seqtext = 'Green,0.6e-6,0.7e-6\nWave,1e-6+t,1.5e-6+t,SquareI,a=0.5,n=2\nMeasure,1.5e-6+t,1.8e-6+t'
+        self.seq = []
+        if isinstance(seqtext, ParsedSequence):
+            self.parsed = seqtext  # the text has already been parsed, e.g. by the SequenceList
+            self.seq = seqtext.seq
+        else:
+            self.convert_text_to_seq(seqtext)  # this function creates the seq object, a list of list of strings
+            self.parsed = ParsedSequence(self.seq)  # parses the times and optional params of each line
+        self.timeres = float(timeres) * _ns  # old code was written assuming everything in ns, so fix that
+        self.events = EventTable(self.timeres)  # table holding the events of all the channels
+        self.rb_nevents = 1  # this was created to account for the nevents variable when the scan is a random scan
+        self.rbinfo_list = []  # a list created to save the random scan info (final states and final sequences)
+        self.rb_seed = None  # seed for the random gates, if None the module level random generator is used
+        # the (2 x lines) amounts in ticks that the start and stop times of the lines are moved by at this point, if
+        # None they are worked out from the time increment given to create_channels_from_seq
+        self.line_offsets = None
+        self.interval_table = None  # the table the data was rendered from, kept to render the next point of a scan
+        self.train_spans = []  # (start, period, number of periods) in samples of the data of each pulse train
+        self.channel_cache = None  # optional ChannelCache shared with the other points of a scan
+        # if True the Wave events are made in baseband, and the sideband modulation is applied once to the data of the
+        # whole sequence, with its phase counted from the start of the sequence so that it is continuous across pulses
+        self.coherent_sideband = False
+        # the SB freq, IQ scale factor and skew phase of the sequence when coherent_sideband is set
+        self.sideband = None
+        if pulseparams is None:
+            self.pulseparams = _PULSE_PARAMS
+        # if pulseparams == None:
+        #    self.pulseparams = {'amplitude': 100, 'pulsewidth': 20, 'SB freq': 0.00, 'IQ scale factor': 1.0,'phase': 0.0, 'skew phase':0.0, 'num pulses': 1}
+        else:
+            self.pulseparams = pulseparams
+        if connectiondict is None:
+            self.connectiondict = _CONN_DICT
+        else:
+            self.connectiondict = connectiondict
+        self.delay = delay
+        #
+        self.num_of_channels = 0
+        self.num_of_wait_events = 0
+        self.channels = []
+        self.channel_sampletimes = []
+        self.seq_channel_indices = []
+        self.wait_events = []  # handling waiting events separately since we simply turn everything off,
+        # latest_sequence_event is the last time that a channel is turned off
+        self.latest_sequence_event = 0
+        self.first_sequence_event = 0
+        # when doing random benchmarking we need to know whether to change amplitude or the width to create pi pulses
+        # right now these are boolean variables, perhaps later we may want to allow for these to be numbers specified by user
+        self.change_amp = False
+        self.change_width = False
+        self.paulinum = 4 # this variable is used in random benchmarking to pick one of the pauli random sequences
+        # this variable is used in RB to fix the truncation lengths
+        self.trunc_lengths = [2, 3, 4, 5, 6, 7, 8, 10, 12, 16, 20, 24, 32, 40, 48, 64, 80, 96]
+        # init the arrays, the markers are kept as runs of the same byte and only expanded when they are asked for
+        self.wavedata = None
+        self.c1markers = None
+        self.c2markers = None
+
+    @property
+    def c1markerdata(self):
+        """The marker byte of AWG channel 1 for every sample, expanded from self.c1markers"""
+        return None if self.c1markers is None else self.c1markers.expand()
+
+    @c1markerdata.setter
+    def c1markerdata(self, data):
+        self.c1markers = data if data is None or isinstance(data, MarkerEdges) else MarkerEdges.from_array(data)
+
+    @property
+    def c2markerdata(self):
+        """The marker byte of AWG channel 2 for every sample, expanded from self.c2markers"""
+        return None if self.c2markers is None else self.c2markers.expand()
+
+    @c2markerdata.setter
+    def c2markerdata(self, data):
+        self.c2markers = data if data is None or isinstance(data, MarkerEdges) else MarkerEdges.from_array(data)
+
+    def set_first_sequence_event(self):
+        if self.num_of_channels > 1:
+            temp_channels = []
+            for channel in self.channels:
+                channel.set_first_channel_event()
+                if channel.num_of_events > 0:
+                    temp_channels.append(channel)
+            if len(temp_channels) > 0:
+                self.first_sequence_event = sorted(temp_channels, key=lambda x: x.first_channel_event)[
+                    0].first_channel_event
+            else:
+                self.first_sequence_event = 0
+        if self.num_of_wait_events > 0:
+            if float(self.wait_events[0]) < self.first_sequence_event:
+                self.first_sequence_event = float(self.wait_events[0])
+
+    def set_latest_sequence_event(self):
+        self.latest_sequence_event = 0
+        for idx, chan in enumerate(self.channels):
+            if chan.latest_channel_event > self.latest_sequence_event:
+                self.latest_sequence_event = chan.latest_channel_event
+        if self.num_of_wait_events > 0:
+            if float(self.wait_events[-1]) > self.latest_sequence_event:
+                self.latest_sequence_event = float(self.wait_events[-1])
+
+    def add_channel(self, ch_type):
+        """Adds a channel of specified channel type, but does not yet add the events data"""
+        self.num_of_channels += 1
+        temp_pulseparams = self.pulseparams.copy()
+        if self.num_of_channels > 1:
+            evt_ch_idx = self.channels[-1].event_channel_index + 1
+        else:
+            evt_ch_idx = 0
+
+        if ch_type == _RANDBENCH:
+            if self.rb_seed is None:
+                rng = random
+            else:
+                rng = random.Random(self.rb_seed)
+            channel = RandomGateChannel(ch_type=ch_type,delay=self.delay, pulse_params=temp_pulseparams,
+                                            connection_dict=self.connectiondict, sampletime=self.timeres,
+                                            event_channel_idx=evt_ch_idx,change_amp=self.change_amp,change_width=self.change_width, compseqnum = self.comp_seq_num,
+                                            rng=rng, event_table=self.events)
+        else:
+            channel = Channel(ch_type=ch_type, delay=self.delay, pulse_params=temp_pulseparams,
+                                  connection_dict=self.connectiondict, sampletime=self.timeres, event_channel_idx=
+                                  evt_ch_idx, event_table=self.events)
+
+        self.channels.append(channel)
+        self.channel_sampletimes.append(self.timeres)
+        self.seq_channel_indices.append(channel.event_channel_index)
+        self.set_latest_sequence_event()
+        self.set_first_sequence_event()
+
+    def delete_channel(self, index):
+        """deletes the channel object"""
+        if self.num_of_channels > 0:
+            self.channels.pop(index)
+            self.num_of_channels -= 1
+            self.seq_channel_indices.pop(index)
+            self.set_latest_sequence_event()
+            self.set_first_sequence_event()
+            return True
+        else:
+            return False
+
+    def adjust_channel_times(self, chantype='a1', channels=None):
+        """this is a critical method that adjusts channel times for all other channels besides the one specified.
+        THis is often needed when we either increment times in a given channel that would then end up conflicting
+        with other channels start/stop times; or when we add new events into a channel
+        :param chantype: string that gives the channel type that will not be adjusted
+        :param channels: the channels that may be adjusted, all the channels of the sequence by default
+        Returns the type of the channel that was not adjusted, its push window and the types of the channels whose
+        events were moved."""
+        # first figure out which channel we are being asked to ignore
+        insertchan = self.channels[0]
+        for (idx, chan) in enumerate(self.channels):
+            if chan.ch_type == chantype:
+                insertchan = chan
+        # here we get all the start and stop times that we need from that channel
+        window = insertchan.push_window()
+        return insertchan.ch_type, window, self.push_channels(insertchan.ch_type, window, channels)
+
+    def push_channels(self, ch_type, window, channels=None):
+        """Pushes the events of the channels other than ch_type that conflict with a push window, see
+        :meth:`Channel.push_window`, and returns the types of the channels whose events were moved
+        :param ch_type: type of the channel that is not adjusted
+        :param window: the earliest start time, latest stop time and push time in ticks
+        :param channels: the channels that may be adjusted, all the channels of the sequence by default
+        """
+        moved = []
+        for chan in (self.channels if channels is None else channels):
+            if chan.ch_type != ch_type:
+                # check if the inserted channel start time conflicts with previous start times
+                if chan.push_events(*window):
+                    moved.append(chan.ch_type)
+                # update the first and latest channel events
+                chan.set_first_channel_event()
+                chan.set_latest_channel_event()
+        return moved
+
+    def convert_text_to_seq(self, seqtext):
+        """This method parses the sequence definition which is currently just a string, and converts
+        it to a list of list of strings.  Eventually may include more sophisticated parsing techniques, e.g. using a
+        lexer/parser library like PLY, ATL5"""
+        # get a list of all the lines in the text
+        all_lines = seqtext.split('\n')
+        b_all_lines = all_lines[:]  # make a copy
+        # now iterate over the copy, and create a list of a list of strings which specify the sequence
+        for (idx, line) in list(enumerate(b_all_lines)):
+            wfm = line.split(',')
+            self.seq.append(wfm)
+            # b_all_lines[idx:idx] = [wfm]
+        # self.seq = self.seq[:-1]
+        # print('text box converted to', self.seq)
+
+    def unpack_optional_params(self, seq_idx=0):
+        '''get the optional params in the list of strings
+        :param seq_idx: index in the list of strings to unpack
+        '''
+        return self.parsed.lines[seq_idx].bind(self.pulseparams)
+
+    def channel_keys(self, offsets):
+        """Returns the key of the inputs of each marker channel at this point for the :class:`ChannelCache`: the clock
+        rate and, for each line of the channel, its times, their offsets in ticks, its pulse type, number of events and
+        separation
+        :param offsets: the (2 x lines) amounts in ticks that the start and stop times of the lines are moved by
+        """
+        keys = {}
+        for i, seqline in enumerate(self.parsed.lines):
+            if seqline.ch_type in _MARKER_ROUTES:
+                ptype, ampfactor, nevents = seqline.bind(self.pulseparams)[:3]
+                keys.setdefault(seqline.ch_type, [self.timeres]).append(
+                    (i, seqline.start, seqline.stop, seqline.start_increment, seqline.stop_increment,
+                     int(offsets[0, i]), int(offsets[1, i]), ptype, nevents, seqline.separation))
+        return {ch_type: tuple(key) for ch_type, key in keys.items()}
 
     def create_channels_from_seq(self, dt=0.0):
         """This method parses the sequence definition which is currently just a list of list of strings, and converts
@@ -1706,6 +2240,9 @@ class Sequence:
         lexer/parser library like PLY, ATL5
         :param dt: increment for the start or stop times, will be multiplied by any increment factor specified in string"""
 
+        offsets = self.line_offsets
+        if offsets is None:
+            offsets = self.parsed.time_offsets([dt])[:, :, 0]
         t_start = np.zeros(len(self.seq))
         t_stop = t_start.copy()
         start_inc = t_start.copy()
@@ -1715,13 +2252,29 @@ class Sequence:
         self.set_first_sequence_event()
         self.set_latest_sequence_event()
         temp_pulseparams = self.pulseparams.copy()  # this must be done as pulseparams is an immutable dict
+        if self.sideband is not None:
+            temp_pulseparams.update(_BASEBAND_PARAMS)  # the sideband is applied to the whole data, see create_sequence
+        self.line_rows = []  # the rows of the event table added by each line of the sequence
+        keys = self.channel_keys(offsets) if self.channel_cache is not None else {}
+        restored = []  # the channels whose events were taken from the channel cache
         for i in range(len(self.seq)):  # loop through the list of list of strings
+            self.line_rows.append(len(self.events))
             self.pulseparams = temp_pulseparams.copy()  # get the original pulse params
             chan_name = self.seq[i][0]  # the first element is the name of the channel
-            if chan_name not in ch_type:  # if the channel does not exist already
+            if chan_name in restored:
+                ch_type.append(chan_name)  # the events of this line were restored with those of the first line
+            elif chan_name not in ch_type and chan_name in keys and self.channel_cache.has(chan_name, keys[chan_name]):
+                # the channel is the same as at the last point, so all its events are restored at once
+                ch_type.append(chan_name)
+                restored.append(chan_name)
+                self.add_channel(ch_type=chan_name)
+                self.channel_cache.restore(self.channels[-1])
+            elif chan_name not in ch_type:  # if the channel does not exist already
                 ch_type.append(chan_name)
                 # the first 3 in the list are mandatory
-                t_start[i], t_stop[i], start_inc[i], stop_inc[i] = find_start_stop_increment_times(pulse=self.seq[i])
+                seqline = self.parsed.lines[i]
+                t_start[i], t_stop[i] = seqline.start, seqline.stop
+                start_inc[i], stop_inc[i] = seqline.start_increment, seqline.stop_increment
                 # then we could have optional parameters
                 ptype, ampfactor, nevents, fname, phase,change_width, change_amp = self.unpack_optional_params(seq_idx=i)
                 # create the channel modifying the pulse params as needed for that channel
@@ -1740,16 +2293,19 @@ class Sequence:
                     nevents = self.rb_nevents  # this is the nevents value for random benchmarking
                     final_state, final_seq = ch.add_event_train(time_on=t_start[i], time_off=t_stop[i], start_inc=start_inc[i],
                                        stop_inc=stop_inc[i], pulse_type=ptype, events_in_train=nevents, dt=dt,
-                                       fname=fname)
+                                       fname=fname, offsets=offsets[:, i])
                     self.rbinfo_list = [final_state, final_seq]  # gathering these data to pass it to the app
                 else:
                     ch.add_event_train(time_on=t_start[i], time_off=t_stop[i], start_inc=start_inc[i],
-                                   stop_inc=stop_inc[i], pulse_type=ptype, events_in_train=nevents, dt=dt, fname=fname)
+                                   stop_inc=stop_inc[i], pulse_type=ptype, events_in_train=nevents, dt=dt, fname=fname,
+                                   offsets=offsets[:, i], separation=seqline.separation, phases=seqline.phases)
             else:  # we have an existing channel of this name
                 # get all the parameters of the pulses to be added to the existing channel
                 # the first 3 in the list are mandatory
                 ch_type.append(chan_name)  # we still append the channel name
-                t_start[i], t_stop[i], start_inc[i], stop_inc[i] = find_start_stop_increment_times(pulse=self.seq[i])
+                seqline = self.parsed.lines[i]
+                t_start[i], t_stop[i] = seqline.start, seqline.stop
+                start_inc[i], stop_inc[i] = seqline.start_increment, seqline.stop_increment
                 # then we could have optional parameters
                 ptype, ampfactor, nevents, fname, phase,change_width, change_amp = self.unpack_optional_params(seq_idx=i)
                 # set the pulse params as needed for the pulse
@@ -1762,68 +2318,206 @@ class Sequence:
                         tempchan = Channel(ch_type=chan_name, delay=self.delay, pulse_params=self.pulseparams,
                                            connection_dict=self.connectiondict, sampletime=self.timeres,
                                            event_channel_idx=
-                                           self.channels[-1].event_channel_index + 1)
+                                           self.channels[-1].event_channel_index + 1, event_table=self.events)
                         tempchan.add_event_train(time_on=t_start[i], time_off=t_stop[i], start_inc=start_inc[i],
                                                  stop_inc=stop_inc[i], pulse_type=ptype, events_in_train=nevents, dt=dt,
-                                                 fname=fname)
+                                                 fname=fname, offsets=offsets[:, i], separation=seqline.separation,
+                                                 phases=seqline.phases)
                         chan.insert_channel_events(tempchan)
+            self.line_rows[i] = range(self.line_rows[i], len(self.events))
+        for chan in self.channels:
+            if chan.ch_type in keys and chan.ch_type not in restored:
+                self.channel_cache.keep(chan, keys[chan.ch_type])
 
-        for i in range(len(self.seq)):
-            self.adjust_channel_times(chantype=ch_type[i])  # if we need to adjust all the channels after this
+        self.adjust_channels(ch_type, keys)
         self.set_first_sequence_event()
         self.set_latest_sequence_event()
 
-    def create_sequence(self, dt=0.0):
+    def adjust_channels(self, ch_type, keys=None):
+        """Adjusts the times of the channels to each other after each line of the sequence, see
+        :meth:`adjust_channel_times`. When the other channels never push the marker channels, the adjustment of the
+        marker channels only depends on their own events, so it is kept in the channel cache together with the push
+        window of each line, and at the next point with the same marker channels only the other channels are pushed.
+        :param ch_type: list of the channel type of each line
+        :param keys: dict of the channel type -> key of the memoized marker channels
+        """
+        cache = self.channel_cache
+        if cache is None or not keys:
+            for i in range(len(self.seq)):
+                self.adjust_channel_times(chantype=ch_type[i])  # if we need to adjust all the channels after this
+            return
+        key = tuple(sorted(keys.items()))
+        if cache.adjusted is not None and cache.adjusted[0] == key and self.replay_adjustment(ch_type, cache.adjusted):
+            return
+        markers = [chan for chan in self.channels if chan.ch_type in keys]
+        starts = [self.events.events['start'][chan.rows] for chan in markers]
+        windows = []
+        kept = True
+        for i in range(len(self.seq)):
+            pusher, window, moved = self.adjust_channel_times(chantype=ch_type[i])
+            windows.append(window if pusher in keys else None)
+            kept = kept and (pusher in keys or not any(name in keys for name in moved))
+        if kept:
+            cache.keep_adjustment(key, windows, markers, starts)
+
+    def replay_adjustment(self, ch_type, adjusted):
+        """Adjusts the channels with the adjustment of the marker channels kept in the channel cache, see
+        :meth:`adjust_channels`. Returns False, with the channels as they were, if another channel could push the
+        marker channels at this point.
+        :param ch_type: list of the channel type of each line
+        :param adjusted: the adjustment kept by :meth:`ChannelCache.keep_adjustment`
+        """
+        key, windows, shifts, lowest, highest = adjusted
+        others = [chan for chan in self.channels if chan.ch_type not in shifts]
+        saved = self.events.events.copy()
+        for i in range(len(self.seq)):
+            if windows[i] is not None:
+                self.push_channels(None, windows[i], others)
+                continue
+            pusher, window, moved = self.adjust_channel_times(chantype=ch_type[i], channels=others)
+            earliest_start_time, latest_stop_time, push_time = window
+            # a marker event could be anywhere between its start before and after the adjustment
+            if push_time != 0 and np.any((lowest < latest_stop_time) & (highest > earliest_start_time)):
+                self.events.events[:] = saved
+                for chan in others:
+                    chan.index.rebuild(chan.rows)
+                    chan.set_first_channel_event()
+                    chan.set_latest_channel_event()
+                return False
+        for chan in self.channels:
+            if chan.ch_type in shifts and shifts[chan.ch_type].any():
+                self.events.shift(chan.rows, shifts[chan.ch_type])
+                chan.index.rebuild(chan.rows)
+                chan.set_first_channel_event()
+                chan.set_latest_channel_event()
+        return True
+
+    def create_sequence(self, dt=0.0, previous=None):
         """Creates the data for the sequence.
         :param dt: Increment in time.
+        :param previous: the sequence of the previous point of a time scan, if given only the part of the I/Q data that
+                is different from its data is rendered, see :meth:`IntervalTable.rerender`
+        """
+        aomdelay, mwdelay = self.sample_delays()
+        if self.coherent_sideband and self.sideband is None:
+            self.sideband = tuple(float(self.pulseparams[key]) for key in _SIDEBAND_PARAMS)
+        # create all the channels from the self.seq object
+        self.create_channels_from_seq(dt=dt)
+        maxend = self.data_length()
+        # turn all the channels into a table of start/stop indices and envelopes, and render it in one pass
+        table = self.build_interval_table(maxend, aomdelay=aomdelay, mwdelay=mwdelay)
+        wavedata = None
+        # the sideband of a shifted part of the previous data would not have the phase of its new place
+        if previous is not None and previous.interval_table is not None and self.sideband is None:
+            wavedata = table.rerender(previous.interval_table, previous.wavedata)
+        if wavedata is None:
+            wavedata = table.render_waves()
+        if self.sideband is not None:
+            self.modulate_sideband(wavedata, table)
+        # the wavedata will store the data for the I and Q channels in a 2D array
+        self.wavedata = wavedata
+        # the markers, with their delays applied, are only turned into runs of the marker byte
+        if self.channel_cache is not None:
+            self.c1markers, self.c2markers = self.channel_cache.marker_edges(table)
+        else:
+            self.c1markers = table.marker_edges(1)
+            self.c2markers = table.marker_edges(2)
+        self.interval_table = table
+        self.train_spans = table.train_spans
+
+    def modulate_sideband(self, wavedata, table):
+        """Applies the sideband modulation of the sequence to the data of the Wave events that were made in baseband,
+        one range of samples at a time, see
+        :func:`sideband_modulation <source.Hardware.AWG520.Pulse.sideband_modulation>`
+        :param wavedata: the rendered I and Q data
+        :param table: the :class:`IntervalTable` the data was rendered from
         """
-        # get the AOM delay
-        aomdelay = int((self.delay[0] + self.timeres / 2) / self.timeres)  # proper way of rounding delay[0]/timeres
+        ssb_freq, iqscale, skew_phase = self.sideband
+        for first, last in zip(*table.sideband_ranges()):
+            sideband_modulation(wavedata[:, first:last], ssb_freq, iqscale, skew_phase, first=first)
+
+    def sample_delays(self):
+        """Returns the AOM and MW delays in samples"""
+        ticks_per_sample = self.events.ticks_per_sample
+        # get the AOM delay, rounding delay[0]/timeres half up
+        aomdelay = (to_ticks(self.delay[0]) + ticks_per_sample // 2) // ticks_per_sample
         self.logger.info("AOM delay is found to be %d", aomdelay)
         # get the MW delay
-        mwdelay = int((self.delay[1] + self.timeres / 2) // self.timeres)
+        mwdelay = (to_ticks(self.delay[1]) + ticks_per_sample // 2) // ticks_per_sample
         self.logger.info("MW delay is found to be %d", mwdelay)
-        # create all the channels from the self.seq object
+        return aomdelay, mwdelay
+
+    def data_length(self):
+        """Returns the number of samples in the data of the sequence once its channels have been created"""
+        # this is the largest stop index, which is the stop index of the latest event, plus one
+        return ticks_to_samples(to_ticks(self.latest_sequence_event), self.events.ticks_per_sample) + 1
+
+    def analyze(self, dt=0.0):
+        """Creates the channels of the sequence and works out the size of its data without rendering it. Returns a
+        dict with the number of samples, the first and latest event times, and the number of events that overlap
+        an earlier event of the same channel, by channel type. Wave events overlap if their envelopes overlap.
+        :param dt: Increment in time.
+        """
         self.create_channels_from_seq(dt=dt)
-        # now we need to find the data length i.e. the largest stop time in the list of stop times
-        maxend = np.int64(self.latest_sequence_event / self.timeres) + 1
-        # print("the max. event value is {}".format(self.maxend))
-        # now we can init the arrays
-        # dummydata = np.zeros(maxend, dtype=_MARKTYPE)
-        c1m1 = np.zeros(maxend, dtype=_MARKTYPE)
-        c1m2 = c1m1.copy()
-        c2m1 = c1m1.copy()
-        c2m2 = c1m1.copy()
-        waveI = np.zeros(maxend, dtype=_IQTYPE)
-        waveQ = waveI.copy()
-
-        for (idx, channel) in enumerate(self.channels):
+        overlaps = {}
+        for channel in self.channels:
+            events = channel.events
+            starts, stops = events['t1_idx'], events['t2_idx']
             if channel.ch_type == _WAVE or channel.ch_type == _RANDBENCH:
-                for (n, evt) in enumerate(channel.event_train):
-                    waveI[evt.t1_idx:evt.t2_idx] = evt.data[0]
-                    waveQ[evt.t1_idx:evt.t2_idx] = evt.data[1]
-            elif channel.ch_type == _GREEN_AOM:
-                for (n, evt) in enumerate(channel.event_train):
-                    c1m2[evt.t1_idx:evt.t2_idx] = evt.data
-                c1m2 = np.roll(c1m2, -aomdelay)
-            elif channel.ch_type == _MW_S2:
-                for (n, evt) in enumerate(channel.event_train):
-                    c1m1[evt.t1_idx:evt.t2_idx] = evt.data
-                c1m1 = np.roll(c1m1, -mwdelay)
-            elif channel.ch_type == _MW_S1:
-                for (n, evt) in enumerate(channel.event_train):
-                    c2m1[evt.t1_idx:evt.t2_idx] = evt.data
-                c2m1 = np.roll(c2m1, -mwdelay)
-                self.logger.warning(
-                    'Value error: only MW switch connected is S2 using Ch1, M1, this channel will do nothing')
-            elif channel.ch_type == _ADWIN_TRIG:
-                for (n, evt) in enumerate(channel.event_train):
-                    c2m2[evt.t1_idx:evt.t2_idx] = evt.data
-
-        self.c1markerdata = c1m1 + c1m2
-        self.c2markerdata = c2m1 + c2m2
-        # the wavedata will store the data for the I and Q channels in a 2D array
-        self.wavedata = np.array((waveI, waveQ))
+                lengths = [channel.table.envelopes[eid].shape[-1] if eid >= 0 else 0 for eid in events['envelope']]
+                stops = starts + np.array(lengths, dtype=starts.dtype)
+            overlaps[channel.ch_type] = count_overlaps(starts, stops)
+        return {'length': self.data_length(), 'first event': self.first_sequence_event,
+                'latest event': self.latest_sequence_event, 'overlaps': overlaps}
+
+    def sideband_types(self):
+        """Returns the Wave event types whose data is made in baseband when coherent_sideband is set. Load Wfm pulses
+        are left out if a line loads I and Q data, which already has its modulation, as they share the type."""
+        fnames = [line.fname for line in self.parsed.lines]
+        if any('IQdata.txt' in str(fname) for fname in fnames if fname is not None):
+            return [name for name in _SIDEBAND_TYPES if name != _PULSE_TYPES[-1]]
+        return _SIDEBAND_TYPES
+
+    def build_interval_table(self, length, aomdelay=0, mwdelay=0):
+        """Collects the start and stop indices of the events in all channels into an :class:`IntervalTable`.
+        :param length: number of samples in the sequence
+        :param aomdelay: AOM delay in samples, the Green channel is moved earlier by this much
+        :param mwdelay: MW delay in samples, the S1 and S2 channels are moved earlier by this much
+        """
+        table = IntervalTable(length)
+        for channel in self.channels:
+            events = channel.events
+            if channel.ch_type == _WAVE or channel.ch_type == _RANDBENCH:
+                keep = events['envelope'] >= 0
+                rows = np.asarray(channel.rows, dtype=np.int64)[keep]
+                events = events[keep]
+                # the events of a train are grouped by their place in its phase cycle, each group is named by the row
+                # of its first event
+                trains = np.full(len(rows), -1, dtype=np.int64)
+                for train in np.unique(events['train'][events['train'] >= 0]):
+                    first, count, pattern = channel.table.trains[train]
+                    intrain = events['train'] == train
+                    trains[intrain] = first + (rows[intrain] - first) % pattern
+                    t1 = channel.table.events['t1_idx'][first:first + count]
+                    if count >= 2 * pattern:
+                        table.add_train_span(t1[0], t1[pattern] - t1[0], count // pattern)
+                envelopes = [channel.table.envelopes[eid] for eid in events['envelope']]
+                table.add_wave_events(events['t1_idx'], envelopes, trains=trains)
+                if self.sideband is not None:
+                    types = self.sideband_types()
+                    codes = [code for code, name in enumerate(channel.table.type_names) if name in types]
+                    modulated = np.isin(events['type'], codes)
+                    widths = np.array([env.shape[-1] for env in envelopes], dtype=np.int64)
+                    table.add_sideband_events(events['t1_idx'][modulated], (events['t1_idx'] + widths)[modulated])
+            elif channel.ch_type in _MARKER_ROUTES:
+                awgchannel, delaytype = _MARKER_ROUTES[channel.ch_type]
+                if channel.ch_type == _MW_S1:
+                    self.logger.warning(
+                        'Value error: only MW switch connected is S2 using Ch1, M1, this channel will do nothing')
+                delay = {'aom': aomdelay, 'mw': mwdelay}.get(delaytype, 0)
+                table.add_marker_events(awgchannel, events['t1_idx'], events['t2_idx'],
+                                        marker_bit(self.connectiondict[channel.ch_type]), delay=delay)
+        return table
 
 
 class RandomSequence(Sequence):
@@ -1831,7 +2525,10 @@ class RandomSequence(Sequence):
 
 
 class SequenceList(object):
-    def __init__(self, sequence, delay=None, scanparams=None, pulseparams=None, connectiondict=None, timeres=1, **kwargs):
+    def __init__(self, sequence, delay=None, scanparams=None, pulseparams=None, connectiondict=None, timeres=1,
+                 parallel=False, max_workers=None, stream=False, rb_seed=None, auto_timeres=False,
+                 envelope_tolerance=_EXACT_TOLERANCE, batched=False, incremental=False, store=None,
+                 coherent_sideband=False, **kwargs):
         """This class creates a list of sequence objects that each have the waveforms for one step in the scanlist.
         :param sequence: string that will be interpreted in same manner as Sequence class def
         :param delay: list with [AOM delay, MW delay] , possibly other delays to be added.
@@ -1840,7 +2537,26 @@ class SequenceList(object):
         :param connectiondict: a dictionary of the connections between AWG channels and switches/IQ modulators
         :param timeres: clock rate in ns
         :param scanparams : a dictionary that specifies the type, start, stepsize, number of steps
+        :param parallel: if True the scan points are built in a pool of worker processes
+        :param max_workers: number of worker processes, defaults to the number of CPUs
+        :param stream: if True, :meth:`AWGFile.write_sequence` writes each scan point to disk as soon as it is built
+                and does not keep it, see :meth:`iter_sequences`
+        :param rb_seed: seed for the truncation lengths and gates of a random scan, if None they are different every
+                time the scan is created
+        :param auto_timeres: if True the scan is built at the coarsest clock rate that gives the same sequence as
+                timeres, see :meth:`select_timeres`, and self.timeres is set to that clock rate
+        :param envelope_tolerance: largest difference in the I/Q data allowed when the clock rate is picked
+        :param batched: if True, amplitude, phase and SB freq scans are built in batches, see
+                :meth:`iter_sequences_batched`
+        :param incremental: if True, each point of a time scan is rendered from the data of the previous point, see
+                :meth:`iter_sequences_incremental`
+        :param store: optional :class:`WaveformStore` that the data of every point is written to as it is created, the
+                sequences then only hold memory mapped views of its file, see :meth:`iter_sequences`
+        :param coherent_sideband: if True, the sideband modulation of each point is applied once to its whole data, so
+                its phase is continuous across pulses, see :meth:`Sequence.modulate_sideband`. Such scans are not
+                batched, and time scans are not rendered incrementally.
         """
+        self.logger = logging.getLogger('seqlogger.seqlist')
         self.comp_seq_num = kwargs['compseqnum']
         self.pauli_rand_num = kwargs['paulirandnum']
         if delay is None:
@@ -1864,20 +2580,43 @@ class SequenceList(object):
         # self.pulseparams = pulseparams
         # self.connectiondict = connectiondict
         self.timeres = timeres
+        self.reference_timeres = timeres  # the clock rate given, which the sequence is specified at
+        self.auto_timeres = auto_timeres
+        self.envelope_tolerance = envelope_tolerance
         self.sequence = sequence
         self.sequencelist = []
         self.rbinfo_list = []
         self.rbscanlengths = []
+        self.parallel = parallel
+        self.max_workers = max_workers
+        self.stream = stream
+        self.batched = batched
+        self.incremental = incremental
+        self.store = store
+        self.coherent_sideband = coherent_sideband
+        self.rb_seed = rb_seed
+        self.points = []  # values of the scanned quantity at each scan point
+        self.seeds = []  # seeds for the random gates of each scan point
+        self.line_offsets = None  # amounts the times of each line are moved by at each point of a time scan
+        self.channel_cache = ChannelCache()  # marker channels that the points of the scan have in common
+        self.prepared = None  # the inputs that the scan points were worked out for, see ensure_prepared
 
     def create_sequence_list(self):
-        # dt = float(self.scanparams['stepsize'])
-        temp_pulseparams = self.pulseparams.copy()  # store a temporary copy of the pulseparams variable
+        """Creates the sequences of all the scan points and keeps them in self.sequencelist"""
+        self.sequencelist.extend(self.iter_sequences())
+        if self.scanparams['type'] == 'random scan':
+            self.logger.info('Random scan lengths: {0}'.format(self.rbscanlengths))
+
+    def prepare_scan(self):
+        """Parses the sequence text and works out the values of the scanned quantity at each scan point, which are
+        stored in self.points, with the seeds for the random gates of a random scan in self.seeds. Returns the number
+        of scan points."""
+        # parse the sequence text once, every scan point then only binds the value being scanned
+        self.parsed = ParsedSequence(self.sequence)
+        seeds = None
         if self.scanparams['type'] == 'no scan':
             # the no scan may be useful for testing sequences
-            s = Sequence(self.sequence, delay=self.delay, pulseparams=self.pulseparams,
-                         connectiondict=self.connectiondict, timeres=self.timeres)
-            s.create_sequence(dt=0)
-            self.sequencelist.append(s)
+            points = [0.0]
         # now we do the random scan
         elif self.scanparams['type'] == 'random scan':
             # rng = np.random.default_rng()
@@ -1886,65 +2625,485 @@ class SequenceList(object):
             # self.scanlist = rng.integers(self.scanparams['start'],stop,self.scanparams['steps'])
             # modified this as: we first generate a uniform list and then shuffle it for the purpose of interleaving. because the earlier method was repeating length values
             self.scanlist = np.linspace(self.scanparams['start'], stop, self.scanparams['steps'])
-            random.shuffle(self.scanlist)
+            rng = random if self.rb_seed is None else random.Random(self.rb_seed)
+            rng.shuffle(self.scanlist)
             self.scanlist = self.scanlist.astype(int)
             # for each truncation length, we need N_p pauli randomizations.
             self.scanlist = np.repeat(self.scanlist, self.pauli_rand_num)
             # choose how many pauli gate sequences you will run encoded in the parameter stepsize
             # self.paulinum = self.scanparams['stepsize']
-            for x in self.scanlist:
-                s = Sequence(self.sequence,delay=self.delay,pulseparams=self.pulseparams,connectiondict=self.connectiondict, timeres=self.timeres)
-                s.trunc_lengths = self.scanlist
-                # s.paulinum = self.paulinum
-                s.rb_nevents = x
-                s.comp_seq_num = self.comp_seq_num
-                print("scan length is",x)
-                s.create_sequence(dt=0.0)
+            points = list(self.scanlist)
+            # every point gets its own seed for the random gates, so that the gates do not depend on the order in
+            # which the points are built
+            seeds = [rng.getrandbits(32) for x in points]
+        elif self.scanparams['type'] in _SCAN_TYPES:
+            # all other types of scans
+            points = list(self.scanlist)
+        else:
+            points = []
+        if seeds is None:
+            seeds = [None] * len(points)
+        self.points = points
+        self.seeds = seeds
+        self.line_offsets = None
+        if self.scanparams['type'] == 'time':
+            # the times of every line at every point are worked out at once from the compiled time expressions
+            self.line_offsets = self.parsed.time_offsets(np.asarray(points, dtype=np.float64))
+        if self.auto_timeres:
+            self.timeres = self.select_timeres(self.envelope_tolerance)
+        self.prepared = self.scan_inputs()
+        return len(points)
+
+    def scan_inputs(self):
+        """Returns a copy of everything that prepare_scan works the scan points out from"""
+        return copy.deepcopy((self.sequence, self.scanparams, self.pulseparams, self.delay, self.connectiondict,
+                              self.reference_timeres, self.auto_timeres, self.envelope_tolerance, self.rb_seed,
+                              self.comp_seq_num, self.pauli_rand_num))
+
+    def ensure_prepared(self):
+        """Works out the scan points with :meth:`prepare_scan`, unless they were already worked out for the same
+        inputs, e.g. by the preflight check before the files are written. This way a random scan without an RB seed is
+        written with the truncation lengths and gates that were checked, and the clock rate is only picked once.
+        Returns the number of scan points."""
+        if self.prepared is None or self.prepared != self.scan_inputs():
+            return self.prepare_scan()
+        return len(self.points)
+
+    def select_timeres(self, tolerance=_EXACT_TOLERANCE, clocks=None):
+        """Returns the coarsest clock rate in ns at which every scan point is the same sequence as at the clock rate
+        given to this list: every delay and event edge must be on the grid of the coarser clock, and the I/Q data of
+        every Wave event made at the coarser clock, with each sample held for the length of a coarser clock period as
+        the AWG does, must be within tolerance of the data made at the given clock. Only clock rates that are
+        multiples of the given one are tried. The scan points must have been worked out by :meth:`prepare_scan`.
+        :param tolerance: largest difference in the I/Q data allowed
+        :param clocks: the clock rates to choose from, defaults to those of the AWG520
+        """
+        reference = to_ticks(self.reference_timeres * _ns)
+        if clocks is None:
+            clocks = _CLOCKS
+        candidates = sorted((c for c in clocks if to_ticks(c * _ns) > reference and
+                             to_ticks(c * _ns) % reference == 0), reverse=True)
+        grid = 0  # greatest common divisor of all the delays and edges in ticks
+        for delay in self.delay:
+            grid = math.gcd(grid, to_ticks(delay))
+        for index, (x, seed) in enumerate(zip(self.points, self.seeds)):
+            if not candidates:
+                break
+            s, dt = self.setup_sequence_point(x, seed, timeres=self.reference_timeres, index=index)
+            s.create_channels_from_seq(dt=dt)
+            for channel in s.channels:
+                events = channel.events
+                grid = math.gcd(grid, int(np.gcd.reduce(np.concatenate((events['start'], events['stop'])))))
+            candidates = [c for c in candidates if grid % to_ticks(c * _ns) == 0 and
+                          self.same_waves(s, x, seed, c, tolerance, index)]
+        if candidates:
+            self.logger.info('Using a clock rate of {0} ns instead of {1} ns'.format(candidates[0],
+                                                                                      self.reference_timeres))
+            return candidates[0]
+        return self.reference_timeres
+
+    def same_waves(self, s, x, seed, timeres, tolerance, index=None):
+        """Returns True if the I/Q data of the Wave events of one scan point made at another clock rate, with each
+        sample held for a whole period of that clock, is within tolerance of the data of the point at the clock rate
+        given to this list
+        :param s: the sequence of the point with its channels created at the given clock rate
+        :param x: the value of the scanned quantity at this point
+        :param seed: seed for the random gates of a random scan
+        :param timeres: the other clock rate in ns, a multiple of the given one
+        :param tolerance: largest difference in the I/Q data allowed
+        :param index: position of the point in the scan
+        """
+        step = to_ticks(timeres * _ns) // to_ticks(self.reference_timeres * _ns)
+        coarse, dt = self.setup_sequence_point(x, seed, timeres=timeres, index=index)
+        try:
+            with np.errstate(all='ignore'):
+                coarse.create_channels_from_seq(dt=dt)
+        except (ValueError, ZeroDivisionError, IndexError):
+            return False  # e.g. a pulse that is narrower than one sample
+        if len(coarse.channels) != len(s.channels):
+            return False
+        checked = set()
+        for channel, coarsechannel in zip(s.channels, coarse.channels):
+            if channel.ch_type != _WAVE and channel.ch_type != _RANDBENCH:
+                continue
+            envelopes = channel.events['envelope']
+            coarse_envelopes = coarsechannel.events['envelope']
+            if len(envelopes) != len(coarse_envelopes):
+                return False
+            for eid, coarse_eid in zip(envelopes, coarse_envelopes):
+                if (eid, coarse_eid) in checked:
+                    continue
+                checked.add((eid, coarse_eid))
+                if eid < 0 or coarse_eid < 0:
+                    if eid != coarse_eid:
+                        return False
+                    continue
+                data = channel.table.envelopes[eid]
+                coarse_data = coarsechannel.table.envelopes[coarse_eid]
+                if coarse_data.shape[-1] != -(-data.shape[-1] // step):
+                    return False
+                held = np.repeat(coarse_data, step, axis=-1)[:, :data.shape[-1]]
+                if not np.all(np.abs(data - held) <= tolerance):
+                    return False
+        return True
+
+    def iter_sequences(self):
+        """Generator that creates the sequences of the scan points one at a time, in order, without keeping them. This
+        lets the caller write each point to disk and release its arrays before the next one is built, so that the
+        memory used does not grow with the length of the scan. The random scan info is still collected. If the list has
+        a store, each point is appended to it before it is yielded, and the store is finished once all the points have
+        been created. The scan points are only worked out again if the inputs changed, see :meth:`ensure_prepared`."""
+        self.ensure_prepared()
+        if self.store is not None:
+            self.store.start(self)
+        if self.scanparams['type'] == 'pulsewidth' and not self.coherent_sideband:
+            self.prefill_waves()
+        if self.batched and self.scanparams['type'] in _BATCH_SCANS and len(self.points) > 1 and \
+                not self.coherent_sideband:
+            sequences = self.iter_sequences_batched(self.points)
+        elif self.incremental and self.scanparams['type'] == 'time' and len(self.points) > 1:
+            # rendering only what changed is cheaper than passing the whole data of every point back from workers
+            sequences = self.iter_sequences_incremental(self.points)
+        elif self.parallel and len(self.points) > 1:
+            sequences = self.iter_sequences_parallel(self.points, self.seeds)
+        else:
+            sequences = (self.create_sequence_point(x, seed, index) for index, (x, seed) in
+                         enumerate(zip(self.points, self.seeds)))
+        for x, s in zip(self.points, sequences):
+            if self.scanparams['type'] == 'random scan':
+                self.logger.info('Scan length is {0}'.format(x))
                 self.rbinfo_list.append(s.rbinfo_list)
                 self.rbscanlengths.append(x)
-                self.sequencelist.append(s)
-            print(self.rbscanlengths)
-        else:
-            # all other types of scans
-            for x in self.scanlist:
-                self.pulseparams = temp_pulseparams.copy()
-                if self.scanparams['type'] == 'time':
-                    s = Sequence(self.sequence, delay=self.delay, pulseparams=self.pulseparams,
-                                 connectiondict=self.connectiondict, timeres=self.timeres)
-                    s.create_sequence(float(x))
-                    self.sequencelist.append(s)
-                elif self.scanparams['type'] == 'amplitude':
-                    self.pulseparams['amplitude'] = float(x)
-                    s = Sequence(self.sequence, delay=self.delay, pulseparams=self.pulseparams,
-                                 connectiondict=self.connectiondict, timeres=self.timeres)
-                    s.create_sequence(dt=0)
-                    self.sequencelist.append(s)
-                elif self.scanparams['type'] == 'SB freq':
-                    self.pulseparams['SB freq'] = float(x)
-                    s = Sequence(self.sequence, delay=self.delay, pulseparams=self.pulseparams,
-                                 connectiondict=self.connectiondict, timeres=self.timeres)
-                    s.create_sequence(dt=0)
-                    self.sequencelist.append(s)
-                elif self.scanparams['type'] == 'pulsewidth':
-                    self.pulseparams['pulsewidth'] = float(x)
-                    s = Sequence(self.sequence, delay=self.delay, pulseparams=self.pulseparams,
-                                 connectiondict=self.connectiondict, timeres=self.timeres)
-                    s.create_sequence(dt=0)
-                    self.sequencelist.append(s)
-                elif self.scanparams['type'] == 'number':
-                    self.pulseparams['num pulses'] = int(x)
-                    s = Sequence(self.sequence, delay=self.delay, pulseparams=self.pulseparams,
-                                 connectiondict=self.connectiondict, timeres=self.timeres)
-                    s.create_sequence(dt=0)
-                    self.sequencelist.append(s)
-                elif self.scanparams['type'] == 'Carrier frequency':
-                    s = Sequence(self.sequence, delay=self.delay, pulseparams=self.pulseparams,
-                                 connectiondict=self.connectiondict, timeres=self.timeres)
-                    s.create_sequence(dt=0)
-                    self.sequencelist.append(s)
-                elif self.scanparams['type'] == 'phase':
-                    self.pulseparams['phase'] = float(x)
-                    s = Sequence(self.sequence, delay=self.delay, pulseparams=self.pulseparams,
-                                 connectiondict=self.connectiondict, timeres=self.timeres)
-                    s.create_sequence(dt=0)
-                    self.sequencelist.append(s)
+            if self.store is not None:
+                self.store.append(s)
+            yield s
+        if self.store is not None:
+            self.store.finish(self)
+
+    def prefill_waves(self):
+        """Generates the I and Q data of the Wave events of every point of the scan at once, see
+        :func:`prefill_wave_events`, so that each point then finds its pulses in the envelope cache. This is done for
+        pulsewidth scans, where the pulses of every point have a different width. Returns the number of pulses
+        generated."""
+        ticks_per_sample = to_ticks(float(self.timeres) * _ns)
+        times = self.parsed.time_ticks([0.0])[:, :, 0]
+        events = []
+        for x in self.points:
+            pulseparams = self.point_pulseparams(x)
+            for i, seqline in enumerate(self.parsed.lines):
+                if seqline.ch_type != _WAVE:
+                    continue
+                ptype, ampfactor, nevents, fname, phase, change_width, change_amp = seqline.bind(pulseparams)
+                params = pulseparams.copy()
+                params['amplitude'] = params['amplitude'] * ampfactor
+                params['phase'] = phase
+                # the phase of each event of the phase cycle, see Channel.add_event_train
+                cycle = [params]
+                if seqline.phases:
+                    cycle = [dict(params, phase=(float(phase) + float(p)) % 360.0) for p in seqline.phases]
+                # the first event of the line, and the rest of its train, which is not moved by the offsets
+                events.append((ptype, int(times[0, i]), int(times[1, i]), cycle[0]))
+                if nevents > 1:
+                    events.extend((ptype, to_ticks(seqline.start), to_ticks(seqline.stop), p) for p in cycle)
+        return prefill_wave_events(events, ticks_per_sample)
+
+    def create_sequence_point(self, x=0.0, seed=None, index=None):
+        """Creates the sequence for one point of the scan, using the sequence text that has already been parsed by
+        create_sequence_list.
+        :param x: the value of the scanned quantity at this point
+        :param seed: seed for the random gates of a random scan
+        :param index: position of the point in the scan
+        """
+        s, dt = self.setup_sequence_point(x, seed, index=index)
+        s.create_sequence(dt=dt)
+        return s
+
+    def analyze(self):
+        """Works out the size of the data of every scan point without rendering it, see :meth:`Sequence.analyze`.
+        Returns a list with the dict of each point, with the value of the scanned quantity added as 'point'. Scans
+        that do not change the time of any event only have their first point analyzed. The scan points are kept, so
+        that the sequences created afterwards are the ones analyzed, see :meth:`ensure_prepared`."""
+        self.ensure_prepared()
+        reports = []
+        for index, (x, seed) in enumerate(zip(self.points, self.seeds)):
+            if reports and self.scanparams['type'] in _UNTIMED_SCANS:
+                report = dict(reports[0])
+            else:
+                s, dt = self.setup_sequence_point(x, seed, index=index)
+                report = s.analyze(dt=dt)
+            report['point'] = x
+            reports.append(report)
+        return reports
+
+    def setup_sequence_point(self, x=0.0, seed=None, timeres=None, index=None):
+        """Returns the sequence for one point of the scan with the scanned quantity set, before its channels are
+        created, and the time increment to create them with.
+        :param x: the value of the scanned quantity at this point
+        :param seed: seed for the random gates of a random scan
+        :param timeres: clock rate in ns, defaults to self.timeres
+        :param index: position of the point in the scan, which times with an 'n' term depend on, defaults to 0
+        """
+        if timeres is None:
+            timeres = self.timeres
+        s = self.new_sequence(timeres)
+        if self.scanparams['type'] == 'random scan':
+            s.trunc_lengths = self.scanlist
+            # s.paulinum = self.paulinum
+            s.rb_nevents = x
+            s.comp_seq_num = self.comp_seq_num
+            s.rb_seed = seed
+        dt = 0.0
+        if self.scanparams['type'] == 'time':
+            dt = float(x)
+            if index is not None and self.line_offsets is not None:
+                s.line_offsets = self.line_offsets[:, :, index]
+            else:
+                s.line_offsets = s.parsed.time_offsets([dt], [index or 0])[:, :, 0]
+        elif _SCAN_TYPES.get(self.scanparams['type']) is not None:
+            s.pulseparams = self.point_pulseparams(x, timeres)  # the scanned value only changes this point
+        return s, dt
+
+    def point_pulseparams(self, x=None, timeres=None):
+        """Returns the pulse params of one scan point. The SB freq is in cycles per sample, so it is scaled to give the
+        same frequency at a clock rate other than the one given to this list.
+        :param x: the value of the scanned quantity at this point, if None the params of the list are returned
+        :param timeres: clock rate in ns, defaults to self.timeres
+        """
+        if timeres is None:
+            timeres = self.timeres
+        pulseparams = self.pulseparams.copy()
+        if timeres != self.reference_timeres:
+            pulseparams['SB freq'] = float(pulseparams['SB freq']) * timeres / self.reference_timeres
+        if x is not None and _SCAN_TYPES.get(self.scanparams['type']) is not None:
+            key, convert = _SCAN_TYPES[self.scanparams['type']]
+            value = convert(x)
+            if key == 'SB freq':
+                value = value * timeres / self.reference_timeres
+            pulseparams[key] = value
+        return pulseparams
+
+    def new_sequence(self, timeres=None):
+        """Returns an empty :class:`Sequence` of the already parsed sequence text with the params of this list
+        :param timeres: clock rate in ns, defaults to self.timeres
+        """
+        if timeres is None:
+            timeres = self.timeres
+        s = Sequence(self.parsed, delay=self.delay, pulseparams=self.point_pulseparams(timeres=timeres),
+                     connectiondict=self.connectiondict, timeres=timeres)
+        s.channel_cache = self.channel_cache
+        s.coherent_sideband = self.coherent_sideband
+        return s
+
+    def iter_sequences_incremental(self, points):
+        """Generator for time scans. Between two points of a time scan most of the data is the same: everything before
+        the first edge that moves is unchanged, and everything after the last edge that moves is only shifted. So each
+        point is rendered by copying those parts from the data of the previous point and rendering only the samples in
+        between, see :meth:`IntervalTable.rerender`. A point whose events are not the same as those of the previous
+        point, e.g. because a delayed marker wraps around differently, is rendered in full.
+        :param points: list of the values of the scanned quantity
+        """
+        previous = None
+        for index, x in enumerate(points):
+            s, dt = self.setup_sequence_point(x, index=index)
+            s.create_sequence(dt=dt, previous=previous)
+            yield s
+            previous = s
+
+    def iter_sequences_batched(self, points):
+        """Generator for scans that change only the amplitude, phase or SB freq, so that the events are at the same
+        times at every point. The channels are created once, the marker runs are made once and shared by all the
+        points, and the data of each Wave pulse is made for a whole batch of points at once as a (points x samples)
+        array, see :func:`wave_batch_data`. The sequences are yielded in order with only their arrays and event times
+        set. Sequences that can not be batched, e.g. with random gates or overlapping Wave events, are built one point
+        at a time instead.
+        :param points: list of the values of the scanned quantity
+        """
+        base, dt = self.setup_sequence_point(points[0])
+        base.create_channels_from_seq(dt=dt)
+        length = base.data_length()
+        groups = self.batch_groups(base, length)
+        if groups is None:
+            self.logger.info('Sequence can not be built in batches, building it one point at a time')
+            for x in points:
+                yield self.create_sequence_point(x)
+            return
+        aomdelay, mwdelay = base.sample_delays()
+        table = base.build_interval_table(length, aomdelay=aomdelay, mwdelay=mwdelay)
+        c1markers = table.marker_edges(1)
+        c2markers = table.marker_edges(2)
+        batchsize = max(1, _BATCH_BYTES // max(1, 2 * length * _IQTYPE.itemsize))
+        for first in range(0, len(points), batchsize):
+            batch = points[first:first + batchsize]
+            params = [self.point_pulseparams(x) for x in batch]
+            wavedata = np.zeros((len(batch), 2, length), dtype=_IQTYPE)
+            for line, width, starts, lengths, offset in groups:
+                bound = [base.parsed.lines[line].bind(p) for p in params]
+                ptype, fname = bound[0][0], bound[0][3]
+                # the same params as Sequence.create_channels_from_seq gives the events of this line
+                amps = [p['amplitude'] * b[1] for p, b in zip(params, bound)]
+                phases = [b[4] for b in bound]
+                if offset is not None:
+                    phases = [(phase + float(offset)) % 360.0 for phase in phases]  # as Channel.add_event_train does
+                ssb_freqs = [float(p['SB freq']) for p in params]
+                if len(starts) == 1 and lengths[0] == width:
+                    # a single event is generated straight into the data of the batch
+                    wave_batch_data(ptype, width, params[0], amps, ssb_freqs, phases, base.events.ticks_per_sample,
+                                    filename=fname, out=wavedata[:, :, starts[0]:starts[0] + width])
+                    continue
+                data = wave_batch_data(ptype, width, params[0], amps, ssb_freqs, phases,
+                                       base.events.ticks_per_sample, filename=fname)
+                for start, n in zip(starts.tolist(), lengths.tolist()):
+                    wavedata[:, :, start:start + n] = data[:, :, :n]
+            for j in range(len(batch)):
+                s = self.new_sequence()
+                s.wavedata = wavedata[j]
+                s.c1markers = c1markers
+                s.c2markers = c2markers
+                s.train_spans = table.train_spans
+                s.first_sequence_event = base.first_sequence_event
+                s.latest_sequence_event = base.latest_sequence_event
+                yield s
+            del wavedata
+
+    def batch_groups(self, base, length):
+        """Groups the Wave events of a sequence whose channels have been created by the line of the sequence they
+        come from and their envelope, and returns a list of (line, envelope length, start indices, lengths, phase of
+        the phase cycle or None) of each group, with the lengths cut short at the end of the data as the rasterizer
+        does. Returns None if the
+        sequence can not be built in batches.
+        :param base: the sequence
+        :param length: the number of samples in its data
+        """
+        rows = []
+        for channel in base.channels:
+            if channel.ch_type == _RANDBENCH:
+                return None  # the gates are random
+            if channel.ch_type == _WAVE:
+                rows.extend(channel.rows)
+        events = base.events.events
+        rows = np.array(sorted(rows), dtype=np.int64)
+        rows = rows[events['envelope'][rows] >= 0]
+        widths = np.array([base.events.envelopes[eid].shape[-1] for eid in events['envelope'][rows]], dtype=np.int64)
+        starts = events['t1_idx'][rows]
+        lengths = np.clip(np.minimum(widths, length - starts), 0, None)
+        if count_overlaps(starts, starts + lengths) > 0:
+            return None  # later events overwrite earlier ones, which the batches do not do
+        groups = []
+        for line, linerows in enumerate(base.line_rows):
+            inline = (rows >= linerows.start) & (rows < linerows.stop)
+            seqline = base.parsed.lines[line]
+            if np.any(inline) and (_WAVE_PULSES[seqline.pulsetype][0].MODULATION is None or
+                                   'IQdata.txt' in str(seqline.fname)):
+                return None  # the pulse does not make its I and Q data from an envelope
+            for eid in np.unique(events['envelope'][rows[inline]]):
+                group = inline & (events['envelope'][rows] == eid)
+                offset = None  # the phase added to the events of the group by the phase cycle of the line
+                if seqline.phases:
+                    offset = seqline.phases[(int(rows[group][0]) - linerows.start) % len(seqline.phases)]
+                groups.append((line, base.events.envelopes[eid].shape[-1], starts[group], lengths[group], offset))
+        return groups
+
+    def iter_sequences_parallel(self, points, seeds):
+        """Generator that builds the scan points in a pool of worker processes. Each worker parses the sequence text
+        once, and writes the I/Q data of every point it builds to a file in a temporary directory, which is then mapped
+        into memory here, so that the arrays are neither pickled to get them out of the workers nor copied. Only the
+        marker runs, which are small, are passed back with the result. The sequences are yielded in the same order as
+        the points, and only have their arrays and event times set, not their channels. Only a few points more than the
+        number of workers are built ahead of the one being yielded.
+        :param points: list of the values of the scanned quantity
+        :param seeds: list with the seed for the random gates of each point
+        """
+        if self.scanparams['type'] == 'random scan':
+            # make sure the computational gate sequences exist before the workers start, or they would each make them
+            RandomGateChannel().save_comp_seq()
+        spec = (self.sequence, self.delay, self.scanparams, self.pulseparams, self.connectiondict,
+                self.reference_timeres, self.comp_seq_num, self.pauli_rand_num, self.scanlist, self.timeres,
+                self.coherent_sideband)
+        tempdir = _SequenceFileDir()
+        filenames = [os.path.join(tempdir.path, '{0:d}.dat'.format(idx)) for idx in range(len(points))]
+        with ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_sequence_worker,
+                                 initargs=(spec,)) as pool:
+            ahead = 2 * (self.max_workers or os.cpu_count() or 1)
+            futures = collections.deque()
+            jobs = iter(zip(points, seeds, filenames, itertools.count()))
+            for x, seed, fname, index in itertools.islice(jobs, ahead):
+                futures.append((pool.submit(_create_sequence_file, x, seed, fname, index), fname))
+            while futures:
+                future, fname = futures.popleft()
+                for x, seed, nextfname, index in itertools.islice(jobs, 1):
+                    futures.append((pool.submit(_create_sequence_file, x, seed, nextfname, index), nextfname))
+                length, first, latest, rbinfo, s1markers, s2markers = future.result()
+                s = self.new_sequence()
+                s.wavedata = _read_sequence_file(fname, length, tempdir)
+                s.c1markers, s.c2markers = s1markers, s2markers
+                s.first_sequence_event = first
+                s.latest_sequence_event = latest
+                s.rbinfo_list = rbinfo
+                yield s
+                del s
+
+
+# the SequenceList that each worker process of a parallel build uses to create its points
+_worker_seqlist = None
+
+
+def _init_sequence_worker(spec):
+    """Creates the SequenceList of a worker process and parses the sequence text"""
+    global _worker_seqlist
+    (sequence, delay, scanparams, pulseparams, connectiondict, timeres, compseqnum, paulirandnum, scanlist, clock,
+     coherent_sideband) = spec
+    _worker_seqlist = SequenceList(sequence, delay=delay, scanparams=scanparams, pulseparams=pulseparams,
+                                   connectiondict=connectiondict, timeres=timeres, compseqnum=compseqnum,
+                                   paulirandnum=paulirandnum, coherent_sideband=coherent_sideband)
+    _worker_seqlist.scanlist = scanlist
+    _worker_seqlist.timeres = clock  # the clock rate picked by the parent
+    _worker_seqlist.parsed = ParsedSequence(sequence)
+
+
+def _create_sequence_file(x, seed, fname, index=None):
+    """Creates one scan point in a worker process and writes its I and Q data to a file, one after the other. Returns
+    the number of samples, the first and latest event times, the random scan info and the marker runs of channel 1
+    and 2 of the sequence."""
+    s = _worker_seqlist.create_sequence_point(x, seed, index)
+    length = len(s.c1markers)
+    data = np.memmap(fname, dtype=_IQTYPE, mode='w+', shape=(2, max(length, 1)))
+    data[:, :length] = s.wavedata
+    data.flush()
+    del data
+    return length, s.first_sequence_event, s.latest_sequence_event, s.rbinfo_list, s.c1markers, s.c2markers
+
+
+class _SequenceFileDir:
+    """Temporary directory of the files written by the workers of a parallel build. Each view of a file keeps the
+    directory alive, and the directory is deleted once the build and the last view are released."""
+
+    def __init__(self):
+        self.path = tempfile.mkdtemp(prefix='seqlist_')
+        weakref.finalize(self, _remove_sequence_dir, self.path)
+
+
+def _remove_sequence_dir(path):
+    """Deletes the temporary directory of a parallel build, with the files of any points that were never read"""
+    try:
+        shutil.rmtree(path)
+    except OSError as err:
+        modlogger.warning('Could not delete {0}: {1}'.format(path, err))
+
+
+def _read_sequence_file(fname, length, tempdir):
+    """Returns the I and Q data written by :func:`_create_sequence_file` as a read-only view of the file mapped into
+    memory, so that it is not copied. The file is deleted once the view is released and the file is unmapped, which
+    Windows needs before the file can be deleted, and the view keeps the temporary directory alive until then."""
+    with open(fname, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    weakref.finalize(buf, _remove_sequence_file, fname, tempdir)
+    return np.frombuffer(buf, dtype=_IQTYPE, count=2 * max(length, 1)).reshape(2, -1)[:, :length]
+
+
+def _remove_sequence_file(fname, tempdir):
+    """Deletes a file written by :func:`_create_sequence_file`. The temporary directory is only passed to keep it
+    alive while the file is mapped."""
+    try:
+        os.remove(fname)
+    except OSError as err:
+        modlogger.warning('Could not delete {0}: {1}'.format(fname, err))
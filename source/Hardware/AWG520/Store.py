@@ -0,0 +1,190 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+# The waveform store keeps the compiled data of every point of a scan in a single file on disk, with an index of where
+# the I/Q data and the marker runs of each point start. The sequences built by a SequenceList that has a store only
+# hold memory mapped views of that file, so a scan can be larger than the RAM and every point can still be read back at
+# random, e.g. to preview it or upload it again. The store can be opened in another process, such as the scan process
+# or an analysis notebook, without compiling anything.
+
+import logging
+import pickle
+import numpy as np
+from pathlib import Path
+from source.Hardware.AWG520.Sequence import Sequence, ParsedSequence
+from source.Hardware.AWG520.Rasterizer import MarkerEdges
+
+_IQTYPE = np.dtype('<f4')  # AWG520 stores analog values as 4 bytes in little-endian format
+_MARKTYPE = np.dtype('<i1')  # AWG520 stores marker values as 1 byte
+_IDXTYPE = np.dtype('<i8')  # sample indices
+_ALIGN = 8  # every array in the data file starts on a multiple of this many bytes
+_DATA_FILE = 'waveforms.dat'  # the I/Q data and marker runs of all the points
+_INDEX_FILE = 'index.npy'  # one row of _INDEX per point
+_INFO_FILE = 'info.pkl'  # the sequence, its params and the scan info of the SequenceList
+# byte offsets in the data file of the I/Q data and of the marker runs of channel 1 and 2 of a point, with the number of
+# runs, the number of samples and the first and latest event of the sequence
+_INDEX = np.dtype([('length', _IDXTYPE), ('iq', _IDXTYPE), ('c1', _IDXTYPE), ('c1runs', _IDXTYPE), ('c2', _IDXTYPE),
+                   ('c2runs', _IDXTYPE), ('first', '<f8'), ('latest', '<f8')])
+
+
+class WaveformStore(object):
+    """Store of the compiled data of the points of a scan in a single memory mapped file
+    :param dirpath: directory that holds the data, index and info files of the store, it is created if needed
+    :param create: if True any data already in the directory is discarded, otherwise the store that was written there
+            before is opened
+
+    A SequenceList with a store appends each point to it as it is created, see :meth:`SequenceList.iter_sequences`, and
+    the index and info files are written when the scan is finished. The data of a point is read back with
+    :meth:`wavedata` and :meth:`markers`, or as a :class:`Sequence` with store[index].
+    """
+
+    def __init__(self, dirpath, create=False):
+        self.dirpath = Path(dirpath)
+        self.datapath = self.dirpath / _DATA_FILE
+        self.logger = logging.getLogger('seqlogger.store')
+        self.dirpath.mkdir(parents=True, exist_ok=True)
+        self.datafile = None  # the data file while points are being appended
+        self.size = 0  # bytes in the data file
+        self.parsed = None
+        if create:
+            self.index = np.zeros(0, dtype=_INDEX)
+            self.info = {}
+            self.datapath.write_bytes(b'')
+        else:
+            self.index = np.load(self.dirpath / _INDEX_FILE)
+            with open(self.dirpath / _INFO_FILE, 'rb') as f:
+                self.info = pickle.load(f)
+            self.size = self.datapath.stat().st_size
+        self.rows = list(self.index)  # the index rows of the points appended since the store was created
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, index):
+        return self.sequence(index)
+
+    @property
+    def points(self):
+        """The values of the scanned quantity at each point"""
+        return self.info.get('points', [])
+
+    def start(self, sequences):
+        """Discards the points in the store and records the sequence and params of a SequenceList that is about to
+        append its points
+        :param sequences: the SequenceList
+        """
+        self.close()
+        self.datafile = open(self.datapath, 'wb')
+        self.size = 0
+        self.rows = []
+        self.index = np.zeros(0, dtype=_INDEX)
+        self.parsed = None
+        self.info = {'sequence': sequences.sequence, 'delay': sequences.delay, 'pulseparams': sequences.pulseparams,
+                     'connectiondict': sequences.connectiondict, 'timeres': sequences.timeres}
+
+    def append(self, sequence):
+        """Writes the I/Q data and the marker runs of the next point to the data file, and replaces the arrays of the
+        sequence with views of the file. Returns the index of the point.
+        :param sequence: the created :class:`Sequence` of the point
+        """
+        row = np.zeros((), dtype=_INDEX)
+        row['length'] = len(sequence.c1markers)
+        row['first'] = sequence.first_sequence_event
+        row['latest'] = sequence.latest_sequence_event
+        row['iq'] = self.write(np.asarray(sequence.wavedata, dtype=_IQTYPE))
+        for ch, markers in (('c1', sequence.c1markers), ('c2', sequence.c2markers)):
+            row[ch] = self.write(markers.positions)
+            self.write(markers.values)
+            row[ch + 'runs'] = len(markers.positions)
+        self.datafile.flush()
+        self.rows.append(row)
+        index = len(self.rows) - 1
+        sequence.wavedata, sequence.c1markers, sequence.c2markers = self.views(row)
+        return index
+
+    def write(self, data):
+        """Writes an array to the end of the data file, padded to _ALIGN bytes, and returns its offset"""
+        offset = self.size
+        data = np.ascontiguousarray(data)
+        self.datafile.write(memoryview(data).cast('B'))
+        padding = -data.nbytes % _ALIGN
+        self.datafile.write(bytes(padding))
+        self.size += data.nbytes + padding
+        return offset
+
+    def finish(self, sequences):
+        """Writes the index and the scan info of a SequenceList once all its points have been appended, after which the
+        store can be opened by other processes
+        :param sequences: the SequenceList
+        """
+        self.close()
+        self.index = np.array(self.rows, dtype=_INDEX)
+        self.info.update({'points': list(sequences.points), 'rbinfo_list': sequences.rbinfo_list,
+                          'rbscanlengths': sequences.rbscanlengths})
+        np.save(self.dirpath / _INDEX_FILE, self.index)
+        with open(self.dirpath / _INFO_FILE, 'wb') as f:
+            pickle.dump(self.info, f)
+        self.logger.info('Stored {0:d} scan points in {1:d} bytes'.format(len(self.index), self.size))
+
+    def close(self):
+        """Closes the data file if points are being appended"""
+        if self.datafile is not None:
+            self.datafile.close()
+            self.datafile = None
+
+    def views(self, row):
+        """Returns the I/Q data and the marker runs of channel 1 and 2 of a point as views of the data file
+        :param row: the index row of the point
+        """
+        length = int(row['length'])
+        c2runs = int(row['c2runs'])
+        stop = int(row['c2']) + c2runs * (_IDXTYPE.itemsize + 1)
+        start = int(row['iq'])
+        region = np.memmap(self.datapath, dtype=np.uint8, mode='r', offset=start, shape=(stop - start,))
+        wavedata = region[:2 * length * _IQTYPE.itemsize].view(_IQTYPE).reshape(2, length)
+        markers = []
+        for ch in ('c1', 'c2'):
+            runs = int(row[ch + 'runs'])
+            offset = int(row[ch]) - start
+            positions = region[offset:offset + runs * _IDXTYPE.itemsize].view(_IDXTYPE)
+            offset += runs * _IDXTYPE.itemsize
+            values = region[offset:offset + runs].view(_MARKTYPE)
+            markers.append(MarkerEdges(length, positions, values))
+        return wavedata, markers[0], markers[1]
+
+    def wavedata(self, index):
+        """Returns the (2 x samples) I/Q data of a point as a view of the data file"""
+        return self.views(self.rows[index])[0]
+
+    def markers(self, index, channelnum=1):
+        """Returns the marker runs of channel 1 or 2 of a point, as a :class:`MarkerEdges` of views of the data file"""
+        return self.views(self.rows[index])[channelnum]
+
+    def sequence(self, index):
+        """Returns a :class:`Sequence` of a point with its arrays set to views of the data file, which can be written to
+        wfm files like the sequences of a SequenceList. Its channels are not created.
+        :param index: index of the point
+        """
+        if self.parsed is None:
+            self.parsed = ParsedSequence(self.info['sequence'])
+        row = self.rows[index]
+        s = Sequence(self.parsed, delay=self.info['delay'], pulseparams=self.info['pulseparams'],
+                     connectiondict=self.info['connectiondict'], timeres=self.info['timeres'])
+        s.wavedata, s.c1markers, s.c2markers = self.views(row)
+        s.first_sequence_event = float(row['first'])
+        s.latest_sequence_event = float(row['latest'])
+        rbinfo_list = self.info.get('rbinfo_list', [])
+        if index < len(rbinfo_list):
+            s.rbinfo_list = rbinfo_list[index]
+        return s
@@ -0,0 +1,208 @@
+# tests for writing the wfm and seq files of a scan
+import filecmp
+import sys
+import numpy as np
+import pytest
+from source.Hardware.AWG520.AWG520 import AWGFile, _WFM_RECORD
+from source.Hardware.AWG520.Cache import SequenceCache
+from source.Hardware.AWG520.Sequence import SequenceList
+
+_PARAMS = {'amplitude': 500.0, 'pulsewidth': 10e-9, 'SB freq': 0.01, 'IQ scale factor': 1.0, 'phase': 0.0,
+           'skew phase': 0.0, 'num pulses': 1}
+
+
+def write_scan(dirpath, cache=None, **kwargs):
+    seq = 'S2,0,1.01e-6+t\nWave,1e-6,1.01e-6+t,Square\nGreen,1.01e-6+t,2e-6+t\nMeasure,1.01e-6+t,1.1e-6+t'
+    scan = {'type': 'time', 'start': 0, 'stepsize': 10e-9, 'steps': 3}
+    slist = SequenceList(seq, pulseparams=_PARAMS.copy(), scanparams=scan, timeres=1, compseqnum=1, paulirandnum=1,
+                         **kwargs)
+    AWGFile(ftype='SEQ', timeres=1, dirpath=dirpath).write_sequence(sequences=slist, repeat=100, cache=cache)
+    return slist
+
+
+def test_streamed_files(tmp_path):
+    (tmp_path / 'list').mkdir()
+    (tmp_path / 'stream').mkdir()
+    write_scan(tmp_path / 'list')
+    slist = write_scan(tmp_path / 'stream', stream=True)
+    assert slist.sequencelist == []  # nothing is kept when streaming
+    names = sorted(p.name for p in (tmp_path / 'list').iterdir())
+    assert names == sorted(p.name for p in (tmp_path / 'stream').iterdir())
+    assert 'scan.seq' in names and '3_2.wfm' in names
+    match, mismatch, errors = filecmp.cmpfiles(tmp_path / 'list', tmp_path / 'stream', names, shallow=False)
+    assert mismatch == [] and errors == []
+
+
+def test_cached_files(tmp_path, monkeypatch):
+    cache = SequenceCache(tmp_path / 'cache')
+    for name in ('first', 'second', 'other'):
+        (tmp_path / name).mkdir()
+    write_scan(tmp_path / 'first', cache=cache)
+    assert len(cache.entries()) == 1
+    # the second time nothing is compiled, the files come from the cache
+    monkeypatch.setattr(SequenceList, 'iter_sequences', None)
+    slist = write_scan(tmp_path / 'second', cache=cache, stream=True)
+    names = sorted(p.name for p in (tmp_path / 'first').iterdir())
+    assert len(names) == 2 * len(slist.points) + 3  # a wfm file per channel and point, plus the arm and seq files
+    assert names == sorted(p.name for p in (tmp_path / 'second').iterdir())
+    assert filecmp.cmpfiles(tmp_path / 'first', tmp_path / 'second', names, shallow=False)[1:] == ([], [])
+    monkeypatch.undo()
+    # different parameters are a different entry, and the oldest entry is evicted once the cache is too large
+    cache.max_bytes = cache.size() + 1
+    write_scan(tmp_path / 'other', cache=cache, delay=[10e-9, 0.0])
+    assert len(cache.entries()) == 1 and cache.size() <= cache.max_bytes
+    assert cache.fetch(cache.key(slist, seqfilename='scan.seq', repeat=100, clock=1), tmp_path, slist) is False
+
+
+def test_cached_auto_timeres(tmp_path, monkeypatch):
+    seq = 'S2,1e-6,1.1e-6+t\nWave,1e-6,1.1e-6+t,Square\nGreen,2e-6+t,5e-6+t\nMeasure,2e-6+t,2.3e-6+t'
+    scan = {'type': 'time', 'start': 0, 'stepsize': 50e-9, 'steps': 3}
+    cache = SequenceCache(tmp_path / 'cache')
+    for name in ('first', 'second'):
+        (tmp_path / name).mkdir()
+        slist = SequenceList(seq, pulseparams=dict(_PARAMS, **{'SB freq': 0.0}), scanparams=scan, timeres=1,
+                             compseqnum=1, paulirandnum=1, auto_timeres=True)
+        awgfile = AWGFile(ftype='SEQ', timeres=1, dirpath=tmp_path / name)
+        awgfile.write_sequence(sequences=slist, repeat=100, cache=cache)
+        assert slist.timeres == awgfile.timeres == 25
+        monkeypatch.setattr(SequenceList, 'iter_sequences', None)  # the second time the files come from the cache
+
+
+def test_random_scan_key(tmp_path):
+    cache = SequenceCache(tmp_path)
+    scan = {'type': 'random scan', 'start': 2, 'stepsize': 1, 'steps': 3}
+    slists = [SequenceList('RandBench,1e-6,1.1e-6', pulseparams=_PARAMS.copy(), scanparams=scan, compseqnum=1,
+                           paulirandnum=1, rb_seed=seed) for seed in (None, 7, 7)]
+    assert cache.key(slists[0]) is None  # the gates are different every time
+    assert cache.key(slists[1]) == cache.key(slists[2])
+    slists[1].prepare_scan()
+    slists[2].prepare_scan()
+    assert slists[1].points == slists[2].points and slists[1].seeds == slists[2].seeds
+
+
+def test_sideband_mode_key(tmp_path):
+    cache = SequenceCache(tmp_path)
+    scan = {'type': 'amplitude', 'start': 100, 'stepsize': 100, 'steps': 2}
+    keys = [cache.key(SequenceList('Wave,1e-6,1.1e-6,Gauss', pulseparams=_PARAMS.copy(), scanparams=scan,
+                                   compseqnum=1, paulirandnum=1, coherent_sideband=coherent))
+            for coherent in (False, True)]
+    assert keys[0] != keys[1]  # the sideband is modulated differently, so the files are different
+
+
+def test_preflight(tmp_path):
+    (tmp_path / 'files').mkdir()
+    slist = write_scan(tmp_path / 'files')
+    report = AWGFile(ftype='SEQ', timeres=1, dirpath=tmp_path).preflight(slist, repeat=100)
+    assert report['errors'] == [] and report['warnings'] == []
+    sizes = {p.name: p.stat().st_size for p in (tmp_path / 'files').iterdir()}
+    assert report['total bytes'] == sum(sizes.values())
+    assert report['seq bytes'] == sizes['scan.seq'] and report['arm bytes'] == sizes['arm_1.wfm']
+    for i, point in enumerate(report['points']):
+        assert point['file bytes'] == sizes[str(i + 1) + '_1.wfm'] == sizes[str(i + 1) + '_2.wfm']
+        assert point['padded length'] % 4 == 0 and point['padded length'] - point['length'] < 4
+    assert report['latest event'] == report['points'][-1]['latest event'] > report['points'][0]['latest event']
+    # a waveform longer than the AWG memory is found without creating it
+    scan = {'type': 'time', 'start': 0, 'stepsize': 2e-3, 'steps': 2}
+    slist = SequenceList('Green,0,1e-6+t', scanparams=scan, compseqnum=1, paulirandnum=1)
+    report = AWGFile(ftype='SEQ', timeres=1, dirpath=tmp_path).preflight(slist)
+    assert len(report['errors']) == 1 and 'Scan point 2' in report['errors'][0]
+
+
+def test_preflight_random_scan(tmp_path):
+    # the scan that is written is the one that was checked, with or without an RB seed
+    scan = {'type': 'random scan', 'start': 2, 'stepsize': 1, 'steps': 6}
+    for seed in (None, 7):
+        dirpath = tmp_path / str(seed)
+        dirpath.mkdir()
+        slist = SequenceList('RandBench,1e-6,1.1e-6\nGreen,1.2e-6,2e-6', pulseparams=_PARAMS.copy(), scanparams=scan,
+                             compseqnum=1, paulirandnum=1, rb_seed=seed, stream=True)
+        awgfile = AWGFile(ftype='SEQ', timeres=1, dirpath=dirpath)
+        report = awgfile.preflight(slist, repeat=100)
+        awgfile.write_sequence(sequences=slist, repeat=100)
+        assert [point['point'] for point in report['points']] == slist.rbscanlengths
+        for i, point in enumerate(report['points']):
+            assert point['file bytes'] == (dirpath / (str(i + 1) + '_1.wfm')).stat().st_size
+
+
+def read_wfm(fname):
+    data = fname.read_bytes()
+    start = data.index(b'#')
+    ndigits = int(data[start + 1:start + 2])
+    nbytes = int(data[start + 2:start + 2 + ndigits])
+    return np.frombuffer(data, dtype=_WFM_RECORD, count=nbytes // _WFM_RECORD.itemsize, offset=start + 2 + ndigits)
+
+
+def test_idle_segments(tmp_path):
+    seq = 'Green,0,1e-6\nWave,1e-6,1.01e-6+t,Square\nS2,1.05e-6,1.1e-6\nGreen,20e-6+t,21e-6+t'
+    scan = {'type': 'time', 'start': 0, 'stepsize': 10e-9, 'steps': 2}
+    for name in ('plain', 'idle', 'repeat'):
+        (tmp_path / name).mkdir()
+    for name, repeat, compress in (('plain', 1, False), ('idle', 1, True), ('repeat', 100, True)):
+        slist = SequenceList(seq, pulseparams=_PARAMS.copy(), scanparams=scan, timeres=1, compseqnum=1, paulirandnum=1)
+        AWGFile(ftype='SEQ', timeres=1, dirpath=tmp_path / name).write_sequence(sequences=slist, repeat=repeat,
+                                                                                compress_idle=compress)
+    # idle segments are only compressed when each point is played once
+    names = sorted(p.name for p in (tmp_path / 'plain').iterdir())
+    assert sorted(p.name for p in (tmp_path / 'repeat').iterdir()) == names
+    sizes = [sum(p.stat().st_size for p in (tmp_path / name).iterdir() if 'arm' not in p.name)
+             for name in ('idle', 'plain')]
+    assert sizes[0] < sizes[1] / 4
+    # playing the lines of each point one after the other gives the same data as the uncompressed files
+    lines = seq_lines(tmp_path / 'idle')
+    assert len(lines) > 2 * len(slist.points) and all(int(line[3]) == 0 for line in lines if 'idle' in line[0])
+    assert_played(tmp_path / 'idle', tmp_path / 'plain', len(slist.points))
+
+
+def seq_lines(dirpath):
+    """Returns the lines of the scan points in the seq file of a directory, split into their fields"""
+    lines = (dirpath / 'scan.seq').read_bytes().decode().split('\r\n')
+    return [line.split(',') for line in lines[3:int(lines[1].split()[1]) + 2]]
+
+
+def assert_played(dirpath, plainpath, numpoints):
+    """Checks that playing the lines of each point of a compressed seq file gives the data of the plain files"""
+    points = []
+    for line in seq_lines(dirpath):
+        if line[3] == '1':
+            points.append([])
+        points[-1] += [read_wfm(dirpath / f.strip('"')) for f in line[:2]] * int(line[2])
+    assert len(points) == numpoints
+    for i, point in enumerate(points):
+        for c in (1, 2):
+            played = np.concatenate(point[c - 1::2])
+            expected = read_wfm(plainpath / (str(i + 1) + '_' + str(c) + '.wfm'))
+            assert np.array_equal(played, expected)
+
+
+def test_train_segments(tmp_path):
+    seq = 'Green,0,1e-6\nS2,1e-6,17.2e-6\nWave,1e-6,1.02e-6,Square,n=400,sep=2e-8,phases=0;90'
+    scan = {'type': 'amplitude', 'start': 100, 'stepsize': 100, 'steps': 2}
+    for name, compress in (('plain', False), ('train', True)):
+        (tmp_path / name).mkdir()
+        slist = SequenceList(seq, pulseparams=_PARAMS.copy(), scanparams=scan, timeres=1, compseqnum=1, paulirandnum=1)
+        AWGFile(ftype='SEQ', timeres=1, dirpath=tmp_path / name).write_sequence(sequences=slist, repeat=1,
+                                                                                compress_idle=compress)
+    # the pulses are played as one period of 2 pulses repeated, which is stretched to at least 256 samples
+    lines = seq_lines(tmp_path / 'train')
+    assert [int(line[2]) for line in lines] == [1, 49, 1] * 2
+    assert_played(tmp_path / 'train', tmp_path / 'plain', 2)
+
+
+def test_segment_line_limit(tmp_path, monkeypatch):
+    seq = 'Green,0,1e-6\nS2,1e-6,17.2e-6\nWave,1e-6,1.02e-6,Square,n=400,sep=2e-8,phases=0;90'
+    scan = {'type': 'amplitude', 'start': 100, 'stepsize': 100, 'steps': 2}
+    slist = SequenceList(seq, pulseparams=_PARAMS.copy(), scanparams=scan, timeres=1, compseqnum=1, paulirandnum=1)
+    awgfile = AWGFile(ftype='SEQ', timeres=1, dirpath=tmp_path)
+    # the seq lines of the segments are counted
+    report = awgfile.preflight(slist, repeat=1, compress_idle=True)
+    awgfile.write_sequence(sequences=slist, repeat=1, compress_idle=True)
+    assert report['errors'] == [] and report['seq bytes'] == (tmp_path / 'scan.seq').stat().st_size
+    (tmp_path / 'scan.seq').unlink()
+    # 7 lines with the arm line do not fit, while 3 would
+    monkeypatch.setattr(sys.modules[AWGFile.__module__], '_SEQ_MEMORY_LIMIT', 5)
+    assert awgfile.preflight(slist, repeat=1)['errors'] == []
+    report = awgfile.preflight(slist, repeat=1, compress_idle=True)
+    assert report['errors'] == ['Scan has 7 sequence lines, the limit is 5']
+    with pytest.raises(ValueError):
+        awgfile.write_sequence(sequences=slist, repeat=1, compress_idle=True)
+    assert not (tmp_path / 'scan.seq').exists()
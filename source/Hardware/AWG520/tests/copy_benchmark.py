@@ -0,0 +1,43 @@
+# Benchmark of the copies of the I/Q data made while a sequence is created. For each pulse type it prints the memory
+# allocated while the data of one event is generated and while it is rendered into the data of the sequence, in units
+# of the size of the float32 I/Q data of the event, i.e. the number of copies of the event data, and the time taken.
+# Run it with python -m source.Hardware.AWG520.tests.copy_benchmark from the top directory of the repo.
+import time
+import tracemalloc
+from source.Hardware.AWG520.Pulse import envelope_cache
+from source.Hardware.AWG520.Sequence import Sequence, wave_event_data
+from source.Hardware.AWG520.Events import to_ticks
+
+_PARAMS = {'amplitude': 500.0, 'pulsewidth': 100e-9, 'SB freq': 0.01, 'IQ scale factor': 0.9, 'phase': 10.0,
+           'skew phase': 3.0, 'num pulses': 1}
+_SAMPLES = 4000000  # length of the Wave event, in samples at a 1 ns clock
+
+
+def measure(func):
+    """Returns the result of func, the bytes allocated on top of what was allocated before it, and the time taken"""
+    envelope_cache.clear()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    t0 = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return result, peak, elapsed
+
+
+def main():
+    print('{0:<8s} {1:>16s} {2:>12s} {3:>16s} {4:>12s}'.format('pulse', 'generate copies', 'time (s)',
+                                                              'sequence copies', 'time (s)'))
+    for pulse_type in ('Gauss', 'Square', 'SquareI', 'Sech'):
+        (stop, duration, data), peak, generate_time = measure(
+            lambda: wave_event_data(pulse_type, 0, to_ticks(_SAMPLES * 1e-9), _PARAMS, 1000))
+        # the copies of the whole sequence include the data of the sequence itself
+        s = Sequence('Wave,1e-6,{0:g},{1:s}'.format(1e-6 + _SAMPLES * 1e-9, pulse_type), pulseparams=_PARAMS)
+        result, seqpeak, sequence_time = measure(lambda: s.create_sequence())
+        print('{0:<8s} {1:>16.2f} {2:>12.3f} {3:>16.2f} {4:>12.3f}'.format(
+            pulse_type, peak / data.nbytes, generate_time, seqpeak / s.wavedata.nbytes, sequence_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# tests for the structured array event table and the channels built on it
+import numpy as np
+from source.Hardware.AWG520.Events import EventTable, EventView, EventIndex, to_ticks, ticks_to_samples
+from source.Hardware.AWG520.Sequence import Channel, GaussPulse, S2, Sequence
+
+
+def test_table_rows():
+    table = EventTable(1e-9, capacity=2)
+    env = np.ones((2, 10), dtype=np.float32)
+    rows = [table.append(to_ticks(1e-6 + n * 20e-9), to_ticks(1.01e-6 + n * 20e-9), pulse_type='Square', data=env)
+            for n in range(5)]
+    assert rows == list(range(5)) and len(table) == 5
+    assert len(table.envelopes) == 1  # the same array is only stored once
+    assert list(table.events['t1_idx']) == [1000, 1020, 1040, 1060, 1080]
+    table.append(to_ticks(2e-6), to_ticks(2.1e-6), start_increment=1.0, pulse_type='Green')
+    table.increment_time(5, 10e-9)
+    view = EventView(table, 5)
+    assert (view.t1_idx, view.t2_idx, view.event_type, view.data) == (2010, 2100, 'Green', None)
+    view.stop = 2.2e-6
+    assert table.events['t2_idx'][5] == 2200
+
+
+def test_channel_matches_events():
+    params = {'amplitude': 500.0, 'pulsewidth': 10e-9, 'SB freq': 0.01, 'IQ scale factor': 1.0, 'phase': 0.0,
+              'skew phase': 0.0, 'num pulses': 1}
+    ch = Channel(ch_type='Wave', pulse_params=params)
+    ch.add_event(time_on=1e-6, time_off=1.02e-6, pulse_type='Gauss', stop_inc=1.0, dt=30e-9)
+    evt = GaussPulse(start=1e-6, stop=1.02e-6, pulse_params=params, stop_inc=1.0, dt=30e-9)
+    view = ch.event_train[0]
+    assert (view.start, view.stop, view.t1_idx, view.t2_idx) == (evt.start, evt.stop, evt.t1_idx, evt.t2_idx)
+    assert np.array_equal(view.data, evt.data)
+    # channels created from event objects copy them into the table
+    markers = Channel(ch_type='S2', event_train=[S2(start=1e-6, stop=1.1e-6), S2(start=2e-6, stop=2.5e-6)])
+    assert list(markers.events['t2_idx']) == [1100, 2500]
+    assert (markers.first_channel_event, markers.latest_channel_event) == (1e-6, 2.5e-6)
+    assert not markers.has_coincident_events()
+
+
+def test_tick_indices():
+    assert to_ticks(1.02e-6) == 1020000 and to_ticks(4.1e-6) == 4100000
+    assert list(ticks_to_samples(np.array([1499, 1500, 2500, 2501]), 1000)) == [1, 2, 2, 3]
+    # the data length is always one more than the last stop index, for every point of a time scan
+    for n in range(8):
+        s = Sequence('S2,0,1.5e-6+t\nGreen,1e-6+t,4e-6+t', timeres=1)
+        s.create_sequence(dt=n * 10e-9)
+        assert len(s.c1markerdata) == 4001 + 10 * n
+
+
+def test_event_index():
+    table = EventTable(1e-9)
+    index = EventIndex(table)
+    for start, stop in ((5000, 6000), (1000, 9000), (3000, 3500), (3400, 4000)):
+        index.insert(table.append(start * 1000, stop * 1000))
+    assert (index.first_start, index.last_start, index.last_stop) == (1000000, 5000000, 9000000)
+    assert index.rows == [1, 2, 3, 0]
+    assert index.starting_between(1000000, 5000000) == [2, 3]
+    assert sorted(index.overlapping(3600000, 4500000)) == [1, 3]
+    assert not index.has_coincident_events()
+    index.insert(table.append(3400200, 3600000))  # starts on the same sample as row 3
+    assert index.has_coincident_events()
+    index.remove(3)
+    assert not index.has_coincident_events()
+    assert index.rows == EventIndex(table, [0, 1, 2, 4]).rows
+
+
+def test_append_train():
+    table = EventTable(1e-9)
+    envs = [np.full((2, 10), n, dtype=np.float32) for n in range(2)]
+    index = EventIndex(table, [table.append(0, 20000, data=envs[1])])
+    rows = table.append_train(30000, 40000, 5, 30000, pulse_type='Square', data=envs)
+    assert list(rows) == [1, 2, 3, 4, 5] and table.add_train(0, 6, 2) == 0
+    assert list(table.events['t1_idx']) == [0, 30, 60, 90, 120, 150]
+    assert list(table.events['envelope']) == [0, 1, 0, 1, 0, 1] and list(table.events['train']) == [0] * 6
+    index.extend(rows)
+    assert index.rows == EventIndex(table, range(6)).rows and index.last_stop == 160000
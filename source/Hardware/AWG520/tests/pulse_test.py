@@ -0,0 +1,139 @@
+# tests for the pulse data generation in Pulse.py
+import os
+import tracemalloc
+import numpy as np
+import pytest
+from source.Hardware.AWG520.Pulse import EnvelopeCache, envelope_cache, ramp_cache, iq_modulation, Gaussian, Gerono, \
+    Sech, Lorentzian, Square, SquareI, SquareQ, LoadWave, shape_file_cache, load_shape_file, _MODULATION_BLOCK, \
+    _SIDECAR_SUFFIX
+from source.Hardware.AWG520.Rasterizer import IntervalTable
+from source.Hardware.AWG520.Sequence import Channel
+
+
+def test_envelope_cache_lru():
+    cache = EnvelopeCache(max_bytes=2 * 8 * 10)  # room for two arrays of 10 float64
+    calls = []
+
+    def make(n):
+        calls.append(n)
+        return np.full(10, float(n))
+    a = cache.get('a', lambda: make(1))
+    assert cache.get('a', lambda: make(2)) is a
+    with pytest.raises(ValueError):
+        a[0] = 5.0  # the shared data is read-only
+    cache.get('b', lambda: make(3))
+    cache.get('c', lambda: make(4))  # evicts 'a'
+    cache.get('a', lambda: make(5))
+    assert calls == [1, 3, 4, 5]
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['entries']) == (1, 4, 2, 2)
+    assert stats['nbytes'] <= stats['max_bytes']
+
+
+def test_pulse_train_shares_envelope():
+    params = {'amplitude': 500.0, 'pulsewidth': 10e-9, 'SB freq': 0.01, 'IQ scale factor': 1.0, 'phase': 0.0,
+              'skew phase': 0.0, 'num pulses': 1}
+    ch = Channel(ch_type='Wave', pulse_params=params, sampletime=1e-9)
+    misses = envelope_cache.stats()['misses']
+    ch.add_event_train(time_on=1e-6, time_off=1.1e-6, separation=20e-9, events_in_train=8, pulse_type='Gauss')
+    assert all(evt.data is ch.event_train[0].data for evt in ch.event_train)
+    assert envelope_cache.stats()['misses'] <= misses + 1  # the pulse of the train is generated once
+
+
+def test_render_into():
+    for pulse in (Gaussian(0, 1000, 0.01, 0.9, 10.0, 50, 500, skew_phase=3.0), SquareI(0, 1000, 0.01, 0.9, 10.0, 500)):
+        pulse.data_generator()
+        expected = np.array((pulse.I_data, pulse.Q_data))
+        assert expected.dtype == np.float32
+        out = np.zeros((2, 3000), dtype=np.float32)
+        pulse.data_generator(out=out[:, 1000:2000])  # straight into a slice of the data of a sequence
+        assert np.shares_memory(pulse.I_data, out) and np.array_equal(out[:, 1000:2000], expected)
+        assert not out[:, :1000].any() and not out[:, 2000:].any()
+    # the modulation only needs float64 temporaries for a block of samples, and rendering copies each envelope into
+    # out without any
+    n = 200000
+    out = np.zeros((2, n), dtype=np.float32)
+    env = np.ones(n, dtype=np.float32)
+    table = IntervalTable(n)
+    table.add_wave_events([0, n // 2], [out[:, :n // 4], out[:, :n // 4]])
+    rendered = np.zeros((2, n), dtype=np.float32)
+    tracemalloc.start()
+    try:
+        iq_modulation(env, 0.01, 0.9, 10.0, 3.0, out=out)
+        assert tracemalloc.get_traced_memory()[1] < 2.5 * 8 * _MODULATION_BLOCK < out.nbytes
+        tracemalloc.reset_peak()
+        kept = tracemalloc.get_traced_memory()[0]  # the phase ramp stays in its cache
+        table.render_waves(rendered)
+        assert tracemalloc.get_traced_memory()[1] - kept < 0.01 * out.nbytes
+    finally:
+        tracemalloc.stop()
+    assert np.array_equal(rendered[:, n // 2:3 * n // 4], out[:, :n // 4])
+
+
+def test_iq_modulation():
+    n = _MODULATION_BLOCK + 1000  # the second block is the cached ramp rotated by the phase of its first sample
+    env = np.linspace(0.0, 0.5, n)
+    x = np.arange(n)
+    for phase, skew_phase in ((0.0, 0.0), (33.0, 3.0)):
+        i_data, q_data = iq_modulation(env, 0.0137, 0.9, phase, skew_phase)
+        assert i_data.dtype == np.float32
+        assert np.allclose(i_data, env * np.cos(2 * np.pi * (0.0137 * x + phase / 360.0)), rtol=0, atol=1e-6)
+        assert np.allclose(q_data, 0.9 * env * np.sin(2 * np.pi * (0.0137 * x + (phase + skew_phase) / 360.0)),
+                           rtol=0, atol=1e-6)
+    assert ramp_cache.stats()['hits'] >= 1  # the second phase reuses the ramp of the first
+
+
+def test_gerono_table():
+    pulse = Gerono(0, 1000, 0.0, 1.0, 0.0, 10, 500.0)
+    l = pulse.build_l(2 * np.pi, 5000)
+    x, y = pulse.gerono_func(pulse.calculate_alpha(np.pi / 2), l)
+    pulse_func, t_of_l_list, kappa = pulse.core_calculation(l, x, y)
+    for width in (3, 1000, 20001):
+        data = Gerono(0, width, 0.0, 1.0, 0.0, 10, 1024.0).envelope(1.0)
+        t = np.linspace(t_of_l_list[0], t_of_l_list[-1], num=width)
+        t[-1] = t_of_l_list[-1]
+        expected = pulse_func(t)
+        assert data.dtype == np.float32 and len(data) == width
+        assert np.allclose(data, expected / np.max(np.abs(expected)), rtol=0, atol=1e-6)
+    assert Gerono(0, 10, 0.0, 1.0, 0.0, 10, 1.0).shape_table() is pulse.shape_table()  # made once for all pulses
+
+
+def test_batch_envelopes():
+    widths = [1, 2, 40, 80, 333, 1000]
+    deviations = [1, 1, 5, 10, 41, 125]
+    amps = [0.1, 0.2, 0.3, 0.5, 0.7, 1.0]
+    for pulsecls in (Gaussian, Sech, Lorentzian, Gerono, Square, SquareI, SquareQ):
+        data, lengths = pulsecls.batch_envelopes(widths, deviations, amps)
+        assert data.shape == (len(widths), max(widths)) and list(lengths) == widths
+        for row, width, deviation, amp in zip(data, widths, deviations, amps):
+            # every row is the same as the envelope of the single pulse, and padded with zeros
+            expected = pulsecls(0, width, 0.0, 1.0, 0.0, deviation, 0.0).envelope(amp)
+            assert np.array_equal(row[:width], expected) and not row[width:].any()
+
+
+def test_shape_file_cache(tmp_path):
+    path = tmp_path / 'shape.txt'
+    rows = np.column_stack((np.arange(400), np.linspace(0.0, 1e-6, 400), np.sin(np.linspace(0.0, np.pi, 400))))
+    np.savetxt(path, rows, delimiter=',')
+    data = load_shape_file(path)
+    stat = os.stat(path)
+    sidecar = tmp_path / 'shape.txt.{0}-{1}{2}'.format(stat.st_mtime_ns, stat.st_size, _SIDECAR_SUFFIX)
+    assert np.allclose(data, rows) and sidecar.exists()
+    shape_file_cache.clear()
+    assert isinstance(load_shape_file(path).base, np.memmap)  # later runs map the sidecar instead of parsing the text
+    pulse = LoadWave(path, 0, 1000, 0.0, 1.0, 0.0, 10, 500.0)
+    tt, column = rows[:, 1].astype(np.float32), rows[:, 2].astype(np.float32)
+    expected = np.interp(np.linspace(tt[0], tt[-1], 1000), tt, column) * pulse.amp / np.amax(column)
+    assert np.array_equal(pulse.envelope(pulse.amp), expected)
+    # a changed file is parsed again
+    rows[:, 2] *= 2
+    np.savetxt(path, rows, delimiter=',')
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10 ** 9))
+    assert np.allclose(load_shape_file(path), rows) and not sidecar.exists()
+    # so is a different file with an older modification time, as left by cp -p or unzip
+    rows = rows[:6]
+    np.savetxt(path, rows, delimiter=',')
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns - 10 ** 9))
+    shape_file_cache.clear()
+    assert np.allclose(load_shape_file(path), rows)
+    assert len(list(tmp_path.glob('*' + _SIDECAR_SUFFIX))) == 1
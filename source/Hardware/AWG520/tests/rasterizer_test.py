@@ -0,0 +1,105 @@
+# tests for the interval table rasterizer used by Sequence.create_sequence
+import numpy as np
+from source.Hardware.AWG520.Rasterizer import IntervalTable, MarkerEdges, interval_indices, roll_intervals, marker_bit
+from source.Hardware.AWG520.Sequence import Sequence
+
+
+def test_interval_indices():
+    idx = interval_indices([2, 10], [3, 2])
+    assert list(idx) == [2, 3, 4, 10, 11]
+
+
+def test_roll_intervals_matches_np_roll():
+    length = 50
+    starts, stops = np.array([0, 10, 45]), np.array([5, 20, 50])
+    ref = np.zeros(length, dtype=np.int8)
+    for a, b in zip(starts, stops):
+        ref[a:b] = 1
+    for shift in (-7, -60, 3):
+        newstarts, newstops = roll_intervals(starts, stops, shift, length)
+        out = np.zeros(length, dtype=np.int8)
+        for a, b in zip(newstarts, newstops):
+            out[a:b] = 1
+        assert np.array_equal(out, np.roll(ref, shift))
+
+
+def test_packed_markers():
+    table = IntervalTable(20)
+    table.add_marker_events(1, [2], [6], marker_bit(1))
+    table.add_marker_events(1, [4], [10], marker_bit(2), delay=2)
+    c1 = table.render_markers(1)
+    assert list(c1[:10]) == [0, 0, 3, 3, 3, 3, 2, 2, 0, 0]
+    assert not table.render_markers(2).any()
+
+
+def test_create_sequence():
+    seq = 'S2,0,1.5e-6\nWave,1e-6,1.1e-6,Square\nGreen,1.1e-6,2e-6\nMeasure,1.1e-6,1.2e-6'
+    s = Sequence(seq, delay=[100e-9, 0], timeres=1)
+    s.create_sequence(dt=0)
+    assert s.wavedata.shape == (2, len(s.c1markerdata))
+    assert np.all(s.wavedata[0, 1000:1100] != 0) and not s.wavedata[0, 1100:].any()
+    assert np.all(s.c1markerdata[1000:1100] == 3)  # S2 and Green (moved 100 ns earlier) overlap here
+    assert np.all(s.c2markerdata[1100:1200] == 2) and s.c2markerdata.sum() == 200
+
+
+def test_rerender_window():
+    seq = 'S2,0,1.5e-6\nWave,1e-6,1.1e-6+t,Square\nGreen,1.2e-6+t,3e-6+t\nMeasure,1.2e-6+t,1.3e-6+t'
+    previous = Sequence(seq, delay=[100e-9, 0], timeres=1)
+    previous.create_sequence(dt=0)
+    s = Sequence(seq, delay=[100e-9, 0], timeres=1)
+    s.create_sequence(dt=20e-9, previous=previous)
+    # the I/Q data up to the Wave pulse, which is longer, is the same, and the data after it is shifted by 20 samples
+    assert s.interval_table.shift_window(previous.interval_table) == (1000, 1120)
+    ref = Sequence(seq, delay=[100e-9, 0], timeres=1)
+    ref.create_sequence(dt=20e-9)
+    assert np.array_equal(s.wavedata, ref.wavedata)
+    assert np.array_equal(s.c1markerdata, ref.c1markerdata) and np.array_equal(s.c2markerdata, ref.c2markerdata)
+    # a different number of events can not be rendered from the previous data
+    other = IntervalTable(previous.interval_table.length)
+    assert other.shift_window(previous.interval_table) is None
+
+
+def test_marker_edges():
+    table = IntervalTable(40)
+    table.add_marker_events(1, [2, 20], [6, 30], marker_bit(1))
+    table.add_marker_events(1, [4, 25], [10, 28], marker_bit(2), delay=2)
+    edges = table.marker_edges(1)
+    # marker 2 is moved 2 samples earlier, so it turns on together with marker 1
+    assert list(edges.positions) == [0, 2, 6, 8, 20, 23, 26, 30] and list(edges.values) == [0, 3, 2, 0, 1, 3, 1, 0]
+    assert np.array_equal(edges.expand(), table.render_markers(1))
+    out = np.full(40, 7, dtype=np.int8)
+    assert np.array_equal(edges.expand(out=out), table.render_markers(1))
+    assert np.array_equal(MarkerEdges.from_array(out).positions, edges.positions)
+
+
+def test_pulse_train():
+    params = {'amplitude': 500.0, 'pulsewidth': 10e-9, 'SB freq': 0.01, 'IQ scale factor': 1.0, 'phase': 10.0,
+              'skew phase': 0.0, 'num pulses': 1}
+    s = Sequence('Wave,1e-6,1.08e-6,Gauss,n=40,sep=1e-7,phases=0;90;0;90;90;0;90;0', pulseparams=params, timeres=1)
+    s.create_sequence(dt=0)
+    assert len(s.events.envelopes) == 2  # one envelope per phase, made once for all the events of the train
+    assert s.train_spans == [(1000, 8 * 180, 5)]
+    table = s.interval_table
+    starts, stops = table.wave_intervals()
+    assert [len(members) for members, period in table.tiles(starts, stops - starts, 0 * starts)] == [5] * 8
+    # the tiled data is the same as copying the envelopes one at a time
+    ref = np.zeros_like(s.wavedata)
+    for start, env in zip(starts, table.envelopes):
+        ref[:, start:start + env.shape[-1]] = env
+    assert np.array_equal(s.wavedata, ref)
+    # each event has the phase of its place in the phase cycle
+    single = Sequence('Wave,1.18e-6,1.26e-6,Gauss,phase=100', pulseparams=params, timeres=1)
+    single.create_sequence(dt=0)
+    assert np.array_equal(s.wavedata[:, 1180:1260], single.wavedata[:, 1180:1260])
+
+
+def test_negative_phase_cycle():
+    params = {'amplitude': 500.0, 'pulsewidth': 10e-9, 'SB freq': 0.01, 'IQ scale factor': 1.0, 'phase': 0.0,
+              'skew phase': 0.0, 'num pulses': 1}
+    seqs = [Sequence('Wave,1e-6,1.08e-6,Gauss,n=4,sep=1e-7,phases=' + cycle, pulseparams=params, timeres=1)
+            for cycle in ('0;-90', '0; 270')]
+    for s in seqs:
+        s.create_sequence(dt=0)
+    # the phases of the cycle are taken modulo 360 degrees like the phase of the events
+    assert np.array_equal(seqs[0].wavedata, seqs[1].wavedata)
+    assert not np.array_equal(seqs[0].wavedata[:, 1000:1080], seqs[0].wavedata[:, 1180:1260])
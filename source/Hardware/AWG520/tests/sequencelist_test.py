@@ -0,0 +1,226 @@
+# tests for building the sequences of a scan with SequenceList
+import gc
+import random
+import tempfile
+import numpy as np
+from source.Hardware.AWG520.Sequence import Sequence, SequenceList, ParsedSequence, register_pulse
+from source.Hardware.AWG520.Pulse import Pulse, envelope_cache
+
+_PARAMS = {'amplitude': 500.0, 'pulsewidth': 10e-9, 'SB freq': 0.01, 'IQ scale factor': 1.0, 'phase': 0.0,
+           'skew phase': 0.0, 'num pulses': 1}
+
+
+def make_seq_list(seq, scanparams, **kwargs):
+    s = SequenceList(seq, pulseparams=_PARAMS.copy(), scanparams=scanparams, timeres=1, compseqnum=1,
+                     paulirandnum=1, **kwargs)
+    s.create_sequence_list()
+    return s
+
+
+def assert_same_sequences(slist, seq, scanparams):
+    """compares each point of the scan with a sequence built directly from the text"""
+    for x, s in zip(slist.scanlist, slist.sequencelist):
+        params = _PARAMS.copy()
+        dt = 0.0
+        if scanparams['type'] == 'time':
+            dt = x
+        elif scanparams['type'] == 'phase':
+            params['phase'] = x
+        elif scanparams['type'] == 'number':
+            params['num pulses'] = int(x)
+        ref = Sequence(seq, pulseparams=params, timeres=1)
+        ref.create_sequence(dt=dt)
+        assert np.array_equal(s.wavedata, ref.wavedata)
+        assert np.array_equal(s.c1markerdata, ref.c1markerdata)
+        assert np.array_equal(s.c2markerdata, ref.c2markerdata)
+
+
+def test_parsed_line():
+    parsed = ParsedSequence('Wave,1e-6,1.1e-6+2t,Gauss,n=3++,phase=90,amp=0.5\nGreen,1e-6,2e-6')
+    line = parsed.lines[0]
+    assert (line.start, line.stop, line.start_increment, line.stop_increment) == (1e-6, 1.1e-6, 0.0, 2.0)
+    params = dict(_PARAMS, **{'num pulses': 5, 'phase': 30.0})
+    assert line.bind(params) == ('Gauss', 0.5, 5, None, 90.0, False, False)
+    assert parsed.lines[1].bind(params)[0:3] == ('Green', 1.0, 1)
+
+
+def test_time_scan():
+    seq = 'S2,0,1.5e-6+t\nWave,1e-6,1e-6+t,Square\nGreen,1e-6+t,4e-6+t\nMeasure,1e-6+t,1.1e-6+t'
+    scan = {'type': 'time', 'start': 10e-9, 'stepsize': 10e-9, 'steps': 3}
+    assert_same_sequences(make_seq_list(seq, scan), seq, scan)
+
+
+def test_time_expressions():
+    parsed = ParsedSequence('S2,1e-6,1.1e-6+2t\nGreen,2e-6-0.5*t+20e-9*n,3e-6+1e-9*2^n')
+    ticks = parsed.time_ticks([0.0, 10e-9, 20e-9])
+    assert ticks[0].tolist() == [[1000000, 1000000, 1000000], [2000000, 2015000, 2030000]]
+    assert ticks[1].tolist() == [[1100000, 1120000, 1140000], [3001000, 3002000, 3004000]]
+    # the index of the point is passed on to each scan point, in order
+    seq = 'S2,0,1.5e-6+t\nGreen,1e-6+t+100e-9*n,2e-6+t+100e-9*n'
+    slist = make_seq_list(seq, {'type': 'time', 'start': 0, 'stepsize': 10e-9, 'steps': 3})
+    for n, s in enumerate(slist.sequencelist):
+        green = np.flatnonzero(s.c1markerdata & 2)
+        assert (green[0], green[-1] + 1) == (1000 + 110 * n, 2000 + 110 * n)
+
+
+def test_incremental_time_scan():
+    seq = 'S2,0,1.5e-6+t\nWave,1e-6,1e-6+t,Gauss\nGreen,1e-6+t,4e-6+t\nMeasure,1e-6+t,1.1e-6+t\nGreen,5e-6,6e-6'
+    scan = {'type': 'time', 'start': 10e-9, 'stepsize': 10e-9, 'steps': 4}
+    assert_same_sequences(make_seq_list(seq, scan, incremental=True), seq, scan)
+
+
+def test_phase_and_number_scan():
+    seq = 'Wave,1e-6,1.02e-6,Square,phase=0++\nWave,1.1e-6,1.2e-6,Gauss,n=1++\nGreen,1.5e-6,2e-6'
+    for scan in ({'type': 'phase', 'start': 0, 'stepsize': 90, 'steps': 3},
+                 {'type': 'number', 'start': 1, 'stepsize': 1, 'steps': 3}):
+        assert_same_sequences(make_seq_list(seq, scan), seq, scan)
+
+
+def test_parallel_build():
+    seq = 'S2,0,1.5e-6+t\nWave,1e-6,1e-6+t,Gauss\nGreen,1e-6+t,4e-6+t\nMeasure,1e-6+t,1.1e-6+t'
+    scan = {'type': 'time', 'start': 10e-9, 'stepsize': 10e-9, 'steps': 4}
+    serial = make_seq_list(seq, scan)
+    parallel = make_seq_list(seq, scan, parallel=True, max_workers=2)
+    assert len(parallel.sequencelist) == len(serial.sequencelist)
+    for s, p in zip(serial.sequencelist, parallel.sequencelist):
+        assert np.array_equal(s.wavedata, p.wavedata)
+        assert np.array_equal(s.c1markerdata, p.c1markerdata)
+        assert np.array_equal(s.c2markerdata, p.c2markerdata)
+        assert s.latest_sequence_event == p.latest_sequence_event
+
+
+def test_parallel_temp_dir(tmp_path, monkeypatch):
+    seq = 'S2,0,1.5e-6+t\nWave,1e-6,1e-6+t,Gauss\nGreen,1e-6+t,4e-6+t\nMeasure,1e-6+t,1.1e-6+t'
+    scan = {'type': 'time', 'start': 10e-9, 'stepsize': 10e-9, 'steps': 4}
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    parallel = make_seq_list(seq, scan, parallel=True, max_workers=2)
+    # the files of the points stay while their sequences map them
+    assert len(list(tmp_path.glob('seqlist_*/*.dat'))) == len(parallel.sequencelist)
+    del parallel
+    gc.collect()
+    assert not list(tmp_path.iterdir())  # the directory goes with the last file
+
+
+def test_parallel_random_scan():
+    seq = 'RandBench,1e-6,1.02e-6,Gauss\nGreen,3e-6,4e-6\nMeasure,3e-6,3.1e-6'
+    scan = {'type': 'random scan', 'start': 2, 'stepsize': 1, 'steps': 3}
+    random.seed(1234)
+    serial = make_seq_list(seq, scan)
+    random.seed(1234)
+    parallel = make_seq_list(seq, scan, parallel=True, max_workers=2)
+    assert parallel.rbscanlengths == serial.rbscanlengths
+    assert parallel.rbinfo_list == serial.rbinfo_list
+    for s, p in zip(serial.sequencelist, parallel.sequencelist):
+        assert np.array_equal(s.wavedata, p.wavedata)
+
+
+
+def test_auto_timeres():
+    seq = 'S2,1e-6,1.1e-6+t\nWave,1e-6,1.1e-6+t,Square\nGreen,2e-6+t,5e-6+t\nMeasure,2e-6+t,2.3e-6+t'
+    scan = {'type': 'time', 'start': 0, 'stepsize': 50e-9, 'steps': 3}
+    params = dict(_PARAMS, **{'SB freq': 0.0})
+    slists = [SequenceList(seq, pulseparams=params.copy(), scanparams=scan, delay=[100e-9, 0.0], compseqnum=1,
+                           paulirandnum=1, auto_timeres=auto) for auto in (False, True)]
+    for slist in slists:
+        slist.create_sequence_list()
+    ref, auto = slists
+    assert auto.timeres == 25  # every edge is on a 50 ns grid
+    for s, r in zip(auto.sequencelist, ref.sequencelist):
+        # holding each sample for 25 ns gives the same output
+        assert np.array_equal(np.repeat(s.c1markerdata, 25)[:len(r.c1markerdata)], r.c1markerdata)
+        assert np.array_equal(np.repeat(s.wavedata, 25, axis=1)[:, :r.wavedata.shape[1]], r.wavedata)
+    # sideband modulation and shaped pulses are only made coarser within the tolerance given
+    assert make_seq_list(seq, scan, auto_timeres=True).timeres == 1
+    seq = 'Wave,1e-6,1.1e-6,Gauss\nGreen,2e-6,5e-6'
+    scan = {'type': 'amplitude', 'start': 500, 'stepsize': 100, 'steps': 2}
+    assert make_seq_list(seq, scan, auto_timeres=True).timeres == 1
+    assert make_seq_list(seq, scan, auto_timeres=True, envelope_tolerance=0.3).timeres > 1
+
+
+def test_batched_scans():
+    seq = 'S2,1e-6,1.02e-6\nWave,1e-6,1.02e-6,Gauss,n=3\nWave,2e-6,2.1e-6,Square,amp=0.5,phase=90\n' \
+          'Wave,3e-6,3.1e-6,SquareQ\nGreen,4e-6,5e-6\nMeasure,4e-6,4.1e-6'
+    for scan in ({'type': 'amplitude', 'start': 0, 'stepsize': 100, 'steps': 4},
+                 {'type': 'phase', 'start': 0, 'stepsize': 45, 'steps': 4},
+                 {'type': 'SB freq', 'start': 0, 'stepsize': 0.005, 'steps': 4}):
+        serial = make_seq_list(seq, scan, delay=[20e-9, 10e-9])
+        batched = make_seq_list(seq, scan, delay=[20e-9, 10e-9], batched=True)
+        assert len(batched.sequencelist) == len(serial.sequencelist) == 4
+        for s, b in zip(serial.sequencelist, batched.sequencelist):
+            assert np.array_equal(s.wavedata, b.wavedata)
+            assert np.array_equal(s.c1markerdata, b.c1markerdata) and np.array_equal(s.c2markerdata, b.c2markerdata)
+
+
+def test_channel_cache():
+    params = dict(_PARAMS, pulsewidth=20e-9)
+    for seq, scan in (('Green,0,3e-6\nMeasure,0,0.3e-6\nS2,4e-6,4.6e-6\nWave,4e-6,4.1e-6,Gauss\nGreen,6e-6,9e-6\n'
+                       'Measure,6e-6,6.3e-6', {'type': 'pulsewidth', 'start': 10e-9, 'stepsize': 5e-9, 'steps': 4}),
+                      # the second Wave pushes the S2 event from the second point on
+                      ('Wave,1e-6,1.02e-6,Square\nWave,2.8e-6+t,2.9e-6+t,Square\nS2,2.95e-6,3e-6\nGreen,4e-6,5e-6',
+                       {'type': 'time', 'start': 0, 'stepsize': 100e-9, 'steps': 3})):
+        cached = SequenceList(seq, pulseparams=params.copy(), scanparams=scan, timeres=1, compseqnum=1,
+                              paulirandnum=1)
+        cached.create_sequence_list()
+        assert cached.channel_cache.hits > 0 and cached.channel_cache.adjusted is not None
+        plain = SequenceList(seq, pulseparams=params.copy(), scanparams=scan, timeres=1, compseqnum=1,
+                             paulirandnum=1)
+        plain.channel_cache = None
+        plain.create_sequence_list()
+        for s, p in zip(cached.sequencelist, plain.sequencelist):
+            assert np.array_equal(s.wavedata, p.wavedata)
+            assert np.array_equal(s.c1markerdata, p.c1markerdata) and np.array_equal(s.c2markerdata, p.c2markerdata)
+            assert s.latest_sequence_event == p.latest_sequence_event
+
+
+def test_coherent_sideband():
+    params = dict(_PARAMS, **{'SB freq': 0.0137, 'IQ scale factor': 0.9, 'skew phase': 3.0})
+    seq = 'Wave,1e-6,1.1e-6,Square\nWave,2e-6+t,2.05e-6+t,Square,phase=90\nWave,3e-6,3.02e-6,SquareI\nGreen,4e-6,5e-6'
+    scan = {'type': 'time', 'start': 0, 'stepsize': 10e-9, 'steps': 3}
+    slist = SequenceList(seq, pulseparams=params, scanparams=scan, timeres=1, compseqnum=1, paulirandnum=1,
+                         coherent_sideband=True, incremental=True)
+    slist.create_sequence_list()
+    amp = 500.0 / 1024
+    for x, s in zip(slist.scanlist, slist.sequencelist):
+        shift = int(round(x * 1e9))
+        # the phase of the sideband is counted from the start of the sequence, not from the start of each pulse
+        for first, last, phase in ((1000, 1100, 0.0), (2000 + shift, 2050 + shift, 90.0)):
+            n = np.arange(first, last)
+            assert np.allclose(s.wavedata[0, first:last], amp * np.cos(2 * np.pi * (0.0137 * n + phase / 360.0)),
+                               rtol=0, atol=1e-6)
+            assert np.allclose(s.wavedata[1, first:last],
+                               0.9 * amp * np.sin(2 * np.pi * (0.0137 * n + (phase + 3.0) / 360.0)), rtol=0, atol=1e-6)
+        # pulses that are not modulated with the sideband are left alone
+        assert np.all(s.wavedata[0, 3000:3020] == np.float32(amp)) and not s.wavedata[1, 3000:3020].any()
+        assert not s.wavedata[:, 1100:2000].any()
+
+
+class Triangle(Pulse):
+    def __init__(self, num, width, ssb_freq, iqscale, phase, deviation, amp, skew_phase=0):
+        super().__init__(num, width, ssb_freq, iqscale, phase, skew_phase)
+        self.amp = amp / 1024.0
+
+    def envelope(self, amp):
+        return np.float32(amp * (1.0 - np.abs(np.linspace(-1.0, 1.0, self.width))))
+
+    def data_generator(self, out=None):
+        self.iq_generator(self.envelope(self.amp), out)
+
+
+def test_prefilled_pulsewidth_scan():
+    register_pulse('Triangle', Triangle)
+    seq = 'Wave,1e-6,1.1e-6,Gauss\nWave,2e-6,2.1e-6,Sech,n=4,phases=0;90\nWave,3e-6,3.05e-6,Triangle,amp=0.5\n' \
+          'Wave,4e-6,4.05e-6,SquareI\nGreen,4.1e-6,5e-6'
+    scan = {'type': 'pulsewidth', 'start': 5e-9, 'stepsize': 5e-9, 'steps': 4}
+    envelope_cache.clear()
+    slist = SequenceList(seq, pulseparams=_PARAMS.copy(), scanparams=scan, timeres=1, compseqnum=1, paulirandnum=1)
+    slist.prepare_scan()
+    assert slist.prefill_waves() > 0
+    misses = envelope_cache.stats()['misses']
+    slist.create_sequence_list()
+    assert envelope_cache.stats()['misses'] == misses  # every pulse of the scan was made by the prefill
+    for x, s in zip(slist.scanlist, slist.sequencelist):
+        envelope_cache.clear()
+        ref = Sequence(seq, pulseparams=dict(_PARAMS, pulsewidth=x), timeres=1)
+        ref.create_sequence()
+        assert np.array_equal(s.wavedata, ref.wavedata)
+        assert s.wavedata[:, 3000:3010].any()  # the registered shape is in the sequence
@@ -0,0 +1,36 @@
+# tests for the memory mapped store of the compiled points of a scan
+import numpy as np
+from source.Hardware.AWG520.AWG520 import AWGFile
+from source.Hardware.AWG520.Sequence import SequenceList
+from source.Hardware.AWG520.Store import WaveformStore
+
+_PARAMS = {'amplitude': 500.0, 'pulsewidth': 10e-9, 'SB freq': 0.01, 'IQ scale factor': 1.0, 'phase': 0.0,
+           'skew phase': 0.0, 'num pulses': 1}
+_SEQ = 'S2,0,1.01e-6+t\nWave,1e-6,1.01e-6+t,Square\nGreen,1.01e-6+t,2e-6+t\nMeasure,1.01e-6+t,1.1e-6+t'
+
+
+def make_scan(**kwargs):
+    scan = {'type': 'time', 'start': 0, 'stepsize': 10e-9, 'steps': 4}
+    return SequenceList(_SEQ, pulseparams=_PARAMS.copy(), scanparams=scan, timeres=1, compseqnum=1, paulirandnum=1,
+                        **kwargs)
+
+
+def test_stored_points(tmp_path):
+    expected = make_scan()
+    expected.create_sequence_list()
+    slist = make_scan(store=WaveformStore(tmp_path / 'store', create=True), incremental=True)
+    slist.create_sequence_list()
+    for s, e in zip(slist.sequencelist, expected.sequencelist):
+        assert isinstance(s.wavedata.base, np.memmap)  # the sequences only hold views of the file
+        assert np.array_equal(s.wavedata, e.wavedata) and np.array_equal(s.c2markerdata, e.c2markerdata)
+    # the store is opened again without compiling anything, and its points are written like any other sequence
+    store = WaveformStore(tmp_path / 'store')
+    assert len(store) == 4 and np.allclose(store.points, expected.points)
+    assert np.array_equal(store.wavedata(2), expected.sequencelist[2].wavedata)
+    assert np.array_equal(np.asarray(store.markers(3, 1)), expected.sequencelist[3].c1markerdata)
+    s = store[1]
+    assert s.latest_sequence_event == expected.sequencelist[1].latest_sequence_event
+    for name, seq in (('stored', s), ('compiled', expected.sequencelist[1])):
+        (tmp_path / name).mkdir()
+        AWGFile(ftype='SEQ', timeres=1, dirpath=tmp_path / name).write_waveform(seq, '2', 1)
+    assert (tmp_path / 'stored' / '2_1.wfm').read_bytes() == (tmp_path / 'compiled' / '2_1.wfm').read_bytes()
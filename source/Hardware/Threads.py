@@ -20,6 +20,7 @@ from PyQt5 import QtCore
 from source.Hardware.AWG520 import AWG520
 from source.Hardware.AWG520.AWG520 import AWGFile
 from source.Hardware.AWG520.Sequence import Sequence,SequenceList
+from source.Hardware.AWG520.Cache import SequenceCache
 from source.Hardware.PTS3200.PTS import PTS
 from source.Hardware.MCL.NanoDrive import MCL_NanoDrive
 from source.common.utils import log_with, create_logger,get_project_root
@@ -83,6 +84,16 @@ class UploadThread(QtCore.QThread):
         self.logger = logging.getLogger('threadlogger.uploadThread')
         self.dirPath = dirPath
         self.awgPath =awgPath
+        # build the scan points of the sequence in a pool of worker processes; off until starting the pool from this
+        # QThread has been tested on the lab PCs, where Windows spawns a new interpreter for each worker
+        self.parallel = False
+        self.stream = True  # write each scan point to disk as soon as it is built instead of keeping them all
+        self.batched = True  # build amplitude, phase and SB freq scans in batches of points
+        self.incremental = True  # render each point of a time scan from the data of the previous point
+        self.compress_idle = False  # play idle stretches and pulse trains as short repeated waveforms
+        self.cache = SequenceCache()  # files of sequences that were uploaded before are copied from here
+        self.rb_seed = None  # set this to repeat the same random scan, which also lets its files be cached
+        self.auto_timeres = False  # if True the coarsest clock rate that gives the same sequence as timeRes is used
         # 2020-07-21: due to random crashes with QT when upload button is pressed , we are now writing the files in
         # the main app, and only using this thread to upload the files to the AWG.
         # -------------------------- uncomment this block if you want to go back ----------------------------
@@ -127,10 +138,20 @@ class UploadThread(QtCore.QThread):
         #     self.scan['type'] = 'no scan' # this tells the SeqList class to simply put one sequence as the PTS will
         #     # scan the frequency
         # now create the sequences
-        self.sequences = SequenceList(sequence=self.seq, delay=delay,pulseparams = self.pulseparams,scanparams = self.scan, timeres=self.timeRes, compseqnum=self.CompSeqNum, paulirandnum=self.PauliRandNum)
+        self.sequences = SequenceList(sequence=self.seq, delay=delay,pulseparams = self.pulseparams,scanparams = self.scan, timeres=self.timeRes, compseqnum=self.CompSeqNum, paulirandnum=self.PauliRandNum,
+                                      parallel=self.parallel, stream=self.stream, rb_seed=self.rb_seed,
+                                      auto_timeres=self.auto_timeres, batched=self.batched,
+                                      incremental=self.incremental)
         # write the files to the AWG520/sequencefiles directory
         self.awgfile = AWGFile(ftype='SEQ',timeres = self.timeRes)
-        self.awgfile.write_sequence(sequences=self.sequences,seqfilename="scan.seq",repeat= samples)
+        # check that the scan fits in the AWG before any waveform is created
+        self.preflight = self.awgfile.preflight(sequences=self.sequences, seqfilename="scan.seq", repeat=samples,
+                                                compress_idle=self.compress_idle)
+        if self.preflight['errors']:
+            self.logger.error('Scan can not be uploaded: {0}'.format('; '.join(self.preflight['errors'])))
+            return
+        self.awgfile.write_sequence(sequences=self.sequences,seqfilename="scan.seq",repeat= samples, cache=self.cache,
+                                    compress_idle=self.compress_idle)
         if scan_random:
             final_states = list(list(zip(*self.sequences.rbinfo_list))[0])
             final_seqs = list(list(zip(*self.sequences.rbinfo_list))[1])